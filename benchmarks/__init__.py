@@ -0,0 +1,3 @@
+"""Performance benchmarks for mailman-api.
+
+See README.rst in this directory."""
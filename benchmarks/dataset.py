@@ -0,0 +1,51 @@
+"""Synthetic lists for the benchmarks.
+
+`generate(lists, members)` creates `lists` lists of `members` members each
+through the MailList API, so the pickles on disk look like ones Mailman
+wrote.  Consecutive lists share half their members, which gives lookups
+by address a realistic handful of lists to return.  Everything is derived
+from the list and member numbers, so scenarios can name existing members
+without reading the lists back."""
+from Mailman import MailList, Utils, UserDesc
+
+DOMAINS = 50
+
+# One in this many members gets digests.
+DIGEST_EVERY = 10
+
+
+def list_name(number):
+    return 'bench%05d' % number
+
+
+def address(number):
+    return 'user%07d@example%02d.com' % (number, number % DOMAINS)
+
+
+def member_numbers(list_number, members):
+    first = list_number * members // 2
+    return xrange(first, first + members)
+
+
+def create_list(name, members):
+    mlist = MailList.MailList()
+    mlist.Create(name, 'admin@example.com', 'password')
+    try:
+        mlist.subscribe_policy = 0
+        for number in members:
+            userdesc = UserDesc.UserDesc(address(number),
+                                         'User %d' % number,
+                                         'password',
+                                         number % DIGEST_EVERY == 0)
+            mlist.ApprovedAddMember(userdesc)
+        mlist.Save()
+    finally:
+        mlist.Unlock()
+
+
+def generate(lists, members):
+    existing = set(Utils.list_names())
+    for list_number in xrange(lists):
+        name = list_name(list_number)
+        if name not in existing:
+            create_list(name, member_numbers(list_number, members))
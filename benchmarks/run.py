@@ -0,0 +1,316 @@
+"""Runs the benchmark scenarios and reports throughput and latency as JSON.
+
+Each dataset size runs in a fresh process with its own stand-in Mailman
+root, so caches, indexes and lock files never leak from one size into the
+next.  Requests go straight to the WSGI application, which leaves the
+HTTP server out of the numbers.
+
+Usage::
+
+    python -m benchmarks.run --sizes 10x100,100x1000 --output report.json
+    python -m benchmarks.run --baseline report.json
+
+With `--baseline`, the run fails if any scenario's p95 latency is more
+than `--tolerance` slower than in the baseline report."""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import tempfile
+import threading
+import subprocess
+from urllib import urlencode
+from StringIO import StringIO
+from optparse import OptionParser
+from wsgiref.util import setup_testing_defaults
+from timeit import default_timer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STANDIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'standin')
+
+PERCENTILES = (50, 90, 95, 99)
+
+SCENARIOS = ['list_lists', 'list_lists_address', 'members', 'members_page',
+             'subscribe', 'unsubscribe']
+
+
+def list_lists(lists, members):
+    while True:
+        yield 'GET', '/', {}, {}
+
+
+def list_lists_address(lists, members):
+    from .dataset import address, member_numbers
+    while True:
+        numbers = member_numbers(random.randrange(lists), members)
+        yield 'GET', '/', {'address': address(random.choice(numbers))}, {}
+
+
+def members(lists, members):
+    from .dataset import list_name
+    while True:
+        name = list_name(random.randrange(lists))
+        yield 'GET', '/%s/members' % name, {}, {}
+
+
+def members_page(lists, members):
+    from .dataset import list_name
+    while True:
+        name = list_name(random.randrange(lists))
+        yield 'GET', '/%s/members' % name, {'limit': 100}, {}
+
+
+def subscribe(lists, members):
+    from .dataset import list_name
+    number = 0
+    while True:
+        yield ('PUT', '/%s/members' % list_name(number % lists), {},
+               {'address': 'new%07d@example.org' % number,
+                'fullname': 'New %d' % number})
+        number += 1
+
+
+def unsubscribe(lists, members):
+    from .dataset import address, list_name, member_numbers
+    for position in xrange(members):
+        for list_number in xrange(lists):
+            number = member_numbers(list_number, members)[position]
+            yield ('DELETE', '/%s/members' % list_name(list_number), {},
+                   {'address': address(number)})
+
+
+def request(application, method, path, query, form):
+    body = urlencode(form)
+    environ = {'REQUEST_METHOD': method,
+               'PATH_INFO': path,
+               'QUERY_STRING': urlencode(query),
+               'REMOTE_ADDR': '127.0.0.1',
+               'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+               'CONTENT_LENGTH': str(len(body)),
+               'wsgi.input': StringIO(body)}
+    setup_testing_defaults(environ)
+    status = []
+
+    def start_response(status_line, headers, exc_info=None):
+        status.append(int(status_line.split()[0]))
+
+    result = application(environ, start_response)
+    try:
+        for chunk in result:
+            pass
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return status[0]
+
+
+def percentile(ordered, pct):
+    if not ordered:
+        return None
+    index = int(round(pct / 100.0 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def run_scenario(application, scenario, lists, members, count, warmup,
+                 concurrency):
+    requests = globals()[scenario](lists, members)
+    for _ in xrange(warmup):
+        try:
+            request(application, *next(requests))
+        except StopIteration:
+            break
+    latencies = []
+    errors = []
+    iterator_lock = threading.Lock()
+
+    def worker():
+        while True:
+            with iterator_lock:
+                if len(latencies) + len(errors) >= count:
+                    return
+                try:
+                    args = next(requests)
+                except StopIteration:
+                    return
+            start = default_timer()
+            try:
+                status = request(application, *args)
+            except Exception:
+                status = None
+            elapsed = default_timer() - start
+            with iterator_lock:
+                if status is not None and status < 400:
+                    latencies.append(elapsed)
+                else:
+                    errors.append(status)
+
+    threads = [threading.Thread(target=worker) for _ in xrange(concurrency)]
+    start = default_timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = default_timer() - start
+
+    latencies.sort()
+    completed = len(latencies) + len(errors)
+    result = {'scenario': scenario,
+              'lists': lists,
+              'members': members,
+              'requests': completed,
+              'errors': len(errors),
+              'seconds': wall,
+              'throughput': completed / wall if wall else None,
+              'latency_ms': {}}
+    if latencies:
+        result['latency_ms']['mean'] = \
+            sum(latencies) / len(latencies) * 1000
+        for pct in PERCENTILES:
+            result['latency_ms']['p%d' % pct] = \
+                percentile(latencies, pct) * 1000
+        result['latency_ms']['max'] = latencies[-1] * 1000
+    return result
+
+
+def run_size(opts):
+    """Runs every scenario against one dataset size in this process."""
+    sys.path[:0] = [STANDIN, ROOT]
+    from .dataset import generate
+    from mailmanapi import index
+    from mailmanapi.routes import get_application
+
+    index.READ_MODEL = opts.read_model
+
+    random.seed(opts.seed)
+    start = default_timer()
+    generate(opts.lists, opts.members)
+    generated = default_timer() - start
+
+    application = get_application()
+    results = []
+    for scenario in opts.scenarios.split(','):
+        result = run_scenario(application, scenario, opts.lists,
+                              opts.members, opts.requests, opts.warmup,
+                              opts.concurrency)
+        result['generate_seconds'] = generated
+        results.append(result)
+    return results
+
+
+def spawn_size(opts, lists, members):
+    root = tempfile.mkdtemp(prefix='mailman-api-bench-')
+    env = dict(os.environ, MAILMAN_STANDIN_ROOT=root)
+    try:
+        command = [sys.executable, '-m', 'benchmarks.run', '--child',
+                   '--lists', str(lists), '--members', str(members),
+                   '--scenarios', opts.scenarios,
+                   '--requests', str(opts.requests),
+                   '--warmup', str(opts.warmup),
+                   '--concurrency', str(opts.concurrency),
+                   '--seed', str(opts.seed)]
+        if opts.read_model:
+            command += ['--read-model', opts.read_model]
+        output = subprocess.check_output(command, cwd=ROOT, env=env)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return json.loads(output)
+
+
+def regressions(report, baseline, tolerance):
+    previous = dict(((r['scenario'], r['lists'], r['members']), r)
+                    for r in baseline['results'])
+    found = []
+    for result in report['results']:
+        key = (result['scenario'], result['lists'], result['members'])
+        old = previous.get(key)
+        if not old or 'p95' not in old['latency_ms'] or \
+                'p95' not in result['latency_ms']:
+            continue
+        if result['latency_ms']['p95'] > \
+                old['latency_ms']['p95'] * (1 + tolerance):
+            found.append('%s at %dx%d: p95 %.2fms, was %.2fms' % (
+                key + (result['latency_ms']['p95'],
+                       old['latency_ms']['p95'])))
+    return found
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--sizes', dest='sizes', default='10x100,10x1000,'
+                      '100x1000',
+                      help=('Comma separated dataset sizes, as '
+                            '<lists>x<members>. Default: %default'))
+    parser.add_option('--scenarios', dest='scenarios',
+                      default=','.join(SCENARIOS),
+                      help='Comma separated scenarios. Default: %default')
+    parser.add_option('--requests', dest='requests', type='int',
+                      default=200,
+                      help=('Timed requests per scenario and size. '
+                            'Default: %default'))
+    parser.add_option('--warmup', dest='warmup', type='int', default=10,
+                      help=('Untimed requests before each scenario. '
+                            'Default: %default'))
+    parser.add_option('--concurrency', dest='concurrency', type='int',
+                      default=1,
+                      help=('Threads sending requests. '
+                            'Default: %default'))
+    parser.add_option('--seed', dest='seed', type='int', default=1,
+                      help='Random seed. Default: %default')
+    parser.add_option('--read-model', dest='read_model',
+                      choices=['consistent', 'stale'],
+                      help='Serve reads from the index in this mode.')
+    parser.add_option('--output', dest='output',
+                      help='Write the report here instead of stdout.')
+    parser.add_option('--baseline', dest='baseline',
+                      help='Compare p95 latencies with this report.')
+    parser.add_option('--tolerance', dest='tolerance', type='float',
+                      default=0.2,
+                      help=('Allowed p95 slowdown against the baseline. '
+                            'Default: %default'))
+    parser.add_option('--child', dest='child', action='store_true',
+                      help='Internal: run a single size in this process.')
+    parser.add_option('--lists', dest='lists', type='int')
+    parser.add_option('--members', dest='members', type='int')
+    opts, args = parser.parse_args()
+
+    for scenario in opts.scenarios.split(','):
+        if scenario not in SCENARIOS:
+            parser.error('unknown scenario: %s' % scenario)
+
+    if opts.child:
+        json.dump(run_size(opts), sys.stdout)
+        return
+
+    from mailmanapi import __version__
+    report = {'version': __version__,
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'date': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+              'concurrency': opts.concurrency,
+              'read_model': opts.read_model,
+              'results': []}
+    for size in opts.sizes.split(','):
+        lists, members = [int(n) for n in size.split('x')]
+        report['results'].extend(spawn_size(opts, lists, members))
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if opts.output:
+        with open(opts.output, 'w') as fp:
+            fp.write(output + '\n')
+    else:
+        print output
+
+    if opts.baseline:
+        with open(opts.baseline) as fp:
+            found = regressions(report, json.load(fp), opts.tolerance)
+        for line in found:
+            sys.stderr.write('Regression: %s\n' % line)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
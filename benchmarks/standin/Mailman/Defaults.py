@@ -0,0 +1 @@
+MAILMAN_SITE_LIST = 'mailman'
@@ -0,0 +1,54 @@
+class MailmanError(Exception):
+    pass
+
+
+class MMListError(MailmanError):
+    pass
+
+
+class MMUnknownListError(MMListError):
+    pass
+
+
+class MMListAlreadyExistsError(MMListError):
+    pass
+
+
+class BadListNameError(MMListError):
+    pass
+
+
+class MemberError(MailmanError):
+    pass
+
+
+class MMBadEmailError(MemberError):
+    pass
+
+
+class MMHostileAddress(MMBadEmailError):
+    pass
+
+
+class MMAlreadyAMember(MemberError):
+    pass
+
+
+class NotAMemberError(MemberError):
+    pass
+
+
+class MembershipIsBanned(MemberError):
+    pass
+
+
+class MMSubscribeNeedsConfirmation(MemberError):
+    pass
+
+
+class MMNeedApproval(MemberError):
+    pass
+
+
+class MissingInformation(MailmanError):
+    pass
@@ -0,0 +1,57 @@
+import os
+import time
+
+
+class LockError(Exception):
+    pass
+
+
+class AlreadyLockedError(LockError):
+    pass
+
+
+class NotLockedError(LockError):
+    pass
+
+
+class TimeOutError(LockError):
+    pass
+
+
+class LockFile(object):
+    """Exclusive-create lock file; `timeout` of 0 waits forever."""
+
+    def __init__(self, lockfile, lifetime=15, withlogging=False):
+        self._lockfile = lockfile
+        self._owned = False
+
+    def lock(self, timeout=0):
+        if self._owned:
+            raise AlreadyLockedError(self._lockfile)
+        deadline = time.time() + timeout if timeout else None
+        while True:
+            try:
+                fd = os.open(self._lockfile,
+                             os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError:
+                if deadline is not None and time.time() > deadline:
+                    raise TimeOutError(self._lockfile)
+                time.sleep(0.001)
+                continue
+            os.close(fd)
+            self._owned = True
+            return
+
+    def refresh(self, newlifetime=None, unconditionally=False):
+        if not self._owned and not unconditionally:
+            raise NotLockedError(self._lockfile)
+
+    def unlock(self, unconditionally=False):
+        if not self._owned and not unconditionally:
+            raise NotLockedError(self._lockfile)
+        if self._owned:
+            os.unlink(self._lockfile)
+            self._owned = False
+
+    def locked(self):
+        return self._owned
@@ -0,0 +1,237 @@
+import os
+import re
+import time
+import cPickle
+
+from Mailman import mm_cfg, Errors, Utils, LockFile
+from Mailman.MemberAdaptor import ENABLED
+
+_LISTNAME = re.compile(r'^[-+_.=a-z0-9]+$')
+
+
+class MailList(object):
+    """Pickle-backed stand-in for Mailman 2.1's MailList.
+
+    Loading, locking and saving follow the original closely enough that
+    the cost profile (one unpickle per load, one full rewrite per Save)
+    is the same."""
+
+    def __init__(self, name=None, lock=True):
+        self._internal_name = name
+        self._timestamp = 0
+        if name:
+            self._internal_name = name.lower()
+        self._lock = self._make_lock()
+        if name:
+            if lock:
+                self.Lock()
+            else:
+                self.Load()
+
+    def _make_lock(self):
+        if not os.path.isdir(mm_cfg.LOCK_DIR):
+            try:
+                os.makedirs(mm_cfg.LOCK_DIR)
+            except OSError:
+                pass
+        return LockFile.LockFile(
+            os.path.join(mm_cfg.LOCK_DIR,
+                         (self._internal_name or '<site>') + '.lock'))
+
+    def internal_name(self):
+        return self._internal_name
+
+    def fullpath(self):
+        return os.path.join(mm_cfg.LIST_DATA_DIR, self._internal_name)
+
+    # Locking and persistence
+
+    def Lock(self, timeout=0):
+        self._lock.lock(timeout)
+        try:
+            self.Load()
+        except Exception:
+            self.Unlock()
+            raise
+
+    def Unlock(self):
+        self._lock.unlock(unconditionally=True)
+
+    def Locked(self):
+        return self._lock.locked()
+
+    def Load(self, check_version=True):
+        if not Utils.list_exists(self._internal_name):
+            raise Errors.MMUnknownListError
+        pfile = os.path.join(self.fullpath(), 'config.pck')
+        mtime = os.path.getmtime(pfile)
+        if mtime <= self._timestamp:
+            return
+        fp = open(pfile, 'rb')
+        try:
+            data = cPickle.load(fp)
+        finally:
+            fp.close()
+        self._timestamp = mtime
+        self.__dict__.update(data)
+
+    def Save(self):
+        self._lock.refresh()
+        data = {}
+        for key, value in self.__dict__.items():
+            if key[0] == '_':
+                continue
+            data[key] = value
+        pfile = os.path.join(self.fullpath(), 'config.pck')
+        tmpfile = '%s.tmp.%d' % (pfile, os.getpid())
+        fp = open(tmpfile, 'wb')
+        try:
+            cPickle.dump(data, fp, 1)
+            fp.flush()
+            os.fsync(fp.fileno())
+        finally:
+            fp.close()
+        if os.path.exists(pfile):
+            try:
+                os.unlink(pfile + '.last')
+            except OSError:
+                pass
+            os.link(pfile, pfile + '.last')
+        os.rename(tmpfile, pfile)
+        self._timestamp = os.path.getmtime(pfile)
+
+    def Create(self, name, admin, crypted_password, langs=None,
+               emailhost=None, urlhost=None):
+        assert name == name.lower(), 'List name must be all lower case.'
+        if not _LISTNAME.match(name):
+            raise Errors.BadListNameError(name)
+        if Utils.list_exists(name):
+            raise Errors.MMListAlreadyExistsError(name)
+        Utils.ValidateEmail(admin)
+        self._internal_name = name
+        self._lock = self._make_lock()
+        self._lock.lock()
+        if not os.path.isdir(self.fullpath()):
+            os.makedirs(self.fullpath())
+        self.InitVars(name, admin, crypted_password, emailhost, urlhost)
+
+    def InitVars(self, name, admin, crypted_password, emailhost=None,
+                 urlhost=None):
+        self.real_name = name[0].upper() + name[1:]
+        self.description = ''
+        self.created_at = time.time()
+        self.subscribe_policy = 1
+        self.archive_private = 0
+        self.owner = [admin]
+        self.password = crypted_password
+        self.host_name = emailhost or mm_cfg.DEFAULT_EMAIL_HOST
+        self.web_page_url = 'http://%s/mailman/' % (
+            urlhost or mm_cfg.DEFAULT_URL_HOST)
+        self.preferred_language = 'en'
+        self.next_request_id = 1
+        self.ban_list = []
+        self.members = {}
+        self.digest_members = {}
+        self.passwords = {}
+        self.user_options = {}
+        self.language = {}
+        self.usernames = {}
+        self.topics_userinterest = {}
+        self.bounce_info = {}
+        self.delivery_status = {}
+
+    def GetScriptURL(self, scriptname, absolute=0):
+        return '%s%s/%s' % (self.web_page_url, scriptname,
+                            self._internal_name)
+
+    def GetListEmail(self):
+        return '%s@%s' % (self._internal_name, self.host_name)
+
+    def GetRequestEmail(self, cookie=''):
+        return '%s-request@%s' % (self._internal_name, self.host_name)
+
+    # Membership (OldStyleMemberships semantics)
+
+    def getMembers(self):
+        return self.members.keys() + self.digest_members.keys()
+
+    def getRegularMemberKeys(self):
+        return self.members.keys()
+
+    def getDigestMemberKeys(self):
+        return self.digest_members.keys()
+
+    def isMember(self, member):
+        lcmember = member.lower()
+        return lcmember in self.members or lcmember in self.digest_members
+
+    def getMemberKey(self, member):
+        if not self.isMember(member):
+            raise Errors.NotAMemberError(member)
+        return member.lower()
+
+    def getMemberCPAddress(self, member):
+        key = self.getMemberKey(member)
+        cpaddr = self.members.get(key, self.digest_members.get(key))
+        return cpaddr or key
+
+    def getMemberName(self, member):
+        return self.usernames.get(self.getMemberKey(member))
+
+    def getMemberLanguage(self, member):
+        return self.language.get(self.getMemberKey(member),
+                                 self.preferred_language)
+
+    def getDeliveryStatus(self, member):
+        key = self.getMemberKey(member)
+        return self.delivery_status.get(key, (ENABLED, 0))[0]
+
+    def setMemberLanguage(self, member, language):
+        self.language[self.getMemberKey(member)] = language
+
+    def setDeliveryStatus(self, member, status):
+        key = self.getMemberKey(member)
+        if status == ENABLED:
+            self.delivery_status.pop(key, None)
+        else:
+            self.delivery_status[key] = (status, time.time())
+
+    def AddMember(self, userdesc, remote=None):
+        email = userdesc.address
+        Utils.ValidateEmail(email)
+        if email.lower() in self.ban_list:
+            raise Errors.MembershipIsBanned(email)
+        if self.isMember(email):
+            raise Errors.MMAlreadyAMember(email)
+        if self.subscribe_policy == 0:
+            self.ApprovedAddMember(userdesc)
+        elif self.subscribe_policy == 2:
+            self.next_request_id += 1
+            raise Errors.MMNeedApproval(
+                'subscriptions to %s require moderator approval'
+                % self.real_name)
+        else:
+            raise Errors.MMSubscribeNeedsConfirmation
+
+    def ApprovedAddMember(self, userdesc, ack=None, admin_notif=None,
+                          text='', whence=''):
+        email = userdesc.address
+        if self.isMember(email):
+            raise Errors.MMAlreadyAMember(email)
+        key = email.lower()
+        cpaddr = 0 if key == email else email
+        if userdesc.digest:
+            self.digest_members[key] = cpaddr
+        else:
+            self.members[key] = cpaddr
+        if userdesc.fullname:
+            self.usernames[key] = userdesc.fullname
+        self.language[key] = userdesc.language or self.preferred_language
+        self.passwords[key] = userdesc.password or ''
+
+    def ApprovedDeleteMember(self, name, whence=None, admin_notif=None,
+                             userack=None):
+        key = self.getMemberKey(name)
+        for attr in ('members', 'digest_members', 'usernames', 'language',
+                     'passwords', 'user_options', 'delivery_status'):
+            getattr(self, attr).pop(key, None)
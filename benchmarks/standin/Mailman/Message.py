@@ -0,0 +1,24 @@
+import os
+import time
+
+from Mailman import mm_cfg
+
+
+class UserNotification(object):
+    def __init__(self, recip, sender, subject=None, text=None, lang=None):
+        self.recip = recip
+        self.sender = sender
+        self.subject = subject
+        self.text = text
+
+    def send(self, mlist, **_kws):
+        queue = os.path.join(mm_cfg.QUEUE_DIR, 'virgin')
+        if not os.path.isdir(queue):
+            os.makedirs(queue)
+        name = '%f-%d.msg' % (time.time(), os.getpid())
+        fp = open(os.path.join(queue, name), 'w')
+        try:
+            fp.write('To: %s\nFrom: %s\nSubject: %s\n\n%s' % (
+                self.recip, self.sender, self.subject, self.text))
+        finally:
+            fp.close()
@@ -0,0 +1,8 @@
+class UserDesc(object):
+    def __init__(self, address=None, fullname=None, password=None,
+                 digest=None, lang=None):
+        self.address = address
+        self.fullname = fullname
+        self.password = password
+        self.digest = digest
+        self.language = lang
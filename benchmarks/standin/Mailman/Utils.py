@@ -0,0 +1,38 @@
+import os
+import re
+import hashlib
+
+from Mailman import mm_cfg, Errors
+
+sha_new = hashlib.sha1
+
+_BADCHARS = re.compile(r'[][()<>|;^,\000-\037\177-\377]')
+
+
+def list_exists(listname):
+    path = os.path.join(mm_cfg.LIST_DATA_DIR, listname.lower(), 'config.pck')
+    return os.path.exists(path)
+
+
+def list_names():
+    try:
+        names = os.listdir(mm_cfg.LIST_DATA_DIR)
+    except OSError:
+        return []
+    return [name for name in names if list_exists(name)]
+
+
+def ValidateEmail(s):
+    if not s or ' ' in s:
+        raise Errors.MMBadEmailError(s)
+    if _BADCHARS.search(s) or s[0] == '-':
+        raise Errors.MMHostileAddress(s)
+    user, sep, domain = s.partition('@')
+    if not user or not sep or '.' not in domain:
+        raise Errors.MMBadEmailError(s)
+
+
+def maketext(templatefile, dict=None, raw=False, lang=None, mlist=None):
+    dict = dict or {}
+    return '%s\n\n%s\n' % (templatefile, '\n'.join(
+        '%s: %s' % item for item in sorted(dict.items())))
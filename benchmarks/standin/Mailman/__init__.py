@@ -0,0 +1,5 @@
+"""A small stand-in for the parts of Mailman 2.1 that mailman-api uses.
+
+Lists are pickled to `config.pck` under `mm_cfg.LIST_DATA_DIR` and locked
+with lock files, the way Mailman does it, so loading, locking and saving a
+list cost roughly what they cost on a real installation."""
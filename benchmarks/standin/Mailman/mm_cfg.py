@@ -0,0 +1,15 @@
+"""Site configuration for the stand-in.
+
+Everything lives under `$MAILMAN_STANDIN_ROOT`, so a benchmark run never
+touches a real Mailman installation."""
+import os
+import tempfile
+
+VAR_PREFIX = os.environ.get('MAILMAN_STANDIN_ROOT') or \
+    os.path.join(tempfile.gettempdir(), 'mailman-standin')
+LIST_DATA_DIR = os.path.join(VAR_PREFIX, 'lists')
+LOCK_DIR = os.path.join(VAR_PREFIX, 'locks')
+DATA_DIR = os.path.join(VAR_PREFIX, 'data')
+QUEUE_DIR = os.path.join(VAR_PREFIX, 'qfiles')
+DEFAULT_EMAIL_HOST = 'lists.example.com'
+DEFAULT_URL_HOST = 'lists.example.com'
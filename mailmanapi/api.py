@@ -1,8 +1,20 @@
 import os
+import csv
 import json
-import shutil
+import bisect
+import itertools
+from . import cache, coalesce, index, jobs, metrics, outbox, search, \
+              utils
 from .utils import parse_boolean, \
                    get_mailinglist, \
+                   get_config_stamp, \
+                   list_etag, \
+                   aggregate_etag, \
+                   conditional, \
+                   json_response, \
+                   message_response, \
+                   stream_response, \
+                   csv_response, \
                    get_error_code, \
                    get_error_message
 from Mailman import Errors, \
@@ -13,13 +25,106 @@ from Mailman import Errors, \
                     Message, \
                     i18n, \
                     mm_cfg
-from bottle import HTTPResponse, \
-                   request
+from bottle import HTTPResponse, request
 
 _ = i18n._
 
 CWD = os.path.abspath(os.path.dirname(__file__))
 
+# Rows `POST /<listname>/members/import` subscribes under each lock.
+IMPORT_CHUNK_SIZE = 1000
+
+# Failed rows an import reports individually.
+IMPORT_MAX_ERRORS = 100
+
+# Columns of `GET /_export?format=csv`; each record fills those it has.
+EXPORT_COLUMNS = ('record', 'listname', 'real_name', 'description',
+                  'member_count', 'created', 'subscribe_policy',
+                  'archive_private', 'owner', 'address', 'fullname',
+                  'digest', 'delivery_status', 'language')
+
+LIST_FIELDS = ('listname', 'real_name', 'description', 'member_count',
+               'created', 'subscribe_policy', 'archive_private', 'owner')
+
+# Fields returned by `GET /?summary=true`.
+SUMMARY_FIELDS = ('listname', 'real_name', 'description')
+
+# How to get each field but `listname` from a MailList.
+_LIST_ATTRIBUTES = {
+    'real_name': lambda mlist: mlist.real_name,
+    'description': lambda mlist: mlist.description,
+    'member_count': cache.get_member_count,
+    'created': lambda mlist: mlist.created_at,
+    'subscribe_policy': lambda mlist: mlist.subscribe_policy,
+    'archive_private': lambda mlist: mlist.archive_private,
+    'owner': lambda mlist: mlist.owner,
+}
+
+
+def _parse_flag(value):
+    # Like parse_boolean, but also takes 1.  Only for flags that didn't
+    # exist before, as `delete_archives=1` and `digest=1` have always
+    # meant false.
+    return value == '1' or parse_boolean(value)
+
+
+def _list_values(listname, mlist, fields=LIST_FIELDS):
+    list_values = {'listname': listname}
+    for field in fields:
+        if field != 'listname':
+            list_values[field] = _LIST_ATTRIBUTES[field](mlist)
+    return list_values
+
+
+def _requested_fields():
+    """Returns the list fields asked for with the `fields` or `summary`
+    query parameters; raises ValueError for unknown fields."""
+    if parse_boolean(request.query.get('summary')):
+        return SUMMARY_FIELDS
+    fields = request.query.get('fields')
+    if not fields:
+        return LIST_FIELDS
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    for field in fields:
+        if field not in LIST_FIELDS:
+            raise ValueError('unknown field: ' + field)
+    if 'listname' not in fields:
+        fields.insert(0, 'listname')
+    return fields
+
+
+def _list_headers(listname):
+    """Returns the conditional GET headers for a response built from
+    `listname`, or raises a 304 response."""
+    if index.READ_MODEL == 'stale':
+        # Validators must match what the index will answer with.
+        stamp = index.get_stamp(listname)
+    else:
+        stamp = get_config_stamp(listname)
+    if stamp is None:
+        return {}
+    return conditional(list_etag(stamp), stamp[1])
+
+
+def _all_lists_headers():
+    """Returns the conditional GET headers for a response built from all
+    lists, or raises a 304 response."""
+    if index.READ_MODEL == 'stale':
+        stamps = index.get_stamps()
+    else:
+        stamps = {}
+        for listname in Utils.list_names():
+            stamp = get_config_stamp(listname)
+            if stamp is not None:
+                stamps[listname] = stamp
+    # Deleting a list changes the lists directory, not any config.pck.
+    try:
+        mtimes = [os.stat(mm_cfg.LIST_DATA_DIR).st_mtime]
+    except OSError:
+        mtimes = [0]
+    mtimes.extend(stamp[1] for stamp in stamps.values())
+    return conditional(aggregate_etag(stamps), max(mtimes))
+
 
 def list_lists():
     """Lists existing mailing lists on the server.
@@ -31,36 +136,60 @@ def list_lists():
     Returns a list of dictionaries containing the basic attributes for
     each mailing list that exist on this server.
 
+    The response has `ETag` and `Last-Modified` headers, and requests
+    with matching `If-None-Match` or `If-Modified-Since` headers get an
+    empty 304 response.
+
     **Parameters**:
-      * `address` (optional): email address to search for in lists."""
+      * `address` (optional): email address to search for in lists.
+      * `fields` (optional): comma separated attributes to return for
+        each list, out of `listname`, `real_name`, `description`,
+        `member_count`, `created`, `subscribe_policy`, `archive_private`
+        and `owner`. `listname` is always returned. Default: all of them.
+      * `summary` (optional): if this equals `true`, return only
+        `listname`, `real_name` and `description`."""
 
-    all_lists = Utils.list_names()
     lists = []
+    try:
+        fields = _requested_fields()
+    except ValueError, e:
+        message = 'Invalid parameters: ' + str(e)
+        return message_response(message, get_error_code('InvalidParams'))
+    headers = _all_lists_headers()
 
     address = request.query.get('address')
+    if index.READ_MODEL:
+        for list_values in index.get_lists(address):
+            if list_values['listname'] != Defaults.MAILMAN_SITE_LIST:
+                lists.append(dict((field, list_values[field])
+                                  for field in fields))
+        all_lists = []
+    elif address:
+        all_lists = index.lists_for_address(address)
+    else:
+        all_lists = Utils.list_names()
     for listname in all_lists:
         if listname == Defaults.MAILMAN_SITE_LIST:
             continue
 
-        mlist = get_mailinglist(listname, lock=False)
+        if not address and list(fields) == ['listname']:
+            # Nothing to load the list for.
+            lists.append({'listname': listname})
+            continue
 
-        members = mlist.getMembers()
-        if not address or address in members:
-            list_values = {
-                'listname': listname,
-                'real_name': mlist.real_name,
-                'description': mlist.description,
-                'member_count': len(mlist.getMembers()),
-                'created': mlist.created_at,
-                'subscribe_policy': mlist.subscribe_policy,
-                'archive_private': mlist.archive_private,
-                'owner': mlist.owner
-            }
+        try:
+            mlist = cache.get_list(listname)
+        except HTTPResponse:
+            # Deleted outside the API since the index or the names were
+            # read.
+            continue
 
-            lists.append(list_values)
+        # The index may lag behind changes made outside the API for up to
+        # index.REFRESH_INTERVAL seconds; don't report stale memberships.
+        if not address or mlist.isMember(address):
+            lists.append(_list_values(listname, mlist, fields))
 
-    return HTTPResponse(body=json.dumps(lists),
-                        content_type='application/json')
+    return json_response(lists, **headers)
 
 
 def list_attr(listname):
@@ -71,30 +200,162 @@ def list_attr(listname):
     **URI**: /<listname>
 
     Returns a dictionary containing the basic attributes for
-    a specific mailing list that exist on this server."""
+    a specific mailing list that exist on this server.
+
+    Supports conditional requests like `GET /`; the validators change
+    whenever the list does."""
 
     lists = []
+    headers = _list_headers(listname)
+
+    if index.READ_MODEL:
+        list_values = index.get_list(listname)
+        if list_values is None:
+            return _unknown_list(listname)
+        list_values['listname'] = listname
+        lists.append(list_values)
+        return json_response(lists, **headers)
+
+    mlist = cache.get_list(listname)
+    lists.append(_list_values(listname, mlist))
+    return json_response(lists, **headers)
 
+
+def _unknown_list(listname):
+    message = get_error_message('MMUnknownListError') + ': ' + listname
+    return message_response(message, get_error_code('MMUnknownListError'))
+
+
+def _subscribe_member(mutation, address, fullname=None, digest=False):
+    """Subscribes `address` to the list of `mutation`, a
+    `utils.ListMutation`, returning the (status_code, message) pair the
+    API reports for the outcome."""
+    userdesc = UserDesc.UserDesc(address, fullname, digest=digest)
+    try:
+        with metrics.phase('mutation'):
+            mutation.mlist.AddMember(userdesc)
+    except (Errors.MMSubscribeNeedsConfirmation,
+            Errors.MMNeedApproval), e:
+        # Held for the user or a moderator, which changes the list too.
+        mutation.changed()
+        return (get_error_code(e.__class__.__name__),
+                _subscribe_error_message(e))
+    except (Errors.MMAlreadyAMember,
+            Errors.MembershipIsBanned,
+            Errors.MMBadEmailError,
+            Errors.MMHostileAddress), e:
+        return (get_error_code(e.__class__.__name__),
+                _subscribe_error_message(e))
+    mutation.changed()
+    return 200, 'Success'
+
+
+def _subscribe_error_message(e):
+    class_name = e.__class__.__name__
+    # Don't append error string for MMSubscribeNeedsConfirmation exception.
+    if class_name == 'MMSubscribeNeedsConfirmation':
+        return get_error_message(class_name)
+    return get_error_message(class_name) + ': ' + str(e)
+
+
+def _unsubscribe_member(mutation, address):
+    """Unsubscribes `address` from the list of `mutation`, a
+    `utils.ListMutation`, returning the (status_code, message) pair the
+    API reports for the outcome."""
     try:
-        mlist = get_mailinglist(listname, lock=False)
-    except Errors.MMUnknownListError, e:
+        with metrics.phase('mutation'):
+            mutation.mlist.ApprovedDeleteMember(address, admin_notif=False,
+                                                userack=True)
+    except Errors.NotAMemberError, e:
         message = get_error_message(e.__class__.__name__) + ': ' + str(e)
-        return HTTPResponse(status=get_error_code(e.__class__.__name__),
-                            body=json.dumps({'message': message}),
-                            content_type='application/json')
-    list_values = {
-        'listname': listname,
-        'real_name': mlist.real_name,
-        'description': mlist.description,
-        'member_count': len(mlist.getMembers()),
-        'created': mlist.created_at,
-        'subscribe_policy': mlist.subscribe_policy,
-        'archive_private': mlist.archive_private,
-        'owner': mlist.owner
-    }
-    lists.append(list_values)
-    return HTTPResponse(body=json.dumps(lists),
-                        content_type='application/json')
+        return get_error_code(e.__class__.__name__), message
+    mutation.changed()
+    return 200, 'Success'
+
+
+def _parse_batch(body, content_type):
+    """Parses a batch request body into a list of dictionaries with
+    `address`, `fullname` and `digest` keys.
+
+    The body is either a JSON array or, for `application/x-ndjson`, one
+    JSON value per line; each value is an address string or an object
+    with the same fields as the single-member endpoints take."""
+    if content_type.split(';')[0].strip() == 'application/x-ndjson':
+        items = [json.loads(line) for line in body.splitlines()
+                 if line.strip()]
+    else:
+        items = json.loads(body)
+        if not isinstance(items, list):
+            raise ValueError('expected a JSON array')
+    return [_batch_entry(item) for item in items]
+
+
+def _batch_entry(item):
+    # Normalizes one element of a batch or import body.
+    if isinstance(item, basestring):
+        item = {'address': item}
+    elif not isinstance(item, dict):
+        raise ValueError('expected an address or an object')
+    for field in ('address', 'fullname'):
+        if not isinstance(item.get(field), (basestring, type(None))):
+            raise ValueError('%s must be a string' % field)
+    digest = item.get('digest')
+    if isinstance(digest, basestring):
+        digest = parse_boolean(digest)
+    elif not isinstance(digest, (bool, int, type(None))):
+        raise ValueError('digest must be a boolean')
+    return {'address': item.get('address'),
+            'fullname': item.get('fullname'),
+            'digest': bool(digest)}
+
+
+def _apply_changes(listname, changes):
+    """Applies membership `changes` to `listname` under a single lock and
+    a single Save(), returning a (status_code, message) pair for each.
+
+    Each change is a dictionary with an `operation` of `subscribe` or
+    `unsubscribe` and the `address`, `fullname` and `digest` fields.  The
+    list is only saved if at least one of them changed it."""
+    results = []
+    membership = {}
+    with utils.mutate_list(listname) as mutation:
+        stamp = get_config_stamp(listname)
+        mutation.on_save(lambda: index.record_changes(
+            listname, stamp,
+            added=[(a, change['fullname'], change['digest'])
+                   for a, change in membership.items() if change],
+            removed=[a for a, change in membership.items() if not change]))
+        for change in changes:
+            address = change['address']
+            if not address:
+                results.append((get_error_code('MissingInformation'),
+                                get_error_message('MissingInformation')))
+                continue
+            subscribing = change['operation'] == 'subscribe'
+            if subscribing:
+                status_code, message = _subscribe_member(
+                    mutation, address, change['fullname'], change['digest'])
+            else:
+                status_code, message = _unsubscribe_member(mutation,
+                                                           address)
+            if status_code == 200:
+                membership[address.lower()] = subscribing and change
+            results.append((status_code, message))
+    return results
+
+
+def _submit_change(listname, change):
+    if coalesce.WINDOW:
+        return coalesce.submit(listname, change, _apply_changes)
+    return _apply_changes(listname, [change])[0]
+
+
+def _change_response(status_code, message):
+    headers = {}
+    if status_code == get_error_code('TimeOutError'):
+        # A coalesced change whose group timed out on the list lock.
+        headers['retry_after'] = str(utils.RETRY_AFTER)
+    return message_response(message, status_code, **headers)
 
 
 def subscribe(listname):
@@ -112,35 +373,11 @@ def subscribe(listname):
         digests instead of every mail sent to the list.
 
     """
-    address = request.forms.get('address')
-    fullname = request.forms.get('fullname')
-    digest = parse_boolean(request.forms.get('digest'))
-
-    mlist = get_mailinglist(listname)
-    userdesc = UserDesc.UserDesc(address, fullname, digest=digest)
-    message = 'Success'
-    status_code = 200
-    try:
-        mlist.AddMember(userdesc)
-    except (Errors.MMSubscribeNeedsConfirmation,
-            Errors.MMNeedApproval,
-            Errors.MMAlreadyAMember,
-            Errors.MembershipIsBanned,
-            Errors.MMBadEmailError,
-            Errors.MMHostileAddress), e:
-        class_name = e.__class__.__name__
-        # Don't append error string for MMSubscribeNeedsConfirmation exception.
-        if class_name == 'MMSubscribeNeedsConfirmation':
-            message = get_error_message(e.__class__.__name__)
-        else:
-            message = get_error_message(e.__class__.__name__) + ': ' + str(e)
-        status_code = get_error_code(e.__class__.__name__)
-    finally:
-        mlist.Save()
-        mlist.Unlock()
-    return HTTPResponse(status=status_code,
-                        body=json.dumps({'message': message}),
-                        content_type='application/json')
+    change = {'operation': 'subscribe',
+              'address': request.forms.get('address'),
+              'fullname': request.forms.get('fullname'),
+              'digest': parse_boolean(request.forms.get('digest'))}
+    return _change_response(*_submit_change(listname, change))
 
 
 def unsubscribe(listname):
@@ -155,21 +392,218 @@ def unsubscribe(listname):
       * `address`: email address that is to be unsubscribed from the list
 
     """
-    address = request.forms.get('address')
-    mlist = get_mailinglist(listname)
-    message = 'Success'
-    status_code = 200
+    change = {'operation': 'unsubscribe',
+              'address': request.forms.get('address'),
+              'fullname': None,
+              'digest': False}
+    return _change_response(*_submit_change(listname, change))
+
+
+def erase_member():
+    """Unsubscribes an address from every list it is subscribed to.
+
+    **Method**: DELETE
+
+    **URI**: /_members
+
+    **Parameters**:
+
+      * `address`: email address to unsubscribe, in the query string or
+        the request body.
+
+    Each list is changed under its own lock, one after another, as
+    Mailman's locks and i18n aren't meant for threads.  Returns an array
+    with the `listname`, `status` and `message` of the unsubscription
+    from each list, using the status codes and messages of the single
+    unsubscribe call."""
+    address = request.params.get('address')
+    if not address:
+        return message_response(get_error_message('MissingInformation'),
+                                get_error_code('MissingInformation'))
+    # Erasure mustn't miss lists changed since the last refresh.
+    index.refresh(force=True)
+    listnames = index.lists_for_address(address)
+
+    def unsubscribe_from(listname):
+        change = {'operation': 'unsubscribe',
+                  'address': address,
+                  'fullname': None,
+                  'digest': False}
+        try:
+            return _submit_change(listname, change)
+        except HTTPResponse, e:
+            # The list is gone or its lock timed out.
+            return e.status_code, json.loads(e.body)['message']
+        except Exception, e:
+            return 500, '%s: %s' % (e.__class__.__name__, e)
+
+    results = []
+    for listname in listnames:
+        status_code, message = unsubscribe_from(listname)
+        results.append({'listname': listname,
+                        'status': status_code,
+                        'message': message})
+    return json_response(results)
+
+
+def _apply_batch(listname, operation):
     try:
-        mlist.ApprovedDeleteMember(address, admin_notif=False, userack=True)
-    except Errors.NotAMemberError, e:
-        message = get_error_message(e.__class__.__name__) + ': ' + str(e)
-        status_code = get_error_code(e.__class__.__name__)
-    finally:
-        mlist.Save()
-        mlist.Unlock()
-    return HTTPResponse(status=status_code,
-                        body=json.dumps({'message': message}),
-                        content_type='application/json')
+        changes = _parse_batch(request.body.read(),
+                               request.content_type or '')
+    except ValueError, e:
+        message = 'Invalid parameters: ' + str(e)
+        return message_response(message, get_error_code('InvalidParams'))
+    for change in changes:
+        change['operation'] = operation
+
+    results = []
+    for change, (status_code, message) in zip(
+            changes, _apply_changes(listname, changes)):
+        results.append({'address': change['address'],
+                        'status': status_code,
+                        'message': message})
+    return json_response(results)
+
+
+def subscribe_batch(listname):
+    """Adds many subscribers to the list called `<listname>` at once.
+
+    **Method**: PUT
+
+    **URI**: /<listname>/members/batch
+
+    The request body is a JSON array, or newline-delimited JSON when sent
+    as `application/x-ndjson`. Each element is either an address or an
+    object with the `address`, `fullname` and `digest` fields taken by
+    the single subscribe call. The list is locked and saved once for the
+    whole batch.
+
+    Returns an array with an `address`, `status` and `message` for each
+    element, using the status codes and messages of the single subscribe
+    call."""
+    return _apply_batch(listname, 'subscribe')
+
+
+def unsubscribe_batch(listname):
+    """Unsubscribes many addresses from the list called `<listname>` at
+    once.
+
+    **Method**: DELETE
+
+    **URI**: /<listname>/members/batch
+
+    The request body has the same format as for the batch subscribe call;
+    only `address` is used. Returns a result array in the same format."""
+    return _apply_batch(listname, 'unsubscribe')
+
+
+def _import_entries(lines, content_type):
+    """Returns an iterator over the rows of an import body, read from
+    `lines`, as `_batch_entry` dictionaries, or as ValueErrors for rows
+    that can't be parsed.  Raises ValueError right away if the body as a
+    whole can't be."""
+    content_type = content_type.split(';')[0].strip()
+    if content_type == 'application/x-ndjson':
+        def parse(line):
+            return _batch_entry(json.loads(line))
+        lines = (line for line in lines if line.strip())
+    elif content_type == 'text/csv':
+        reader = csv.reader(lines)
+        header = [column.strip().lower() for column in next(reader, [])]
+        if 'address' not in header:
+            raise ValueError('the CSV header has no address column')
+
+        def parse(row):
+            item = dict(zip(header, row))
+            item['fullname'] = item.get('fullname') or None
+            return _batch_entry(item)
+        lines = reader
+    else:
+        raise ValueError('expected text/csv or application/x-ndjson, got '
+                         + (content_type or 'no content type'))
+
+    def entries():
+        while True:
+            try:
+                entry = parse(next(lines))
+            except StopIteration:
+                return
+            except (ValueError, csv.Error), e:
+                entry = e
+            yield entry
+    return entries()
+
+
+def import_members(listname):
+    """Subscribes the members of an uploaded CSV or NDJSON file.
+
+    **Method**: POST
+
+    **URI**: /<listname>/members/import
+
+    The request body is CSV, sent as `text/csv`, with a header line
+    naming its `address`, `fullname` and `digest` columns, or
+    newline-delimited JSON, sent as `application/x-ndjson`, in the format
+    of the batch subscribe call. It is read and applied as it arrives,
+    `--import-chunk-size` rows at a time, each chunk under its own lock
+    and Save(), so other changes to the list can go ahead during a long
+    import.
+
+    Returns the number of `rows` read and how many were `added`,
+    `skipped` as already subscribed and `failed`, with the `row`,
+    `address`, `status` and `message` of the first failures in
+    `errors`. If a chunk can't be applied, such as when the list lock
+    times out, the response has that chunk's status code and `message`
+    and reports the rows applied before it; re-sending the whole file
+    then skips those."""
+    try:
+        entries = _import_entries(utils.iter_body_lines(request.environ),
+                                  request.content_type or '')
+    except (ValueError, csv.Error), e:
+        message = 'Invalid parameters: ' + str(e)
+        return message_response(message, get_error_code('InvalidParams'))
+
+    summary = {'rows': 0, 'added': 0, 'skipped': 0, 'failed': 0,
+               'errors': []}
+
+    def failed(row, address, status_code, message):
+        summary['failed'] += 1
+        if len(summary['errors']) < IMPORT_MAX_ERRORS:
+            summary['errors'].append({'row': row, 'address': address,
+                                      'status': status_code,
+                                      'message': message})
+
+    while True:
+        chunk = list(itertools.islice(entries, IMPORT_CHUNK_SIZE))
+        if not chunk:
+            break
+        changes = [entry for entry in chunk if isinstance(entry, dict)]
+        for change in changes:
+            change['operation'] = 'subscribe'
+        try:
+            results = iter(_apply_changes(listname, changes))
+        except HTTPResponse, e:
+            if not summary['rows']:
+                return e
+            summary['message'] = json.loads(e.body)['message']
+            headers = {}
+            if e.status_code == get_error_code('TimeOutError'):
+                headers['retry_after'] = str(utils.RETRY_AFTER)
+            return json_response(summary, e.status_code, **headers)
+        for row, entry in enumerate(chunk, summary['rows'] + 1):
+            if not isinstance(entry, dict):
+                failed(row, None, get_error_code('InvalidParams'),
+                       'Invalid parameters: ' + str(entry))
+                continue
+            status_code, message = next(results)
+            if status_code == 200:
+                summary['added'] += 1
+            elif status_code == get_error_code('MMAlreadyAMember'):
+                summary['skipped'] += 1
+            else:
+                failed(row, entry['address'], status_code, message)
+        summary['rows'] += len(chunk)
+    return json_response(summary)
 
 
 def create_list(listname):
@@ -188,7 +622,10 @@ def create_list(listname):
       * `emailhost`: email host
       * `urlhost`: url host
       * `notification_email`: email for notification. If null assumes admin email.
-      * `quiet`: 0) Send email notification on list creation; 1) No notification email. Default is to send notification (0) """
+      * `quiet`: 0) Send email notification on list creation; 1) No notification email. Default is to send notification (0)
+      * `async` (optional): if this equals `true` or `1`, create the list
+      in the background and answer 202 with the job's status, to be
+      followed at `GET /_jobs/<job_id>`."""
 
     admin = request.forms.get('admin')
     password = request.forms.get('password')
@@ -199,7 +636,6 @@ def create_list(listname):
     quiet = request.forms.get('quiet', 0)
     notification_email = request.forms.get('notification_email')
 
-    status_code = 200
     try:
         subscribe_policy = int(subscribe_policy)
         archive_private = int(archive_private)
@@ -208,9 +644,7 @@ def create_list(listname):
             notification_email = admin
     except ValueError, e:
         message = 'Invalid parameters: ' + str(e)
-        return HTTPResponse(status=get_error_code('InvalidParams'),
-                            body=json.dumps({'message': message}),
-                            content_type='application/json')
+        return message_response(message, get_error_code('InvalidParams'))
 
     if subscribe_policy < 0 or subscribe_policy > 3:
         subscribe_policy = 1
@@ -223,46 +657,88 @@ def create_list(listname):
 
     if password is None or password == '':
         message = 'Invalid password'
-        return HTTPResponse(status=get_error_code('InvalidPassword'),
-                            body=json.dumps({'message': message}),
-                            content_type='application/json')
+        return message_response(message, get_error_code('InvalidPassword'))
     else:
         password = Utils.sha_new(password).hexdigest()
 
+    params = {'admin': admin,
+              'password': password,
+              'urlhost': urlhost,
+              'emailhost': emailhost,
+              'subscribe_policy': subscribe_policy,
+              'archive_private': archive_private,
+              'quiet': quiet,
+              'notification_email': notification_email}
+    if _parse_flag(request.params.get('async')):
+        return _job_accepted(jobs.submit('create_list', listname, params))
+    status_code, message = _create_list(listname, params)
+    return message_response(message, status_code)
+
+
+def _no_progress(done, total=None):
+    pass
+
+
+def _job_accepted(job_id):
+    return json_response(jobs.get(job_id), 202,
+                         location='/_jobs/' + job_id)
+
+
+@jobs.handler('create_list')
+def _create_list(listname, params, progress=_no_progress):
+    """Creates a list with the parameters `create_list` has validated and
+    returns the (status_code, message) to report."""
+    status_code = 200
     mail_list = MailList.MailList()
     message = 'Success'
     try:
-        mail_list.Create(listname, admin, password, urlhost=urlhost, emailhost=emailhost)
-        mail_list.archive_private = archive_private
-        mail_list.subscribe_policy = subscribe_policy
-        mail_list.Save()
-        if not quiet:
-            # print 'Sending notification email.'
-            siteowner = notification_email
-            text = Utils.maketext(
-                'newlist.txt',
-                {'listname'    : listname,
-                 'password'    : password,
-                 'admin_url'   : mail_list.GetScriptURL('admin', absolute=1),
-                 'listinfo_url': mail_list.GetScriptURL('listinfo', absolute=1),
-                 'requestaddr' : mail_list.GetRequestEmail(),
-                 'siteowner'   : siteowner
-                 }, mlist=mail_list)
-            i18n.set_language('en')
-            msg = Message.UserNotification(
-                admin, siteowner,
-                _('Your new mailing list: %(listname)s'),
-                text, 'en')
-            msg.send(mail_list)
+        with metrics.phase('mutation'):
+            mail_list.Create(listname, params['admin'], params['password'],
+                             urlhost=params['urlhost'],
+                             emailhost=params['emailhost'])
+        progress(1, 3)
+        mail_list.archive_private = params['archive_private']
+        mail_list.subscribe_policy = params['subscribe_policy']
+        with metrics.phase('save'):
+            mail_list.Save()
+        progress(2, 3)
+        if not params['quiet']:
+            # The password is read from the list when the notification
+            # is rendered rather than written to the outbox.
+            outbox.queue(listname, 'newlist',
+                         {'admin': params['admin'],
+                          'siteowner': params['notification_email']})
+        progress(3, 3)
     except (Errors.BadListNameError, AssertionError,
             Errors.MMBadEmailError, Errors.MMListAlreadyExistsError), e:
         message = get_error_message(e.__class__.__name__) + ': ' + str(e)
         status_code = get_error_code(e.__class__.__name__)
     finally:
         mail_list.Unlock()
-    return HTTPResponse(status=status_code,
-                        body=json.dumps({'message': message}),
-                        content_type='application/json')
+    if status_code == 200:
+        index.record_list(listname)
+    return status_code, message
+
+
+@outbox.renderer('newlist')
+def _newlist_notification(mail_list, params):
+    """Builds the notification sent to the admin of a new list."""
+    listname = mail_list.internal_name()
+    siteowner = params['siteowner']
+    text = Utils.maketext(
+        'newlist.txt',
+        {'listname'    : listname,
+         'password'    : mail_list.password,
+         'admin_url'   : mail_list.GetScriptURL('admin', absolute=1),
+         'listinfo_url': mail_list.GetScriptURL('listinfo', absolute=1),
+         'requestaddr' : mail_list.GetRequestEmail(),
+         'siteowner'   : siteowner
+         }, mlist=mail_list)
+    i18n.set_language('en')
+    return Message.UserNotification(
+        params['admin'], siteowner,
+        _('Your new mailing list: %(listname)s'),
+        text, 'en')
 
 
 def delete_list(listname):
@@ -275,7 +751,10 @@ def delete_list(listname):
     **Parameters**:
 
       * `delete_archives`: If this equals to 'true', archives will be deleted
-      as well"""
+      as well
+      * `async` (optional): if this equals `true` or `1`, delete the list
+      in the background and answer 202 with the job's status, to be
+      followed at `GET /_jobs/<job_id>`"""
 
     delete_archives = parse_boolean(request.forms.get('delete_archives'))
     mlist = get_mailinglist(listname, lock=False)
@@ -298,32 +777,101 @@ def delete_list(listname):
         sys.modules[modname].remove(mlist, cgi=1)
     """
 
+    params = {'delete_archives': delete_archives}
+    if _parse_flag(request.params.get('async')):
+        return _job_accepted(jobs.submit('delete_list',
+                                         mlist.internal_name(), params))
+    status_code, message = _delete_list(mlist.internal_name(), params)
+    return message_response(message, status_code)
+
+
+# Files removed between progress reports while deleting a list.
+PROGRESS_EVERY = 1000
+
+
+def _remove_tree(path, progress, done):
+    # shutil.rmtree, reporting the number of entries removed so far.
+    for root, dirs, files in os.walk(path, topdown=False):
+        for name in files:
+            os.unlink(os.path.join(root, name))
+            done += 1
+            if done % PROGRESS_EVERY == 0:
+                progress(done)
+        for name in dirs:
+            entry = os.path.join(root, name)
+            if os.path.islink(entry):
+                os.unlink(entry)
+            else:
+                os.rmdir(entry)
+            done += 1
+            if done % PROGRESS_EVERY == 0:
+                progress(done)
+    os.rmdir(path)
+    return done + 1
+
+
+@jobs.handler('delete_list')
+def _delete_list(listname, params, progress=_no_progress):
+    """Removes a list's files, and its archives if `delete_archives` is
+    set, and returns the (status_code, message) to report.  Parts already
+    gone are skipped, so it can be re-run after an interruption."""
     REMOVABLES = ['lists/%s']
-    if delete_archives:
+    if params['delete_archives']:
         REMOVABLES.extend(['archives/private/%s',
                            'archives/private/%s.mbox',
                            'archives/public/%s',
                            'archives/public/%s.mbox',
                            ])
-    listname = mlist.internal_name()
+    done = 0
     for dirtmpl in REMOVABLES:
         dir = os.path.join(mm_cfg.VAR_PREFIX, dirtmpl % listname)
         if os.path.islink(dir):
             try:
                 os.unlink(dir)
             except OSError, e:
-                return HTTPResponse(status=500,
-                                    body=json.dumps({'message': str(e)}),
-                                    content_type='application/json')
+                return 500, str(e)
         elif os.path.isdir(dir):
             try:
-                shutil.rmtree(dir)
+                done = _remove_tree(dir, progress, done)
             except OSError, e:
-                return HTTPResponse(status=500,
-                                    body=json.dumps({'message': str(e)}),
-                                    content_type='application/json')
-    return HTTPResponse(body=json.dumps({'message': 'Success'}),
-                        content_type='application/json')
+                return 500, str(e)
+    progress(done, done)
+    index.record_list(listname)
+    return 200, 'Success'
+
+
+def _search_members(listname, headers):
+    # Answers GET /<listname>/members?q=...
+    try:
+        limit = request.query.get('limit')
+        limit = int(limit) if limit else search.DEFAULT_LIMIT
+        if limit < 0:
+            raise ValueError('limit must not be negative')
+        match = request.query.get('match', 'substring')
+        if match not in ('substring', 'prefix'):
+            raise ValueError('unknown match: %s' % match)
+    except ValueError, e:
+        message = 'Invalid parameters: ' + str(e)
+        return message_response(message, get_error_code('InvalidParams'))
+    results, more = cache.get_search_index(listname).search(
+        request.query.get('q'), match == 'prefix',
+        request.query.get('after'), limit)
+    if more and results:
+        headers['x_next_cursor'] = results[-1][0]
+    return json_response([{'address': address, 'fullname': fullname}
+                          for address, fullname in results], **headers)
+
+
+def _member_details(mlist, addresses):
+    """Yields the details `GET /<listname>/members?detail=true` reports
+    for each of `addresses`, which must be member keys of `mlist`."""
+    digest_members = cache.get_digest_members(mlist)
+    for address in addresses:
+        yield {'address': address,
+               'fullname': mlist.getMemberName(address),
+               'digest': address in digest_members,
+               'delivery_status': mlist.getDeliveryStatus(address),
+               'language': mlist.getMemberLanguage(address)}
 
 
 def members(listname):
@@ -335,32 +883,156 @@ def members(listname):
 
     **Parameters**:
 
-      * `address` (optional): email address to search for in list."""
+      * `address` (optional): email address to search for in list.
+      * `limit` (optional): return at most this many addresses. Addresses
+        are sorted, and when more remain the `X-Next-Cursor` response
+        header holds the value to pass as `after` for the next page.
+      * `after` (optional): return only addresses sorting after this one.
+      * `stream` (optional): if this equals `true`, the JSON array is sent
+        in chunks as it is produced instead of being built up front.
+      * `format` (optional): `json` (default) or `ndjson`, which streams
+        one JSON string per line.
+      * `detail` (optional): if this equals `true` or `1`, return an
+        object per member with their `address`, `fullname`, `digest`
+        flag, `delivery_status` and `language` instead of the address.
+      * `q` (optional): return the `address` and `fullname` of members
+        whose address or full name contains this text, ignoring case, or
+        of the members of a domain if it starts with `@`. `limit`
+        defaults to 100 and `after` pages as above.
+      * `match` (optional): with `q`, `substring` (default) or `prefix`.
+
+    Supports conditional requests like `GET /`."""
 
     address = request.query.get('address')
-    try:
-        mlist = MailList.MailList(listname.lower(), lock=False)
-    except Errors.MMUnknownListError, e:
-        message = get_error_message(e.__class__.__name__) + ': ' + listname
-        return HTTPResponse(status=get_error_code(e.__class__.__name__),
-                            body=json.dumps({'message': message}),
-                            content_type='application/json')
+    headers = _list_headers(listname)
+    if index.READ_MODEL and index.get_list(listname) is None:
+        return _unknown_list(listname)
+    if request.query.get('q'):
+        return _search_members(listname, headers)
+    if index.READ_MODEL:
+        mlist = None
+    else:
+        mlist = cache.get_list(listname)
     if not address:
-        return HTTPResponse(body=json.dumps(mlist.getMembers()),
-                            content_type='application/json')
+        try:
+            limit = request.query.get('limit')
+            limit = int(limit) if limit else None
+            if limit is not None and limit < 0:
+                raise ValueError('limit must not be negative')
+            output_format = request.query.get('format', 'json')
+            if output_format not in ('json', 'ndjson'):
+                raise ValueError('unknown format: ' + output_format)
+        except ValueError, e:
+            message = 'Invalid parameters: ' + str(e)
+            return message_response(message, get_error_code('InvalidParams'))
+        after = request.query.get('after')
+        stream = parse_boolean(request.query.get('stream'))
+        detail = _parse_flag(request.query.get('detail'))
+        if detail and mlist is None:
+            # The read model doesn't hold delivery status or language.
+            mlist = cache.get_list(listname)
+
+        if mlist is None:
+            # One extra row tells whether there's a next page.
+            page = index.get_members(
+                listname, after, None if limit is None else limit + 1) or []
+            if limit is not None and len(page) > limit:
+                page = page[:limit]
+                if page:
+                    headers['x_next_cursor'] = page[-1]
+        else:
+            addresses = cache.get_sorted_members(mlist)
+            start = 0
+            if after:
+                start = bisect.bisect_right(addresses, after.lower())
+            stop = len(addresses)
+            if limit is not None:
+                stop = min(start + limit, stop)
+            page = itertools.islice(addresses, start, stop)
+            if stop < len(addresses) and stop > start:
+                headers['x_next_cursor'] = addresses[stop - 1]
+        if detail:
+            page = _member_details(mlist, page)
+        if output_format == 'ndjson' or stream:
+            return stream_response(page, output_format == 'ndjson',
+                                   **headers)
+        return json_response(list(page), **headers)
     else:
         member = []
         try:
-            memberKey = mlist.getMemberKey(address)
+            if mlist is None:
+                row = index.get_member(listname, address)
+                if row is None:
+                    raise Errors.NotAMemberError(address)
+                memberKey, fullname = row
+            else:
+                memberKey = mlist.getMemberKey(address)
+                fullname = mlist.getMemberName(memberKey)
         except Errors.NotAMemberError, e:
             message = get_error_message(e.__class__.__name__) + ': ' + str(e)
-            return HTTPResponse(status=get_error_code(e.__class__.__name__),
-                                body=json.dumps({'message': message}),
-                                content_type='application/json')
+            return message_response(message,
+                                    get_error_code(e.__class__.__name__))
         member_values = {
             'address': memberKey,
-            'fullname': mlist.getMemberName(memberKey)
+            'fullname': fullname
         }
         member.append(member_values)
-        return HTTPResponse(body=json.dumps(member),
-                            content_type='application/json')
+        return json_response(member, **headers)
+
+
+def _export_records(after=None):
+    """Yields a `list` record for each list sorting after `after`, in
+    name order, followed by a `member` record for each of its members.
+
+    Lists are loaded one at a time as the records are consumed, bypassing
+    the list cache so an export doesn't evict the lists being served."""
+    after = after.lower() if after else None
+    for listname in sorted(Utils.list_names()):
+        if listname == Defaults.MAILMAN_SITE_LIST:
+            continue
+        if after is not None and listname <= after:
+            continue
+        try:
+            with metrics.phase('unpickle'):
+                mlist = MailList.MailList(listname, lock=False)
+        except Errors.MMUnknownListError:
+            # Deleted since the names were read.
+            continue
+        record = _list_values(listname, mlist)
+        record['record'] = 'list'
+        yield record
+        for record in _member_details(mlist, sorted(mlist.getMembers())):
+            record['record'] = 'member'
+            record['listname'] = listname
+            yield record
+
+
+def export():
+    """Exports every list and its members.
+
+    **Method**: GET
+
+    **URI**: /_export
+
+    Streams one `list` record with the attributes `GET /<listname>`
+    returns for each list, in list name order, each followed by a
+    `member` record with the list's `listname` and the details
+    `GET /<listname>/members?detail=true` returns for each member.
+    Lists are loaded as the response is sent, so exporting a large site
+    doesn't hold all of it in memory.
+
+    **Parameters**:
+      * `format` (optional): `ndjson` (default), one JSON object per
+        line, or `csv`, with a header line naming the columns.
+      * `after` (optional): export only the lists sorting after this
+        one, to resume an export that was cut off after the last list it
+        completely received."""
+
+    output_format = request.query.get('format', 'ndjson')
+    if output_format not in ('ndjson', 'csv'):
+        message = 'Invalid parameters: unknown format: ' + output_format
+        return message_response(message, get_error_code('InvalidParams'))
+    records = _export_records(request.query.get('after'))
+    if output_format == 'csv':
+        return csv_response(records, EXPORT_COLUMNS)
+    return stream_response(records, True)
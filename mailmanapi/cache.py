@@ -0,0 +1,192 @@
+"""Per-worker LRU cache of read-only MailList objects.
+
+Read endpoints used to unpickle a list's config.pck on every request.  The
+cache keeps recently used lists loaded with lock=False and hands the same
+object out again for as long as the list's config.pck stamp (inode, mtime,
+size) is unchanged.  Cached objects are shared between requests, so they
+must never be locked or modified."""
+import threading
+from collections import OrderedDict
+from bottle import HTTPResponse
+from Mailman import MailList, Errors
+from . import metrics, search
+from .utils import get_mailinglist, get_config_stamp
+
+# Search indexes kept, most recently used first.  They are kept apart
+# from the lists they were built from, so that lists too big to stay in
+# the cache aren't re-indexed on every search.
+SEARCH_INDEXES = 16
+
+# Budget for cached lists, measured in config.pck bytes.  A list's
+# in-memory size is roughly proportional to its pickle, so this bounds
+# worker memory without having to walk the objects.
+MAX_BYTES = 64 * 1024 * 1024
+
+
+class ListCache(object):
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, listname):
+        key = listname.lower()
+        # Stat before loading: if the list changes while it's being
+        # unpickled, the entry keeps the older stamp and is reloaded on
+        # its next use.
+        stamp = get_config_stamp(key)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[0][2]
+                if entry[0] == stamp:
+                    self.hits += 1
+                    self._entries[key] = entry
+                    self._bytes += stamp[2]
+                    return entry[1]
+            self.misses += 1
+        if stamp is None:
+            # Raises the usual 404 unless the list appeared meanwhile.
+            return get_mailinglist(listname, lock=False)
+        try:
+            with metrics.phase('unpickle'):
+                mlist = MailList.MailList(key, lock=False)
+        except Errors.MMUnknownListError:
+            # Deleted since the stat; raises the usual 404 likewise.
+            return get_mailinglist(listname, lock=False)
+        self._store(key, stamp, mlist)
+        return mlist
+
+    def _store(self, key, stamp, mlist):
+        size = stamp[2]
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[0][2]
+            self._entries[key] = (stamp, mlist, {})
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                evicted = self._entries.popitem(last=False)[1]
+                self._bytes -= evicted[0][2]
+                self.evictions += 1
+
+    def derived(self, mlist, name, factory):
+        with self._lock:
+            entry = self._entries.get(mlist.internal_name())
+        if entry is None or entry[1] is not mlist:
+            return factory(mlist)
+        values = entry[2]
+        if name not in values:
+            values[name] = factory(mlist)
+        return values[name]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'lists': len(self._entries),
+                    'bytes': self._bytes}
+
+
+_cache = ListCache(MAX_BYTES)
+
+_search_indexes = OrderedDict()
+_search_lock = threading.Lock()
+
+
+def configure(max_bytes):
+    _cache.max_bytes = max_bytes
+    _cache.clear()
+    with _search_lock:
+        _search_indexes.clear()
+
+
+def get_list(listname):
+    """Returns a read-only MailList for `listname`, unpickling its
+    config.pck only when it changed since the cached copy was loaded.
+
+    Unknown lists raise the same 404 response as
+    `utils.get_mailinglist`."""
+    return _cache.get(listname)
+
+
+def preload(listnames):
+    """Loads lists until the cache is full, skipping ones that have
+    disappeared meanwhile."""
+    for listname in listnames:
+        if _cache.stats()['bytes'] >= _cache.max_bytes:
+            break
+        try:
+            _cache.get(listname)
+        except HTTPResponse:
+            continue
+
+
+def get_sorted_members(mlist):
+    """Returns the list's member keys in sorted order.
+
+    The sorted roster is kept alongside cached lists, so paging through a
+    big list sorts it once rather than on every page."""
+    return _cache.derived(mlist, 'sorted_members',
+                          lambda mlist: sorted(mlist.getMembers()))
+
+
+def get_member_count(mlist):
+    """Returns the list's number of members, counting its roster once per
+    version of the list."""
+    return _cache.derived(mlist, 'member_count',
+                          lambda mlist: len(mlist.getMembers()))
+
+
+def get_digest_members(mlist):
+    """Returns the set of the list's digest member keys."""
+    return _cache.derived(mlist, 'digest_members',
+                          lambda mlist: set(mlist.getDigestMemberKeys()))
+
+
+def get_search_index(listname):
+    """Returns the `search.MemberIndex` of `listname`, built on first use
+    and rebuilt when its config.pck changes.
+
+    Unknown lists raise the same 404 response as `get_list`."""
+    key = listname.lower()
+    stamp = get_config_stamp(key)
+    with _search_lock:
+        entry = _search_indexes.pop(key, None)
+        if entry is not None and entry[0] == stamp:
+            _search_indexes[key] = entry
+            return entry[1]
+    member_index = search.MemberIndex(get_list(listname))
+    if stamp is not None:
+        with _search_lock:
+            _search_indexes[key] = (stamp, member_index)
+            while len(_search_indexes) > SEARCH_INDEXES:
+                _search_indexes.popitem(last=False)
+    return member_index
+
+
+def stats():
+    return _cache.stats()
+
+
+def _collect_metrics():
+    counters = stats()
+    for name in ('hits', 'misses', 'evictions'):
+        metrics.set_counter('mailmanapi_list_cache_%s_total' % name,
+                            counters[name])
+
+
+metrics.collectors.append(_collect_metrics)
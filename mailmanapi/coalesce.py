@@ -0,0 +1,114 @@
+"""Group commit for concurrent membership changes on the same list.
+
+Every subscribe or unsubscribe used to pay for its own lock, unpickle and
+full config.pck rewrite, so a burst of requests for one list queued up
+behind Mailman's list lock and each did the whole cycle in turn.
+
+With coalescing enabled, a request queues its change in the shared
+`coalesce` database and waits `WINDOW` seconds for others to arrive.
+Requests then take turns at a per-list commit lock.  Whoever gets it
+first applies every change queued for the list in one locked cycle and
+stores each result; the requests behind it find their result already
+there and return without touching the list at all."""
+import os
+import json
+import time
+import fcntl
+from contextlib import contextmanager
+from bottle import HTTPResponse
+from . import storage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    listname TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    address TEXT,
+    fullname TEXT,
+    digest INTEGER NOT NULL,
+    status INTEGER,
+    message TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pending_listname ON pending (listname, status);
+"""
+
+# Seconds a change waits for others before it is committed.  0 disables
+# coalescing and every request commits on its own.
+WINDOW = 0
+
+# Changes whose requester never collected the result are purged after
+# this many seconds.
+EXPIRY = 3600
+
+
+def _connect():
+    return storage.connect('coalesce', SCHEMA)
+
+
+@contextmanager
+def _commit_lock(listname):
+    path = storage.state_path('locks', listname.lower() + '.lock')
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0660)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def _result(conn, change_id):
+    return conn.execute('SELECT status, message FROM pending WHERE id = ?',
+                        (change_id,)).fetchone()
+
+
+def _commit(conn, listname, apply_changes):
+    rows = conn.execute('SELECT id, operation, address, fullname, digest '
+                        'FROM pending WHERE listname = ? AND status IS NULL '
+                        'ORDER BY id', (listname,)).fetchall()
+    changes = [{'operation': row[1],
+                'address': row[2],
+                'fullname': row[3],
+                'digest': bool(row[4])} for row in rows]
+    try:
+        results = apply_changes(listname, changes)
+    except HTTPResponse, e:
+        # The list is unknown or couldn't be locked: every change in the
+        # group fails the same way.
+        message = json.loads(e.body)['message']
+        results = [(e.status_code, message)] * len(rows)
+    with storage.transaction(conn):
+        conn.executemany('UPDATE pending SET status = ?, message = ? '
+                         'WHERE id = ?',
+                         [result + (row[0],)
+                          for row, result in zip(rows, results)])
+        conn.execute('DELETE FROM pending WHERE created < ?',
+                     (time.time() - EXPIRY,))
+
+
+def submit(listname, change, apply_changes):
+    """Queues `change` for `listname` and returns its (status_code,
+    message) once it has been committed, either by this request or by
+    another one that got the commit lock first.
+
+    `apply_changes(listname, changes)` must apply a list of changes under
+    one lock and Save() and return a result for each."""
+    listname = listname.lower()
+    conn = _connect()
+    with storage.transaction(conn):
+        change_id = conn.execute(
+            'INSERT INTO pending (listname, operation, address, fullname, '
+            'digest, created) VALUES (?, ?, ?, ?, ?, ?)',
+            (listname, change['operation'], change['address'],
+             change['fullname'], int(bool(change['digest'])),
+             time.time())).lastrowid
+    try:
+        time.sleep(WINDOW)
+        with _commit_lock(listname):
+            result = _result(conn, change_id)
+            if result[0] is None:
+                _commit(conn, listname, apply_changes)
+                result = _result(conn, change_id)
+    finally:
+        conn.execute('DELETE FROM pending WHERE id = ?', (change_id,))
+    return result[0], result[1]
@@ -0,0 +1,188 @@
+"""gzip/deflate compression of responses, negotiated via Accept-Encoding.
+
+`CompressionMiddleware` compresses JSON and text responses of at least
+`MIN_SIZE` bytes for clients that accept gzip or deflate.  Streamed
+bodies are compressed as they are produced and flushed every
+`FLUSH_SIZE` bytes, so clients can start parsing them before the end;
+only the first `MIN_SIZE` bytes are held back to decide whether a body
+of unknown length is worth compressing.
+
+A compressed representation is a different one as far as caches are
+concerned, so its ETag gets a `-gzip` or `-deflate` suffix, which is
+stripped again from If-None-Match before the request reaches the
+application.  Responses sent uncompressed, such as small ones, keep the
+application's ETag."""
+import re
+import zlib
+
+# Compression level from 1 (fastest) to 9 (smallest); 0 disables
+# compression.
+LEVEL = 6
+
+# Responses smaller than this many bytes are sent uncompressed.
+MIN_SIZE = 1024
+
+# Uncompressed bytes of a streamed body after which compressed output is
+# flushed to the client.  Flushing costs compression ratio, so it isn't
+# done for every chunk the application yields.
+FLUSH_SIZE = 64 * 1024
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/')
+
+# zlib window bits for each content coding.
+_WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+_ETAG_SUFFIX = re.compile(r'-(?:gzip|deflate)"')
+
+
+def choose_encoding(accept_encoding):
+    """Returns the coding to use for an Accept-Encoding header value,
+    preferring gzip, or None."""
+    qualities = {}
+    for item in (accept_encoding or '').split(','):
+        parts = item.strip().split(';')
+        coding = parts[0].strip().lower()
+        quality = 1.0
+        for param in parts[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding] = quality
+    for coding in ('gzip', 'deflate'):
+        quality = qualities.get(coding, qualities.get('*', 0.0))
+        if quality > 0:
+            return coding
+    return None
+
+
+class CompressionMiddleware(object):
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        encoding = choose_encoding(environ.get('HTTP_ACCEPT_ENCODING'))
+        if encoding is None or environ.get('REQUEST_METHOD') == 'HEAD':
+            return self.app(environ, start_response)
+        # Whether the client validates a compressed representation, which
+        # a 304 must then name.
+        encoded_validator = False
+        if 'HTTP_IF_NONE_MATCH' in environ:
+            if_none_match = environ['HTTP_IF_NONE_MATCH']
+            encoded_validator = bool(_ETAG_SUFFIX.search(if_none_match))
+            environ['HTTP_IF_NONE_MATCH'] = _ETAG_SUFFIX.sub('"',
+                                                             if_none_match)
+        response = _CompressedResponse(encoding, start_response,
+                                       encoded_validator)
+        response.body = self.app(environ, response.start_response)
+        return response
+
+
+class _CompressedResponse(object):
+    """Response body that compresses the application's body, calling the
+    server's start_response once it knows whether it will."""
+
+    def __init__(self, encoding, start_response, encoded_validator=False):
+        self.encoding = encoding
+        self.encoded_validator = encoded_validator
+        self.server_start_response = start_response
+        self.body = None
+        self.compressor = None
+        self.pending = []
+
+    def start_response(self, status, headers, exc_info=None):
+        self.status = status
+        self.headers = headers
+        self.exc_info = exc_info
+        return self.pending.append
+
+    def _header(self, name):
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value
+        return None
+
+    def _compressible(self):
+        if self.status[:3] == '304':
+            # Empty, but its ETag must name the representation the client
+            # has.
+            return self.encoded_validator
+        if self.status[:3] == '204':
+            return False
+        content_type = self._header('content-type') or ''
+        return (content_type.startswith(COMPRESSIBLE_TYPES) and
+                self._header('content-encoding') is None and
+                'no-transform' not in (self._header('cache-control') or ''))
+
+    def _start(self, compress):
+        if not compress and self.status[:3] != '304':
+            self.server_start_response(self.status, self.headers,
+                                       self.exc_info)
+            return
+        headers = []
+        for name, value in self.headers:
+            lower = name.lower()
+            if lower == 'etag' and value.endswith('"'):
+                value = '%s-%s"' % (value[:-1], self.encoding)
+            elif lower == 'content-length' and compress:
+                continue
+            elif lower == 'vary':
+                continue
+            headers.append((name, value))
+        vary = self._header('vary')
+        headers.append(('Vary', vary + ', Accept-Encoding'
+                        if vary else 'Accept-Encoding'))
+        if compress:
+            headers.append(('Content-Encoding', self.encoding))
+            self.compressor = zlib.compressobj(LEVEL, zlib.DEFLATED,
+                                               _WBITS[self.encoding])
+        self.server_start_response(self.status, headers, self.exc_info)
+
+    def __iter__(self):
+        if not self._compressible():
+            self.server_start_response(self.status, self.headers,
+                                       self.exc_info)
+            for chunk in self.pending:
+                yield chunk
+            for chunk in self.body:
+                yield chunk
+            return
+
+        # Hold back data until there's enough of it to be worth
+        # compressing, or the body turns out to be small.
+        iterator = iter(self.body)
+        buffered = self.pending
+        size = sum(len(chunk) for chunk in buffered)
+        for chunk in iterator:
+            buffered.append(chunk)
+            size += len(chunk)
+            if size >= MIN_SIZE:
+                break
+        else:
+            self._start(False)
+            if buffered:
+                yield ''.join(buffered)
+            return
+
+        self._start(True)
+        compressor = self.compressor
+        data = compressor.compress(''.join(buffered))
+        unflushed = size
+        del buffered[:]
+        for chunk in iterator:
+            data += compressor.compress(chunk)
+            unflushed += len(chunk)
+            if unflushed >= FLUSH_SIZE:
+                data += compressor.flush(zlib.Z_SYNC_FLUSH)
+                unflushed = 0
+            if data:
+                yield data
+                data = ''
+        yield data + compressor.flush()
+
+    def close(self):
+        if hasattr(self.body, 'close'):
+            self.body.close()
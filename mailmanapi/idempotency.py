@@ -0,0 +1,149 @@
+"""Idempotency keys for the calls that change lists.
+
+A client retrying a subscribe after a timeout can't tell whether the
+first attempt went through, and the retry used to take the list lock
+again only to be told the address is already a member.  Clients can now
+send an `Idempotency-Key` header with subscribe, unsubscribe, create
+and delete calls.  The first request with a key runs as usual and its
+response is kept in the shared `idempotency` database for `TTL`
+seconds; requests repeating the key within that time get the stored
+response back without the API touching Mailman at all.
+
+A key is bound to the request it was first used with: reusing it for a
+different one is answered with a 422, and repeating it while the first
+request is still running with a 409.  Server errors (5xx) aren't kept,
+so requests that failed that way, such as lock timeouts, can be retried
+with the same key."""
+import json
+import time
+import hashlib
+import sqlite3
+from bottle import HTTPResponse, request
+from . import storage
+from .utils import get_error_code, get_error_message, message_response
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    status INTEGER,
+    headers TEXT,
+    body BLOB,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_created ON responses (created);
+"""
+
+# Seconds a key and its response are kept.
+TTL = 24 * 3600
+
+# Seconds after which a request that never stored its response, because
+# its worker died, is presumed lost and its key can be used again.
+PENDING_TIMEOUT = 300
+
+# The routes that accept an Idempotency-Key, by (method, rule).
+ROUTES = set([
+    ('PUT', '/<listname>/members'),
+    ('DELETE', '/<listname>/members'),
+    ('POST', '/<listname>'),
+    ('DELETE', '/<listname>'),
+])
+
+
+def _connect():
+    return storage.connect('idempotency', SCHEMA)
+
+
+def _fingerprint():
+    digest = hashlib.sha1()
+    for part in (request.method, request.path, request.query_string):
+        digest.update(part + '\0')
+    digest.update(request.body.read())
+    request.body.seek(0)
+    return digest.hexdigest()
+
+
+def _begin(conn, key, fingerprint):
+    # Claims `key` for this request.  Returns None if it's new, or else
+    # the row of the request that used it first.
+    now = time.time()
+    with storage.transaction(conn):
+        conn.execute('DELETE FROM responses WHERE created < ?',
+                     (now - TTL,))
+        row = conn.execute('SELECT fingerprint, status, headers, body, '
+                           'created FROM responses WHERE key = ?',
+                           (key,)).fetchone()
+        if row is not None and row[1] is None and \
+                row[4] < now - PENDING_TIMEOUT:
+            row = None
+        if row is None:
+            conn.execute('INSERT OR REPLACE INTO responses (key, '
+                         'fingerprint, created) VALUES (?, ?, ?)',
+                         (key, fingerprint, now))
+    return row
+
+
+def _finish(conn, key, result):
+    if not isinstance(result, HTTPResponse) or result.status_code >= 500:
+        conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+        return
+    headers = [(name, value) for name, value in result.headerlist
+               if name.lower() != 'content-length']
+    conn.execute('UPDATE responses SET status = ?, headers = ?, body = ? '
+                 'WHERE key = ?',
+                 (result.status_code, json.dumps(headers),
+                  sqlite3.Binary(result.body), key))
+
+
+def _replay(row):
+    response = HTTPResponse(str(row[3]), row[1])
+    for name, value in json.loads(row[2]):
+        response[str(name)] = str(value)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+class IdempotencyPlugin(object):
+    """Bottle plugin storing and replaying the responses of requests
+    with an Idempotency-Key header."""
+    name = 'idempotency'
+    api = 2
+
+    def apply(self, callback, route):
+        if (route.method, route.rule) not in ROUTES:
+            return callback
+
+        def wrapper(*args, **kwargs):
+            key = request.get_header('Idempotency-Key')
+            if not key:
+                return callback(*args, **kwargs)
+            fingerprint = _fingerprint()
+            try:
+                conn = _connect()
+                row = _begin(conn, key, fingerprint)
+            except sqlite3.Error:
+                # Better to run the request than to fail it.
+                return callback(*args, **kwargs)
+            if row is not None:
+                if row[0] != fingerprint:
+                    return message_response(
+                        get_error_message('IdempotencyKeyReused'),
+                        get_error_code('IdempotencyKeyReused'))
+                if row[1] is None:
+                    return message_response(
+                        get_error_message('IdempotencyKeyInProgress'),
+                        get_error_code('IdempotencyKeyInProgress'))
+                return _replay(row)
+            result = None
+            try:
+                result = callback(*args, **kwargs)
+            except HTTPResponse, e:
+                result = e
+                raise
+            finally:
+                try:
+                    _finish(conn, key, result)
+                except sqlite3.Error:
+                    pass
+            return result
+        return wrapper
@@ -0,0 +1,301 @@
+"""Persistent read model of list metadata and memberships.
+
+Finding the lists an address belongs to used to mean unpickling every
+list on the server.  The index keeps, in the shared state database, the
+attributes the read endpoints report for each list and a row per member
+with their full name and digest setting, together with the config.pck
+stamp each list was indexed at.  Our own mutating endpoints update it as
+they go; lists changed behind our back (Mailman's web UI, bin/ scripts)
+have a different stamp and are re-indexed by the next `refresh()`.
+
+Address lookups always use the index.  With `READ_MODEL` set, the other
+read endpoints answer from it too, without unpickling anything:
+
+* `consistent`: every read first stats the config.pck files involved and
+  re-indexes lists that changed, so reads are never stale.
+* `stale`: reads trust the index, which is brought up to date at most
+  every `REFRESH_INTERVAL` seconds; changes made outside the API can take
+  that long to show."""
+import time
+import json
+import sqlite3
+from Mailman import MailList, Errors, Utils
+from . import storage
+from .utils import get_config_stamp
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS members (
+    listname TEXT NOT NULL,
+    address TEXT NOT NULL,
+    fullname TEXT,
+    digest INTEGER NOT NULL,
+    PRIMARY KEY (listname, address)
+);
+CREATE INDEX IF NOT EXISTS members_address ON members (address);
+CREATE TABLE IF NOT EXISTS lists (
+    listname TEXT PRIMARY KEY,
+    real_name TEXT,
+    description TEXT,
+    member_count INTEGER NOT NULL,
+    created REAL,
+    subscribe_policy INTEGER,
+    archive_private INTEGER,
+    owner TEXT
+);
+CREATE TABLE IF NOT EXISTS stamps (
+    listname TEXT PRIMARY KEY,
+    inode INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+"""
+
+# Seconds between scans for lists changed outside the API.  A scan only
+# stats each config.pck; 0 scans before every lookup.
+REFRESH_INTERVAL = 10
+
+# None (reads unpickle lists), 'consistent' or 'stale'; see above.
+READ_MODEL = None
+
+_last_refresh = 0
+
+
+def _connect():
+    return storage.connect('index', SCHEMA)
+
+
+def _indexed_stamp(conn, listname):
+    row = conn.execute('SELECT inode, mtime, size FROM stamps '
+                       'WHERE listname = ?', (listname,)).fetchone()
+    return tuple(row) if row else None
+
+
+def _reindex(conn, listname, stamp):
+    try:
+        mlist = MailList.MailList(listname, lock=False)
+    except Errors.MMUnknownListError:
+        _drop(conn, listname)
+        return
+    digest_members = set(mlist.getDigestMemberKeys())
+    members = [(listname, address.lower(), mlist.getMemberName(address),
+                address in digest_members)
+               for address in mlist.getMembers()]
+    with storage.transaction(conn):
+        conn.execute('DELETE FROM members WHERE listname = ?', (listname,))
+        conn.executemany('INSERT OR REPLACE INTO members '
+                         '(listname, address, fullname, digest) '
+                         'VALUES (?, ?, ?, ?)', members)
+        conn.execute('INSERT OR REPLACE INTO lists '
+                     '(listname, real_name, description, member_count, '
+                     'created, subscribe_policy, archive_private, owner) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                     (listname, mlist.real_name, mlist.description,
+                      len(members), mlist.created_at, mlist.subscribe_policy,
+                      mlist.archive_private, json.dumps(mlist.owner)))
+        conn.execute('INSERT OR REPLACE INTO stamps '
+                     '(listname, inode, mtime, size) VALUES (?, ?, ?, ?)',
+                     (listname,) + stamp)
+
+
+def _drop(conn, listname):
+    with storage.transaction(conn):
+        conn.execute('DELETE FROM members WHERE listname = ?', (listname,))
+        conn.execute('DELETE FROM lists WHERE listname = ?', (listname,))
+        conn.execute('DELETE FROM stamps WHERE listname = ?',
+                     (listname,))
+
+
+def refresh(force=False):
+    """Re-indexes every list whose config.pck changed since it was last
+    indexed, and forgets lists that no longer exist.
+
+    Runs at most once every `REFRESH_INTERVAL` seconds per worker unless
+    `force` is set."""
+    global _last_refresh
+    now = time.time()
+    if not force and now - _last_refresh < REFRESH_INTERVAL:
+        return
+    _last_refresh = now
+
+    conn = _connect()
+    indexed = {}
+    for row in conn.execute('SELECT listname, inode, mtime, size '
+                            'FROM stamps'):
+        indexed[row[0]] = tuple(row[1:])
+    existing = set()
+    for listname in Utils.list_names():
+        existing.add(listname)
+        # Stat before loading: a change racing with the load leaves an
+        # old stamp behind and gets picked up by the next refresh.
+        stamp = get_config_stamp(listname)
+        if stamp is not None and indexed.get(listname) != stamp:
+            _reindex(conn, listname, stamp)
+    for listname in set(indexed) - existing:
+        _drop(conn, listname)
+
+
+def sync(listname):
+    """Brings a single list up to date with its config.pck."""
+    listname = listname.lower()
+    conn = _connect()
+    stamp = get_config_stamp(listname)
+    if stamp is None:
+        if _indexed_stamp(conn, listname) is not None:
+            _drop(conn, listname)
+    elif _indexed_stamp(conn, listname) != stamp:
+        _reindex(conn, listname, stamp)
+
+
+def record_list(listname):
+    """Indexes or forgets a list one of our endpoints has just created or
+    deleted."""
+    try:
+        sync(listname)
+    except sqlite3.Error:
+        # Left for the next refresh().
+        pass
+
+
+def _prepare(listname=None):
+    # Applies the READ_MODEL consistency mode before a read.
+    if READ_MODEL == 'consistent':
+        if listname is None:
+            refresh(force=True)
+        else:
+            sync(listname)
+    else:
+        refresh()
+    return _connect()
+
+
+def get_stamp(listname):
+    """Returns the config.pck stamp the index holds for `listname`, or
+    None if it holds no such list."""
+    conn = _prepare(listname)
+    return _indexed_stamp(conn, listname.lower())
+
+
+def get_stamps():
+    """Returns a dictionary mapping every indexed list to the config.pck
+    stamp it was indexed at."""
+    conn = _prepare()
+    return dict((row[0], tuple(row[1:])) for row in conn.execute(
+        'SELECT listname, inode, mtime, size FROM stamps'))
+
+
+def lists_for_address(address):
+    """Returns the sorted names of the lists `address` is subscribed to."""
+    refresh()
+    rows = _connect().execute('SELECT listname FROM members '
+                              'WHERE address = ? ORDER BY listname',
+                              (address.lower(),))
+    return [row[0] for row in rows]
+
+
+def _list_values(row):
+    return {'listname': row[0],
+            'real_name': row[1],
+            'description': row[2],
+            'member_count': row[3],
+            'created': row[4],
+            'subscribe_policy': row[5],
+            'archive_private': row[6],
+            'owner': json.loads(row[7])}
+
+
+_LIST_COLUMNS = ('lists.listname, real_name, description, member_count, '
+                 'created, subscribe_policy, archive_private, owner')
+
+
+def get_lists(address=None):
+    """Returns the attributes of every list, or of the lists `address` is
+    subscribed to, sorted by list name."""
+    conn = _prepare()
+    if address:
+        rows = conn.execute('SELECT %s FROM lists JOIN members '
+                            'ON members.listname = lists.listname '
+                            'WHERE address = ? ORDER BY lists.listname'
+                            % _LIST_COLUMNS, (address.lower(),))
+    else:
+        rows = conn.execute('SELECT %s FROM lists ORDER BY listname'
+                            % _LIST_COLUMNS)
+    return [_list_values(row) for row in rows]
+
+
+def get_list(listname):
+    """Returns the attributes of `listname`, or None if there's no such
+    list."""
+    conn = _prepare(listname)
+    row = conn.execute('SELECT %s FROM lists WHERE listname = ?'
+                       % _LIST_COLUMNS, (listname.lower(),)).fetchone()
+    return _list_values(row) if row else None
+
+
+def get_members(listname, after=None, limit=None):
+    """Returns the sorted member addresses of `listname`, or None if
+    there's no such list.
+
+    Only addresses sorting after `after` are returned, and at most `limit`
+    of them."""
+    listname = listname.lower()
+    conn = _prepare(listname)
+    if _indexed_stamp(conn, listname) is None:
+        return None
+    query = 'SELECT address FROM members WHERE listname = ?'
+    args = [listname]
+    if after:
+        query += ' AND address > ?'
+        args.append(after.lower())
+    query += ' ORDER BY address'
+    if limit is not None:
+        query += ' LIMIT ?'
+        args.append(limit)
+    return [row[0] for row in conn.execute(query, args)]
+
+
+def get_member(listname, address):
+    """Returns the (address, fullname) of a member of `listname`, or None
+    if they aren't one."""
+    conn = _prepare(listname)
+    row = conn.execute('SELECT address, fullname FROM members '
+                       'WHERE listname = ? AND address = ?',
+                       (listname.lower(), address.lower())).fetchone()
+    return tuple(row) if row else None
+
+
+def record_changes(listname, stamp, added=(), removed=()):
+    """Applies membership changes one of our endpoints has just saved.
+
+    `stamp` is the config.pck stamp the list was loaded with and the list
+    must still be locked.  `added` holds (address, fullname, digest)
+    tuples and `removed` addresses.  If the index was already up to date
+    with that version it moves to the saved one; otherwise the list
+    changed behind our back and is left for `refresh()` to re-index in
+    full."""
+    listname = listname.lower()
+    try:
+        conn = _connect()
+        with storage.transaction(conn):
+            if _indexed_stamp(conn, listname) != stamp:
+                return
+            conn.executemany('INSERT OR REPLACE INTO members '
+                             '(listname, address, fullname, digest) '
+                             'VALUES (?, ?, ?, ?)',
+                             ((listname, address.lower(), fullname,
+                               bool(digest))
+                              for address, fullname, digest in added))
+            conn.executemany('DELETE FROM members '
+                             'WHERE listname = ? AND address = ?',
+                             ((listname, address.lower())
+                              for address in removed))
+            conn.execute('UPDATE lists SET member_count = '
+                         '(SELECT COUNT(*) FROM members WHERE listname = ?) '
+                         'WHERE listname = ?', (listname, listname))
+            conn.execute('UPDATE stamps '
+                         'SET inode = ?, mtime = ?, size = ? '
+                         'WHERE listname = ?',
+                         get_config_stamp(listname) + (listname,))
+    except sqlite3.Error:
+        # The list keeps its old stamp, so the next refresh() re-indexes
+        # it from config.pck; the mutation itself has already succeeded.
+        pass
@@ -0,0 +1,226 @@
+"""Durable queue of long-running jobs, such as creating or deleting lists.
+
+Endpoints called with `async=true` queue a job in the shared `jobs`
+database and answer 202 straight away instead of doing the work inside
+the request, where deleting years of archives can outlast gunicorn's
+timeout.  Every worker process runs `WORKERS` threads that claim queued
+jobs and run their handler.
+
+A running job holds a lease that its handler renews whenever it reports
+progress.  If the process running it dies (or gunicorn retires it), the
+lease runs out and another worker runs the job again, up to
+`MAX_ATTEMPTS` times, so handlers must cope with being re-run over
+partially done work.
+
+A job's parameters, which can hold secrets such as a new list's
+password, are erased as soon as it finishes; finished jobs keep only
+their status, for `EXPIRY` seconds."""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+import traceback
+from bottle import HTTPResponse
+from . import storage
+from .utils import json_response, message_response
+
+SCHEMA = """
+-- Erased parameters mustn't linger in free pages of the database file.
+PRAGMA secure_delete=ON;
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    listname TEXT,
+    params TEXT NOT NULL,
+    state TEXT NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    total INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    status INTEGER,
+    message TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created);
+"""
+
+# Job-running threads per worker process.  Mailman's list locks and
+# i18n aren't meant for threads, so one per process is the safe choice.
+WORKERS = 1
+
+# Seconds a job may go without reporting progress before it is presumed
+# lost and run again.
+LEASE = 60
+
+# Runs of a job, counting the first, before a lost job is failed.
+MAX_ATTEMPTS = 3
+
+# Seconds an idle worker thread waits before looking for jobs again.
+POLL_INTERVAL = 1
+
+# Finished jobs are purged after this many seconds.
+EXPIRY = 7 * 24 * 3600
+
+# Job kind -> handler(listname, params, progress) returning a
+# (status_code, message) pair; see `handler`.
+HANDLERS = {}
+
+_wakeup = threading.Event()
+_started = {'pid': None}
+_start_lock = threading.Lock()
+
+
+def _connect():
+    return storage.connect('jobs', SCHEMA)
+
+
+def handler(kind):
+    """Decorator registering the function that runs jobs of `kind`.
+
+    It is called with the job's list name, its parameters and a
+    `progress(done, total=None)` callback, which also renews the job's
+    lease, and returns the (status_code, message) reported as the job's
+    result."""
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+
+def submit(kind, listname, params):
+    """Queues a job and returns its id."""
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    conn = _connect()
+    with storage.transaction(conn):
+        conn.execute('INSERT INTO jobs (id, kind, listname, params, state, '
+                     'created) VALUES (?, ?, ?, ?, ?, ?)',
+                     (job_id, kind, listname, json.dumps(params), 'queued',
+                      now))
+        conn.execute("DELETE FROM jobs WHERE state IN ('done', 'failed') "
+                     "AND finished < ?", (now - EXPIRY,))
+    start()
+    _wakeup.set()
+    return job_id
+
+
+def get(job_id):
+    """Returns the status of a job as a dictionary, or None if there's no
+    such job."""
+    row = _connect().execute(
+        'SELECT id, kind, listname, state, done, total, attempts, status, '
+        'message, created, started, finished FROM jobs WHERE id = ?',
+        (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = {'id': row[0],
+           'kind': row[1],
+           'listname': row[2],
+           'state': row[3],
+           'progress': {'done': row[4], 'total': row[5]},
+           'attempts': row[6],
+           'created': row[9],
+           'started': row[10],
+           'finished': row[11]}
+    if row[7] is not None:
+        job['result'] = {'status': row[7], 'message': row[8]}
+    return job
+
+
+def _claim(conn):
+    # Takes the oldest queued job, or one whose lease ran out, failing
+    # lost jobs that have used up their attempts.
+    now = time.time()
+    with storage.transaction(conn):
+        conn.execute("UPDATE jobs SET state = 'failed', status = 500, "
+                     "message = 'Job lost too many times', params = '{}', "
+                     "finished = ? WHERE state = 'running' AND "
+                     "lease_until < ? AND attempts >= ?",
+                     (now, now, MAX_ATTEMPTS))
+        row = conn.execute("SELECT id, kind, listname, params FROM jobs "
+                           "WHERE state = 'queued' OR "
+                           "(state = 'running' AND lease_until < ?) "
+                           "ORDER BY created LIMIT 1", (now,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE jobs SET state = 'running', "
+                     "attempts = attempts + 1, started = ?, "
+                     "lease_until = ? WHERE id = ?",
+                     (now, now + LEASE, row[0]))
+    return row[0], row[1], row[2], json.loads(row[3])
+
+
+def _progress(conn, job_id):
+    def progress(done, total=None):
+        conn.execute('UPDATE jobs SET done = ?, total = COALESCE(?, total), '
+                     'lease_until = ? WHERE id = ?',
+                     (done, total, time.time() + LEASE, job_id))
+    return progress
+
+
+def run_next():
+    """Runs the next job, returning False if there was none."""
+    conn = _connect()
+    job = _claim(conn)
+    if job is None:
+        return False
+    job_id, kind, listname, params = job
+    try:
+        function = HANDLERS[kind]
+        status, message = function(listname, params,
+                                   _progress(conn, job_id))
+    except HTTPResponse, e:
+        status, message = e.status_code, json.loads(e.body)['message']
+    except Exception:
+        status, message = 500, traceback.format_exc().splitlines()[-1]
+    conn.execute("UPDATE jobs SET state = ?, status = ?, message = ?, "
+                 "params = '{}', finished = ?, lease_until = NULL "
+                 "WHERE id = ?",
+                 ('done' if status < 400 else 'failed', status, message,
+                  time.time(), job_id))
+    return True
+
+
+def _work():
+    while True:
+        _wakeup.clear()
+        try:
+            while run_next():
+                pass
+        except sqlite3.Error:
+            # The database is busy or unavailable; try again later.
+            pass
+        _wakeup.wait(POLL_INTERVAL)
+
+
+def start():
+    """Starts this process's job-running threads unless they are already
+    running.  Called after forking each worker and on first submit."""
+    with _start_lock:
+        if _started['pid'] == os.getpid():
+            return
+        _started['pid'] = os.getpid()
+        for _ in xrange(WORKERS):
+            thread = threading.Thread(target=_work, name='mailmanapi-jobs')
+            thread.daemon = True
+            thread.start()
+
+
+def job_status(job_id):
+    """Reports the progress and result of an asynchronous job.
+
+    **Method**: GET
+
+    **URI**: /_jobs/<job_id>
+
+    Returns the job's `state` (`queued`, `running`, `done` or `failed`),
+    its `progress` as `done` and `total` steps, and once it has finished
+    its `result` as a `status` code and `message`."""
+    job = get(job_id)
+    if job is None:
+        return message_response('Unknown job: ' + job_id, 404)
+    return json_response(job)
@@ -0,0 +1,322 @@
+"""Prometheus metrics for the API, aggregated across gunicorn workers.
+
+Each worker keeps its counters and histograms in memory and writes them to
+its own snapshot file under `STATE_DIR/metrics` at most every
+`FLUSH_INTERVAL` seconds and when it exits.  The metrics endpoint merges
+the snapshots of every worker, so the numbers it reports are totals for
+the whole server.  Snapshots left behind by workers gunicorn has retired
+are folded into a single archive file as they are found, which keeps the
+totals monotonic without letting files pile up."""
+import os
+import time
+import errno
+import fcntl
+import atexit
+import random
+import cPickle
+import threading
+from contextlib import contextmanager
+from bottle import HTTPResponse, response
+from . import storage
+
+# Seconds between snapshot writes of a worker's metrics.
+FLUSH_INTERVAL = 1
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+           5, 10, 30, 60)
+
+METRICS = {
+    'mailmanapi_requests_total': (
+        'counter', 'Requests handled, by route and status.'),
+    'mailmanapi_request_duration_seconds': (
+        'histogram', 'Time spent handling requests, by route and status.'),
+    'mailmanapi_phase_duration_seconds': (
+        'histogram', 'Time spent in each phase of a request: lock, '
+                     'unpickle, mutation, save and serialize.'),
+    'mailmanapi_lock_wait_seconds': (
+        'histogram', 'Time spent waiting for list locks, by list.'),
+    'mailmanapi_lock_timeouts_total': (
+        'counter', 'List lock waits that timed out, by list.'),
+    'mailmanapi_commit_duration_seconds': (
+        'histogram', 'Time lists were held locked for a change, by whether '
+                     'they had to be saved.'),
+    'mailmanapi_list_cache_hits_total': (
+        'counter', 'Reads served from the list cache.'),
+    'mailmanapi_list_cache_misses_total': (
+        'counter', 'Reads that had to unpickle config.pck.'),
+    'mailmanapi_list_cache_evictions_total': (
+        'counter', 'Lists evicted from the list cache.'),
+    'mailmanapi_outbox_depth': (
+        'gauge', 'Notifications in the outbox, pending or given up.'),
+    'mailmanapi_outbox_sent_total': (
+        'counter', 'Notifications sent from the outbox.'),
+    'mailmanapi_outbox_retries_total': (
+        'counter', 'Notification sends that failed and will be retried.'),
+    'mailmanapi_outbox_given_up_total': (
+        'counter', 'Notifications given up after too many failures.'),
+}
+
+# Called before every snapshot to set counters kept elsewhere, such as
+# the list cache's.
+collectors = []
+
+# Called when metrics are collected for values that are the same whoever
+# reads them, such as queue depths, and so mustn't be summed across
+# workers.  Each returns a list of (name, labels, value) tuples.
+gauges = []
+
+_lock = threading.Lock()
+_current = threading.local()
+_state = {'pid': None}
+
+
+def _registry():
+    # A forked worker starts from scratch rather than re-reporting what
+    # its parent had already counted.
+    if _state['pid'] != os.getpid():
+        _state.update(pid=os.getpid(),
+                      token='%d-%08x' % (os.getpid(),
+                                         random.getrandbits(32)),
+                      counters={},
+                      histograms={},
+                      flushed=time.time())
+    return _state
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    with _lock:
+        counters = _registry()['counters']
+        key = _key(name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+
+def set_counter(name, value, **labels):
+    with _lock:
+        _registry()['counters'][_key(name, labels)] = value
+
+
+def observe(name, seconds, **labels):
+    with _lock:
+        histograms = _registry()['histograms']
+        key = _key(name, labels)
+        values = histograms.get(key)
+        if values is None:
+            values = histograms[key] = [0] * (len(BUCKETS) + 2)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                values[i] += 1
+                break
+        values[-2] += seconds
+        values[-1] += 1
+
+
+@contextmanager
+def phase(name):
+    """Times the enclosed block as phase `name` of the current request."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        observe('mailmanapi_phase_duration_seconds', time.time() - start,
+                route=getattr(_current, 'route', ''), phase=name)
+
+
+def _metrics_dir():
+    return os.path.dirname(storage.state_path('metrics', 'archive.pck'))
+
+
+def _read(path):
+    try:
+        fp = open(path, 'rb')
+    except IOError:
+        return None
+    try:
+        return cPickle.load(fp)
+    except (EOFError, cPickle.UnpicklingError):
+        return None
+    finally:
+        fp.close()
+
+
+def _write(path, snapshot):
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    fp = open(tmp, 'wb')
+    try:
+        cPickle.dump(snapshot, fp, cPickle.HIGHEST_PROTOCOL)
+    finally:
+        fp.close()
+    os.rename(tmp, path)
+
+
+def _merge(into, snapshot):
+    for key, value in snapshot['counters'].items():
+        into['counters'][key] = into['counters'].get(key, 0) + value
+    for key, values in snapshot['histograms'].items():
+        merged = into['histograms'].get(key)
+        if merged is None:
+            into['histograms'][key] = list(values)
+        else:
+            into['histograms'][key] = [a + b for a, b in zip(merged, values)]
+
+
+def flush():
+    """Writes this worker's snapshot file."""
+    for collector in collectors:
+        collector()
+    with _lock:
+        state = _registry()
+        snapshot = {'counters': dict(state['counters']),
+                    'histograms': dict((key, list(values)) for key, values
+                                       in state['histograms'].items())}
+        state['flushed'] = time.time()
+        token = state['token']
+    _write(os.path.join(_metrics_dir(), token + '.pck'), snapshot)
+
+
+def maybe_flush():
+    if time.time() - _registry()['flushed'] >= FLUSH_INTERVAL:
+        flush()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+def collect():
+    """Returns the merged snapshot of every worker, past and present."""
+    flush()
+    directory = _metrics_dir()
+    fd = os.open(os.path.join(directory, '.lock'), os.O_RDWR | os.O_CREAT,
+                 0660)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        archive_path = os.path.join(directory, 'archive.pck')
+        archive = _read(archive_path) or {'counters': {}, 'histograms': {}}
+        total = {'counters': {}, 'histograms': {}}
+        _merge(total, archive)
+        retired = []
+        for filename in os.listdir(directory):
+            if not filename.endswith('.pck') or filename == 'archive.pck':
+                continue
+            path = os.path.join(directory, filename)
+            snapshot = _read(path)
+            if snapshot is None:
+                continue
+            _merge(total, snapshot)
+            if not _alive(int(filename.split('-')[0])):
+                _merge(archive, snapshot)
+                retired.append(path)
+        if retired:
+            _write(archive_path, archive)
+            for path in retired:
+                os.unlink(path)
+    finally:
+        os.close(fd)
+    for gauge in gauges:
+        for name, labels, value in gauge():
+            total['counters'][_key(name, labels)] = value
+    return total
+
+
+def _format_labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, unicode(value).replace('\\', '\\\\')
+                     .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels)
+
+
+def render(snapshot):
+    """Formats a snapshot in the Prometheus text exposition format."""
+    series = {}
+    for (name, labels), value in snapshot['counters'].items():
+        series.setdefault(name, []).append(
+            '%s%s %s' % (name, _format_labels(labels), value))
+    for (name, labels), values in snapshot['histograms'].items():
+        lines = series.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip(BUCKETS, values):
+            cumulative += count
+            lines.append('%s_bucket%s %d' % (
+                name, _format_labels(labels, [('le', repr(float(bound)))]),
+                cumulative))
+        lines.append('%s_bucket%s %d' % (
+            name, _format_labels(labels, [('le', '+Inf')]), values[-1]))
+        lines.append('%s_sum%s %r' % (name, _format_labels(labels),
+                                      values[-2]))
+        lines.append('%s_count%s %d' % (name, _format_labels(labels),
+                                        values[-1]))
+    output = []
+    for name in sorted(series):
+        kind, description = METRICS.get(name, ('untyped', ''))
+        output.append('# HELP %s %s' % (name, description))
+        output.append('# TYPE %s %s' % (name, kind))
+        output.extend(sorted(series[name]))
+    return '\n'.join(output).encode('utf-8') + '\n'
+
+
+class MetricsPlugin(object):
+    """Bottle plugin counting and timing every request by route, method
+    and status."""
+    name = 'metrics'
+    api = 2
+
+    def apply(self, callback, route):
+        rule = route.rule
+        method = route.method
+
+        def wrapper(*args, **kwargs):
+            _current.route = '%s %s' % (method, rule)
+            start = time.time()
+            status = 500
+            try:
+                result = callback(*args, **kwargs)
+                if isinstance(result, HTTPResponse):
+                    status = result.status_code
+                else:
+                    status = response.status_code
+                return result
+            except HTTPResponse, e:
+                status = e.status_code
+                raise
+            finally:
+                labels = {'method': method, 'route': rule,
+                          'status': str(status)}
+                inc('mailmanapi_requests_total', **labels)
+                observe('mailmanapi_request_duration_seconds',
+                        time.time() - start, **labels)
+                _current.route = ''
+                maybe_flush()
+        return wrapper
+
+
+def metrics():
+    """Reports request, phase and lock metrics for all workers.
+
+    **Method**: GET
+
+    **URI**: /_metrics
+
+    Returns the metrics in the Prometheus text exposition format."""
+    return HTTPResponse(body=render(collect()),
+                        content_type='text/plain; version=0.0.4')
+
+
+@atexit.register
+def _flush_at_exit():
+    state = _registry()
+    if state['counters'] or state['histograms']:
+        try:
+            flush()
+        except EnvironmentError:
+            pass
@@ -0,0 +1,193 @@
+"""Background delivery of the notification emails the API sends.
+
+Creating a list used to render its notification and hand it to
+Mailman's outgoing queue inside the request.  Endpoints now `queue()` a
+notification in the shared `outbox` database instead, and every worker
+process runs a sender thread that renders and sends whatever is due.
+
+Senders take up to `BATCH_SIZE` notifications at a time, loading each
+list once per batch however many notifications it has, so a burst of
+list creations is sent in a few passes.  A notification that fails to
+send is retried after `RETRY_DELAY` seconds, doubling for every failed
+attempt, and given up after `MAX_ATTEMPTS`; given-up notifications stay
+in the outbox for a week for inspection.  Notifications are claimed for
+`LEASE` seconds, so those claimed by a worker that dies are sent by
+another one afterwards; delivery is at least once."""
+import os
+import json
+import time
+import sqlite3
+import threading
+import traceback
+from Mailman import MailList, Errors
+from . import metrics, storage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    listname TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    given_up INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (given_up, next_attempt);
+"""
+
+# Notifications claimed and sent per pass.
+BATCH_SIZE = 100
+
+# Seconds before the first retry of a failed notification.
+RETRY_DELAY = 30
+
+# Attempts before a notification is given up.
+MAX_ATTEMPTS = 5
+
+# Seconds a sender has to send the notifications it claimed.
+LEASE = 300
+
+# Seconds an idle sender waits before looking for due notifications.
+POLL_INTERVAL = 5
+
+# Given-up notifications are purged after this many seconds.
+EXPIRY = 7 * 24 * 3600
+
+# Notification kind -> renderer(mlist, params) returning the Mailman
+# Message to send; see `renderer`.
+RENDERERS = {}
+
+_wakeup = threading.Event()
+_started = {'pid': None}
+_start_lock = threading.Lock()
+
+
+def _connect():
+    return storage.connect('outbox', SCHEMA)
+
+
+def renderer(kind):
+    """Decorator registering the function that builds notifications of
+    `kind`: called with the loaded list and the parameters given to
+    `queue()`, it returns the message to send."""
+    def register(function):
+        RENDERERS[kind] = function
+        return function
+    return register
+
+
+def queue(listname, kind, params):
+    """Queues a notification about `listname` for the sender threads."""
+    now = time.time()
+    conn = _connect()
+    with storage.transaction(conn):
+        conn.execute('INSERT INTO outbox (listname, kind, params, '
+                     'next_attempt, created) VALUES (?, ?, ?, ?, ?)',
+                     (listname, kind, json.dumps(params), now, now))
+    start()
+    _wakeup.set()
+
+
+def _claim(conn):
+    now = time.time()
+    with storage.transaction(conn):
+        rows = conn.execute('SELECT id, listname, kind, params, attempts '
+                            'FROM outbox WHERE given_up = 0 AND '
+                            'next_attempt <= ? ORDER BY listname, id '
+                            'LIMIT ?', (now, BATCH_SIZE)).fetchall()
+        conn.executemany('UPDATE outbox SET next_attempt = ? WHERE id = ?',
+                         [(now + LEASE, row[0]) for row in rows])
+        conn.execute('DELETE FROM outbox WHERE given_up = 1 AND '
+                     'created < ?', (now - EXPIRY,))
+    return rows
+
+
+def _failed(conn, notification_id, attempts, error):
+    attempts += 1
+    if attempts >= MAX_ATTEMPTS:
+        conn.execute('UPDATE outbox SET attempts = ?, given_up = 1, '
+                     'last_error = ? WHERE id = ?',
+                     (attempts, error, notification_id))
+        metrics.inc('mailmanapi_outbox_given_up_total')
+    else:
+        conn.execute('UPDATE outbox SET attempts = ?, next_attempt = ?, '
+                     'last_error = ? WHERE id = ?',
+                     (attempts,
+                      time.time() + RETRY_DELAY * 2 ** (attempts - 1),
+                      error, notification_id))
+        metrics.inc('mailmanapi_outbox_retries_total')
+
+
+def send_batch():
+    """Sends the next batch of due notifications and returns how many
+    were claimed."""
+    conn = _connect()
+    rows = _claim(conn)
+    lists = {}
+    for notification_id, listname, kind, params, attempts in rows:
+        try:
+            if listname not in lists:
+                lists[listname] = MailList.MailList(listname, lock=False)
+            msg = RENDERERS[kind](lists[listname], json.loads(params))
+            msg.send(lists[listname])
+        except Errors.MMUnknownListError:
+            # The list is gone, and its notification with it.
+            conn.execute('DELETE FROM outbox WHERE id = ?',
+                         (notification_id,))
+        except Exception:
+            _failed(conn, notification_id, attempts,
+                    traceback.format_exc().splitlines()[-1])
+        else:
+            conn.execute('DELETE FROM outbox WHERE id = ?',
+                         (notification_id,))
+            metrics.inc('mailmanapi_outbox_sent_total')
+    return len(rows)
+
+
+def _work():
+    while True:
+        _wakeup.clear()
+        try:
+            while send_batch() == BATCH_SIZE:
+                pass
+        except sqlite3.Error:
+            # The database is busy or unavailable; try again later.
+            pass
+        _wakeup.wait(POLL_INTERVAL)
+
+
+def start():
+    """Starts this process's sender thread unless it is already running.
+    Called after forking each worker and on first use."""
+    with _start_lock:
+        if _started['pid'] == os.getpid():
+            return
+        _started['pid'] = os.getpid()
+        thread = threading.Thread(target=_work, name='mailmanapi-outbox')
+        thread.daemon = True
+        thread.start()
+
+
+def depth():
+    """Returns the number of notifications waiting to be sent and given
+    up, as a dictionary."""
+    rows = _connect().execute('SELECT given_up, COUNT(*) FROM outbox '
+                              'GROUP BY given_up')
+    counts = {'pending': 0, 'given_up': 0}
+    for given_up, count in rows:
+        counts['given_up' if given_up else 'pending'] = count
+    return counts
+
+
+def _gauges():
+    try:
+        counts = depth()
+    except sqlite3.Error:
+        return []
+    return [('mailmanapi_outbox_depth', {'state': state}, count)
+            for state, count in counts.items()]
+
+
+metrics.gauges.append(_gauges)
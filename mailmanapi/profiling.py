@@ -0,0 +1,142 @@
+"""Sampled request profiling.
+
+`ProfilerMiddleware` runs a random `SAMPLE_RATE` fraction of requests,
+plus any request whose `X-Profile` header matches `TOKEN`, under cProfile.
+Each profile, covering both the handler and the streaming of its body, is
+written to `DIRECTORY` as a .prof file that can be loaded with pstats or
+snakeviz.  Only the newest `MAX_FILES` profiles are kept, and
+`summary.txt` lists the `TOP_N` functions by cumulative time across them.
+
+Requests that aren't profiled pay for one random number, and the summary
+is rebuilt at most every `SUMMARY_INTERVAL` seconds per worker, so the
+middleware can be left on under load."""
+import os
+import re
+import hmac
+import time
+import pstats
+import random
+import cProfile
+from StringIO import StringIO
+
+# Where profiles are written; profiling is off while this is None.
+DIRECTORY = None
+
+# Fraction of requests profiled at random.
+SAMPLE_RATE = 0.0
+
+# Requests with an `X-Profile: <TOKEN>` header are always profiled.
+TOKEN = None
+
+MAX_FILES = 100
+
+TOP_N = 30
+
+SUMMARY_INTERVAL = 60
+
+
+class ProfilerMiddleware(object):
+
+    def __init__(self, app):
+        self.app = app
+        self.last_summary = 0
+
+    def __call__(self, environ, start_response):
+        if not self.should_profile(environ):
+            return self.app(environ, start_response)
+        profiler = cProfile.Profile()
+        start = time.time()
+        body = profiler.runcall(self.app, environ, start_response)
+        return _ProfiledBody(self, profiler, environ, body, start)
+
+    def should_profile(self, environ):
+        token = environ.get('HTTP_X_PROFILE')
+        if token and TOKEN and hmac.compare_digest(token, TOKEN):
+            return True
+        return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+    def save(self, profiler, environ, elapsed):
+        path = re.sub(r'[^A-Za-z0-9_.-]+', '_',
+                      environ.get('PATH_INFO', '')).strip('_') or 'root'
+        filename = '%s-%s-%s-%d-%dms.prof' % (
+            time.strftime('%Y%m%d%H%M%S'), environ.get('REQUEST_METHOD'),
+            path[:60], os.getpid(), elapsed * 1000)
+        if not os.path.isdir(DIRECTORY):
+            os.makedirs(DIRECTORY)
+        profiler.dump_stats(os.path.join(DIRECTORY, filename))
+
+        profiles = sorted(name for name in os.listdir(DIRECTORY)
+                          if name.endswith('.prof'))
+        for name in profiles[:-MAX_FILES]:
+            try:
+                os.unlink(os.path.join(DIRECTORY, name))
+            except OSError:
+                # Another worker removed it first.
+                pass
+        if time.time() - self.last_summary >= SUMMARY_INTERVAL:
+            self.last_summary = time.time()
+            self.write_summary(profiles[-MAX_FILES:])
+
+    def write_summary(self, profiles):
+        output = StringIO()
+        stats = None
+        for name in profiles:
+            path = os.path.join(DIRECTORY, name)
+            try:
+                if stats is None:
+                    stats = pstats.Stats(path, stream=output)
+                else:
+                    stats.add(path)
+            except (IOError, EOFError, ValueError):
+                # Rotated away by another worker, or still being written.
+                continue
+        if stats is None:
+            return
+        output.write('Top %d functions by cumulative time over the last '
+                     '%d profiles, generated %s\n\n' % (
+                         TOP_N, len(profiles), time.ctime()))
+        stats.sort_stats('cumulative').print_stats(TOP_N)
+        summary = os.path.join(DIRECTORY, 'summary.txt')
+        tmp = '%s.%d.tmp' % (summary, os.getpid())
+        fp = open(tmp, 'w')
+        try:
+            fp.write(output.getvalue())
+        finally:
+            fp.close()
+        os.rename(tmp, summary)
+
+
+class _ProfiledBody(object):
+    """Response body that keeps profiling while it is iterated and saves
+    the profile when the server closes it."""
+
+    def __init__(self, middleware, profiler, environ, body, start):
+        self.middleware = middleware
+        self.profiler = profiler
+        self.environ = environ
+        self.body = body
+        self.start = start
+
+    def __iter__(self):
+        iterator = self.profiler.runcall(iter, self.body)
+        while True:
+            self.profiler.enable()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.profiler.disable()
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            try:
+                self.middleware.save(self.profiler, self.environ,
+                                     time.time() - self.start)
+            except EnvironmentError:
+                # A full or unwritable disk must not fail the request.
+                pass
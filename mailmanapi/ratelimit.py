@@ -0,0 +1,168 @@
+"""Token-bucket admission control, shared by every gunicorn worker.
+
+Each request costs a token from two buckets: its client's, keyed by its
+`X-API-Key` header if that is one of the configured `API_KEYS` or else
+by its remote address, and, for routes about a
+single list, that list's.  Buckets fill up at a steady rate to a maximum
+burst; a request finding either bucket empty is answered straight away
+with a 429 and a `Retry-After` header saying when a token will be there,
+before it can queue up for a list lock.
+
+Limits are set per route class: `read`, `write` and `scan` for the
+expensive requests that go over every list.  Classes without a limit
+aren't limited.  Buckets live in the shared `ratelimit` database, so a
+client gets the same allowance however its requests are spread over the
+workers."""
+import math
+import time
+import hashlib
+import sqlite3
+from bottle import request
+from . import storage
+from .utils import get_error_code, get_error_message, message_response
+
+SCHEMA = """
+-- Buckets are soft state: losing the last few updates in a crash only
+-- refills them early, so commits needn't wait for the disk.
+PRAGMA synchronous=NORMAL;
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+ROUTE_CLASSES = ('read', 'write', 'scan')
+
+# Route class -> (tokens per second, burst) for each client and for each
+# list, e.g. {'write': (5, 20)}.
+CLIENT_LIMITS = {}
+LIST_LIMITS = {}
+
+# X-API-Key values that give a client a bucket of its own.  Other keys
+# are ignored, so a client can't escape its limit by changing its key.
+API_KEYS = set()
+
+# Routes whose class isn't simply `read` for GETs and `write` otherwise,
+# by (method, rule); None exempts a route.
+ROUTES = {
+    ('GET', '/'): 'scan',
+    ('DELETE', '/_members'): 'scan',
+    ('GET', '/_export'): 'scan',
+    ('GET', '/_metrics'): None,
+}
+
+# Seconds between purges of buckets that have been idle long enough to
+# be full again.
+PURGE_INTERVAL = 600
+
+_last_purge = 0
+
+
+def _connect():
+    return storage.connect('ratelimit', SCHEMA)
+
+
+def parse_limit(value):
+    """Parses a `class:rate:burst` command line value into a (class,
+    (rate, burst)) pair."""
+    try:
+        route_class, rate, burst = value.split(':')
+        rate, burst = float(rate), float(burst)
+    except ValueError:
+        raise ValueError('expected class:rate:burst, got %r' % value)
+    if route_class not in ROUTE_CLASSES:
+        raise ValueError('unknown route class: %s' % route_class)
+    if rate <= 0 or burst < 1:
+        raise ValueError('rate must be positive and burst at least 1')
+    return route_class, (rate, burst)
+
+
+def classify(method, rule):
+    """Returns the route class of a route, or None if it's exempt."""
+    if (method, rule) in ROUTES:
+        return ROUTES[(method, rule)]
+    return 'read' if method in ('GET', 'HEAD') else 'write'
+
+
+def client_key(environ):
+    api_key = environ.get('HTTP_X_API_KEY')
+    if api_key in API_KEYS:
+        # Don't keep the keys themselves lying around on disk.
+        return 'key:' + hashlib.sha1(api_key).hexdigest()[:16]
+    return 'addr:' + environ.get('REMOTE_ADDR', '')
+
+
+def _purge(conn, now):
+    global _last_purge
+    if now - _last_purge < PURGE_INTERVAL:
+        return
+    _last_purge = now
+    # No limit takes longer than this to refill a bucket.
+    limits = CLIENT_LIMITS.values() + LIST_LIMITS.values()
+    refill = max(burst / rate for rate, burst in limits)
+    conn.execute('DELETE FROM buckets WHERE updated < ?', (now - refill,))
+
+
+def take(buckets):
+    """Takes a token from each of `buckets`, a list of (key, (rate,
+    burst)) pairs, if every one has a token to give.
+
+    Returns 0 on success, or else the seconds until they all will."""
+    now = time.time()
+    conn = _connect()
+    with storage.transaction(conn):
+        wait = 0
+        updates = []
+        for key, (rate, burst) in buckets:
+            row = conn.execute('SELECT tokens, updated FROM buckets '
+                               'WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                tokens = burst
+            else:
+                tokens = min(burst, row[0] + (now - row[1]) * rate)
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) / rate)
+            updates.append((key, tokens - 1, now))
+        if not wait:
+            conn.executemany('INSERT OR REPLACE INTO buckets '
+                             '(key, tokens, updated) VALUES (?, ?, ?)',
+                             updates)
+        _purge(conn, now)
+    return wait
+
+
+class RateLimitPlugin(object):
+    """Bottle plugin answering 429 to requests over their limits."""
+    name = 'ratelimit'
+    api = 2
+
+    def apply(self, callback, route):
+        route_class = classify(route.method, route.rule)
+        if route_class is None:
+            return callback
+
+        def wrapper(*args, **kwargs):
+            buckets = []
+            if route_class in CLIENT_LIMITS:
+                buckets.append(('client:%s:%s' % (
+                    client_key(request.environ), route_class),
+                    CLIENT_LIMITS[route_class]))
+            listname = kwargs.get('listname')
+            if listname and route_class in LIST_LIMITS:
+                buckets.append(('list:%s:%s' % (listname.lower(),
+                                                route_class),
+                                LIST_LIMITS[route_class]))
+            if buckets:
+                try:
+                    wait = take(buckets)
+                except sqlite3.Error:
+                    # Let requests through rather than fail them all.
+                    wait = 0
+                if wait:
+                    return message_response(
+                        get_error_message('RateLimited'),
+                        get_error_code('RateLimited'),
+                        retry_after=str(int(math.ceil(wait))))
+            return callback(*args, **kwargs)
+        return wrapper
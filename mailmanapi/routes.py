@@ -1,8 +1,13 @@
-from bottle import default_app
-from . import api
+from bottle import Bottle
+from . import api, compression, idempotency, jobs, metrics, profiling, \
+    ratelimit
 
 
 def create_routes(app):
+    app.route('/_metrics', method='GET', callback=metrics.metrics)
+    app.route('/_jobs/<job_id>', method='GET', callback=jobs.job_status)
+    app.route('/_members', method='DELETE', callback=api.erase_member)
+    app.route('/_export', method='GET', callback=api.export)
     app.route('/', method='GET', callback=api.list_lists)
     app.route('/<listname>', method='POST', callback=api.create_list)
     app.route('/<listname>', method='DELETE', callback=api.delete_list)
@@ -10,12 +15,22 @@ def create_routes(app):
     app.route('/<listname>/members', method='PUT', callback=api.subscribe)
     app.route('/<listname>/members', method='DELETE', callback=api.unsubscribe)
     app.route('/<listname>/members', method='GET', callback=api.members)
+    app.route('/<listname>/members/batch', method='PUT',
+              callback=api.subscribe_batch)
+    app.route('/<listname>/members/batch', method='DELETE',
+              callback=api.unsubscribe_batch)
+    app.route('/<listname>/members/import', method='POST',
+              callback=api.import_members)
 
 
 def get_application():
-    bottle_app = default_app()
-
-    def application(environ, start_response):
-        create_routes(bottle_app)
-        return bottle_app(environ, start_response)
+    application = Bottle()
+    create_routes(application)
+    application.install(metrics.MetricsPlugin())
+    application.install(ratelimit.RateLimitPlugin())
+    application.install(idempotency.IdempotencyPlugin())
+    if compression.LEVEL:
+        application = compression.CompressionMiddleware(application)
+    if profiling.DIRECTORY:
+        return profiling.ProfilerMiddleware(application)
     return application
@@ -0,0 +1,117 @@
+"""Member search within a list.
+
+`MemberIndex` is built from a loaded list the first time it is searched
+and kept by the list cache, apart from the list itself and keyed by the
+list's config.pck stamp, so it is rebuilt whenever config.pck changes
+but not when a big list is evicted.  It holds:
+
+* the member addresses in sorted order, for prefix searches with bisect;
+* the full names, lowercased and sorted, for prefix searches on names;
+* the members of each domain, for `@domain` searches;
+* every address and full name joined into one lowercase string, which
+  substring searches scan with str.find at C speed instead of looping
+  over members in Python.
+
+Members are numbered by their position in the sorted addresses, so
+matches come out in address order and can be paged with a cursor."""
+import bisect
+from array import array
+
+# Results returned when the request doesn't set a limit.
+DEFAULT_LIMIT = 100
+
+
+def _key(text):
+    # Lowercase UTF-8, to compare with queries as they come off the URL.
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return text.lower().replace('\t', ' ').replace('\n', ' ')
+
+
+class MemberIndex(object):
+
+    def __init__(self, mlist):
+        self.addresses = sorted(mlist.getMembers())
+        self.fullnames = []
+        self.domains = {}
+        self.offsets = array('l')
+        names = []
+        lines = []
+        position = 0
+        for number, address in enumerate(self.addresses):
+            fullname = mlist.getMemberName(address)
+            self.fullnames.append(fullname)
+            name = _key(fullname or '')
+            if name:
+                names.append((name, number))
+            domain = address.rpartition('@')[2]
+            self.domains.setdefault(domain, array('l')).append(number)
+            line = '%s\t%s\n' % (_key(address), name)
+            lines.append(line)
+            self.offsets.append(position)
+            position += len(line)
+        names.sort()
+        self.names = [key for key, number in names]
+        self.name_numbers = [number for key, number in names]
+        self.text = ''.join(lines)
+
+    def _first(self, after):
+        # Number of the first member sorting after `after`.
+        if not after:
+            return 0
+        return bisect.bisect_right(self.addresses, after.lower())
+
+    def _prefix(self, query, start):
+        lo = max(bisect.bisect_left(self.addresses, query), start)
+        hi = bisect.bisect_left(self.addresses, query + '\xff')
+        numbers = set(xrange(lo, hi))
+        lo = bisect.bisect_left(self.names, query)
+        hi = bisect.bisect_left(self.names, query + '\xff')
+        numbers.update(number for number in self.name_numbers[lo:hi]
+                       if number >= start)
+        return iter(sorted(numbers))
+
+    def _domain(self, domain, start):
+        numbers = self.domains.get(domain, ())
+        return iter(numbers[bisect.bisect_left(numbers, start):])
+
+    def _substring(self, query, start):
+        if start >= len(self.addresses):
+            return
+        position = self.offsets[start]
+        last = -1
+        while True:
+            position = self.text.find(query, position)
+            if position < 0:
+                return
+            number = bisect.bisect_right(self.offsets, position) - 1
+            if number != last:
+                yield number
+                last = number
+            # Skip the rest of this member's line.
+            if number + 1 >= len(self.offsets):
+                return
+            position = self.offsets[number + 1]
+
+    def search(self, query, prefix=False, after=None, limit=DEFAULT_LIMIT):
+        """Returns up to `limit` (address, fullname) pairs of members
+        matching `query`, in address order and starting after the address
+        `after`, and whether more matches remain.
+
+        A query starting with `@` matches the members of that domain.
+        Otherwise it matches addresses and full names containing it, or
+        starting with it if `prefix` is set.  Matching ignores case."""
+        query = _key(query)
+        start = self._first(after)
+        if query.startswith('@'):
+            numbers = self._domain(query[1:], start)
+        elif prefix:
+            numbers = self._prefix(query, start)
+        else:
+            numbers = self._substring(query, start)
+        results = []
+        for number in numbers:
+            if len(results) == limit:
+                return results, True
+            results.append((self.addresses[number], self.fullnames[number]))
+        return results, False
@@ -0,0 +1,81 @@
+"""Shared on-disk state for the API workers.
+
+Every gunicorn worker opens the same SQLite databases under `STATE_DIR`,
+so anything kept here is visible to all workers and survives restarts."""
+import os
+import fcntl
+import sqlite3
+import threading
+from contextlib import contextmanager
+from Mailman import mm_cfg
+
+STATE_DIR = os.path.join(mm_cfg.DATA_DIR, 'mailman-api')
+
+# Seconds a writer waits for another worker's transaction to finish.
+BUSY_TIMEOUT = 30
+
+_local = threading.local()
+
+
+def state_path(*parts):
+    path = os.path.join(STATE_DIR, *parts)
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+    return path
+
+
+def connect(name, schema):
+    """Returns this thread's connection to the `name` database, creating
+    `schema` on first use.
+
+    Connections are never shared between threads or carried across a
+    fork, so each worker process ends up with its own."""
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    key = (os.getpid(), STATE_DIR, name)
+    conn = connections.get(key)
+    if conn is None:
+        conn = sqlite3.connect(state_path(name + '.db'),
+                               timeout=BUSY_TIMEOUT,
+                               isolation_level=None)
+        _initialize(conn, name, schema)
+        connections[key] = conn
+    return conn
+
+
+def close_all():
+    """Closes this thread's connections, e.g. before forking workers;
+    SQLite connections must not be carried across a fork."""
+    connections = getattr(_local, 'connections', None) or {}
+    for key in list(connections):
+        connections.pop(key).close()
+
+
+def _initialize(conn, name, schema):
+    # Python 2's sqlite3 module doesn't re-prepare statements when another
+    # connection changes the schema underneath them, so workers starting
+    # together must take turns setting up a new database.
+    fd = os.open(state_path(name + '.lock'), os.O_RDWR | os.O_CREAT, 0660)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(schema)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def transaction(conn):
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
@@ -1,6 +1,22 @@
+import os
+import csv
 import json
-from bottle import HTTPResponse
-from Mailman import MailList, Errors
+import time
+import hashlib
+import itertools
+from StringIO import StringIO
+from contextlib import contextmanager
+from email.utils import formatdate
+from bottle import HTTPResponse, request, parse_date
+from Mailman import MailList, Errors, LockFile, mm_cfg
+from . import metrics
+
+# Seconds a request waits for a list's lock before giving up with a 503;
+# 0 waits forever.
+LOCK_TIMEOUT = 10
+
+# Seconds clients are told to wait before retrying after a lock timeout.
+RETRY_AFTER = 5
 
 ERROR_CODES = {
     'MMSubscribeNeedsConfirmation': 403,
@@ -17,6 +33,10 @@ ERROR_CODES = {
     'MMUnknownListError': 404,
     'MMListAlreadyExistsError': 400,
     'InvalidParams': 400,
+    'TimeOutError': 503,
+    'RateLimited': 429,
+    'IdempotencyKeyReused': 422,
+    'IdempotencyKeyInProgress': 409,
 }
 
 ERROR_MESSAGES = {
@@ -34,6 +54,12 @@ ERROR_MESSAGES = {
     'MMUnknownListError': 'Unknown list',
     'MMListAlreadyExistsError': 'List already exists',
     'InvalidParams': 'Invalid parameters',
+    'TimeOutError': 'Timed out waiting for the list lock',
+    'RateLimited': 'Too many requests',
+    'IdempotencyKeyReused': 'Idempotency-Key already used for another '
+                            'request',
+    'IdempotencyKeyInProgress': 'A request with this Idempotency-Key is '
+                                'still in progress',
 }
 
 
@@ -53,10 +79,273 @@ def parse_boolean(value):
 
 def get_mailinglist(listname, lock=True):
     try:
-        return MailList.MailList(listname, lock=lock)
+        with metrics.phase('unpickle'):
+            mlist = MailList.MailList(listname, lock=False)
     except Errors.MMUnknownListError:
         message = get_error_message('MMUnknownListError') + ': ' + listname
         status_code = get_error_code('MMUnknownListError')
-        raise HTTPResponse(status=status_code,
-                           body=json.dumps({'message': message}),
-                           content_type='application/json')
+        raise message_response(message, status_code)
+    if lock:
+        lock_mailinglist(mlist)
+    return mlist
+
+
+def lock_mailinglist(mlist):
+    """Locks `mlist`, waiting at most `LOCK_TIMEOUT` seconds.
+
+    Raises a 503 response with a Retry-After header if the lock can't be
+    had in time, so a stuck cron job or slow Save() elsewhere can't tie
+    up every worker."""
+    listname = mlist.internal_name()
+    start = time.time()
+    try:
+        with metrics.phase('lock'):
+            mlist.Lock(timeout=LOCK_TIMEOUT)
+    except LockFile.TimeOutError, e:
+        metrics.observe('mailmanapi_lock_wait_seconds', time.time() - start,
+                        listname=listname)
+        metrics.inc('mailmanapi_lock_timeouts_total', listname=listname)
+        message = get_error_message(e.__class__.__name__) + ': ' + listname
+        raise message_response(message,
+                               get_error_code(e.__class__.__name__),
+                               retry_after=str(RETRY_AFTER))
+    metrics.observe('mailmanapi_lock_wait_seconds', time.time() - start,
+                    listname=listname)
+
+
+class ListMutation(object):
+    """What a `mutate_list()` block has done to its locked list."""
+
+    def __init__(self, mlist):
+        self.mlist = mlist
+        self.dirty = False
+        self.callbacks = []
+
+    def changed(self):
+        """Marks the list as changed, so that it gets saved."""
+        self.dirty = True
+
+    def on_save(self, callback):
+        """Calls `callback()` once the list is saved, still locked."""
+        self.callbacks.append(callback)
+
+
+@contextmanager
+def mutate_list(listname):
+    """Loads and locks `listname` for the enclosed block, yielding a
+    `ListMutation`, and unlocks it afterwards whatever happens.
+
+    Rewriting config.pck is the most expensive part of a change, so the
+    list is only saved if the block marked it `changed()`, and not at all
+    if the block raised, which drops its half-made changes.  The time the
+    list was held locked is recorded in the
+    `mailmanapi_commit_duration_seconds` histogram."""
+    mlist = get_mailinglist(listname)
+    mutation = ListMutation(mlist)
+    start = time.time()
+    try:
+        yield mutation
+        if mutation.dirty:
+            with metrics.phase('save'):
+                mlist.Save()
+            for callback in mutation.callbacks:
+                callback()
+    finally:
+        mlist.Unlock()
+        metrics.observe('mailmanapi_commit_duration_seconds',
+                        time.time() - start,
+                        saved=str(mutation.dirty).lower())
+
+
+def use_json_encoder(name=None):
+    """Makes `dumps` use the named module's encoder, or the fastest of
+    `JSON_ENCODERS` that is installed.
+
+    The encoders produce equivalent JSON, though not always byte for
+    byte the same; ujson, for instance, leaves out the spaces after
+    separators."""
+    global dumps, json_encoder
+    for candidate in ([name] if name else JSON_ENCODERS):
+        try:
+            module = __import__(candidate)
+        except ImportError:
+            if name:
+                raise
+            continue
+        dumps = module.dumps
+        json_encoder = candidate
+        return candidate
+
+
+# Encoders tried by use_json_encoder(), fastest first.
+JSON_ENCODERS = ('ujson', 'simplejson', 'json')
+
+dumps = json.dumps
+json_encoder = 'json'
+use_json_encoder()
+
+
+def json_response(data, status=200, **headers):
+    """Returns an HTTPResponse with the JSON encoding of `data`."""
+    with metrics.phase('serialize'):
+        body = dumps(data)
+    return HTTPResponse(body=body, status=status,
+                        content_type='application/json', **headers)
+
+
+def message_response(message, status=200, **headers):
+    return json_response({'message': message}, status, **headers)
+
+
+def stream_response(items, ndjson=False, **headers):
+    """Returns an HTTPResponse streaming `items` as a JSON array, or as
+    newline-delimited JSON if `ndjson` is set, encoded as it is sent."""
+    if ndjson:
+        return HTTPResponse(body=iter_ndjson(items),
+                            content_type='application/x-ndjson', **headers)
+    return HTTPResponse(body=iter_json_array(items),
+                        content_type='application/json', **headers)
+
+
+def iter_json_array(items, chunk_size=1000):
+    """Yields the JSON encoding of `items` as a series of chunks of up to
+    `chunk_size` elements, so the whole array never has to be held in
+    memory as a single string."""
+    items = iter(items)
+    yield '['
+    separator = ''
+    while True:
+        chunk = list(itertools.islice(items, chunk_size))
+        if not chunk:
+            break
+        # One encoder call per chunk rather than per element.
+        yield separator + dumps(chunk)[1:-1]
+        separator = ','
+    yield ']'
+
+
+def iter_ndjson(items, chunk_size=1000):
+    """Like `iter_json_array`, but yields one JSON document per line."""
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, chunk_size))
+        if not chunk:
+            break
+        yield '\n'.join(dumps(item) for item in chunk) + '\n'
+
+
+def csv_response(rows, columns, **headers):
+    """Returns an HTTPResponse streaming `rows`, dictionaries, as CSV with
+    the given `columns`."""
+    return HTTPResponse(body=iter_csv(rows, columns),
+                        content_type='text/csv; charset=utf-8', **headers)
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, float):
+        # str() keeps only 12 significant digits on Python 2.
+        return repr(value)
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, (list, tuple)):
+        return ' '.join(_csv_value(item) for item in value)
+    return value
+
+
+def iter_csv(rows, columns, chunk_size=1000):
+    """Yields a header line of `columns` and then `rows`, dictionaries
+    with those keys, as CSV in chunks of up to `chunk_size` rows."""
+    output = StringIO()
+    writer = csv.writer(output)
+    writer.writerow(columns)
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        for row in chunk:
+            writer.writerow([_csv_value(row.get(column))
+                             for column in columns])
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate()
+    if output.tell():
+        # Only the header: there were no rows.
+        yield output.getvalue()
+
+
+def iter_body_lines(environ, block_size=65536):
+    """Yields the lines of the request body as they are read from
+    `wsgi.input`, rather than buffering the whole body like
+    `request.body` does."""
+    stream = environ['wsgi.input']
+    length = environ.get('CONTENT_LENGTH')
+    remaining = int(length) if length else None
+    partial = ''
+    while remaining is None or remaining > 0:
+        if remaining is None:
+            block = stream.read(block_size)
+        else:
+            block = stream.read(min(block_size, remaining))
+            remaining -= len(block)
+        if not block:
+            break
+        lines = (partial + block).split('\n')
+        partial = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    if partial:
+        yield partial
+
+
+def get_config_stamp(listname):
+    """Returns an (inode, mtime, size) tuple identifying the current
+    version of a list's config.pck, or None if the list doesn't exist.
+
+    Mailman writes a new config.pck and renames it into place on every
+    Save(), so any change to the list produces a different stamp."""
+    path = os.path.join(mm_cfg.LIST_DATA_DIR, listname.lower(), 'config.pck')
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime, st.st_size)
+
+
+def list_etag(stamp):
+    """Returns a strong ETag for the version of a list identified by its
+    config.pck `stamp`."""
+    return '"%x-%x-%x"' % (stamp[0], int(stamp[1] * 1000000), stamp[2])
+
+
+def aggregate_etag(stamps):
+    """Returns a strong ETag for a set of lists, given a dictionary mapping
+    their names to their config.pck stamps."""
+    digest = hashlib.sha1(repr(sorted(stamps.items()))).hexdigest()
+    return '"%s"' % digest
+
+
+def conditional(etag, mtime):
+    """Returns the ETag and Last-Modified headers for a response, or
+    raises a 304 response if the request's If-None-Match or, failing
+    that, If-Modified-Since header shows the client already has it.
+
+    Callers compute both validators from config.pck stat data, so a 304
+    costs no more than a stat() per list."""
+    headers = {'etag': etag,
+               'last_modified': formatdate(int(mtime), usegmt=True)}
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        tags = [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+        not_modified = '*' in tags or etag in tags
+    else:
+        since = parse_date(request.headers.get('If-Modified-Since', ''))
+        not_modified = since is not None and int(mtime) <= since
+    if not_modified:
+        raise HTTPResponse(status=304, **headers)
+    return headers
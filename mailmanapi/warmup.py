@@ -0,0 +1,25 @@
+"""Start-up work done once, before workers accept requests.
+
+gunicorn forks every worker from the master process, and with
+`max_requests` it keeps forking new ones as old ones retire.  `warm_up()`
+runs in the master, so imports, the address index refresh and, with
+`preload_lists`, the list cache are paid for once and inherited by every
+worker instead of by the first requests each worker serves."""
+import random
+from Mailman import Utils
+from . import cache, index, jobs, outbox, storage
+
+
+def warm_up(preload_lists=False):
+    index.refresh(force=True)
+    if preload_lists:
+        cache.preload(Utils.list_names())
+    storage.close_all()
+
+
+def post_fork(server, worker):
+    """gunicorn hook: per-worker set-up after the fork."""
+    # Forked workers would otherwise share the master's random sequence.
+    random.seed()
+    jobs.start()
+    outbox.start()
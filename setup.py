@@ -35,5 +35,9 @@ setup(
         "bottle-beaker>=0.1.0",
         "bottle-cork>=0.12.0",
     ],
+    extras_require={
+        # Faster JSON encoding of responses; used when installed.
+        'ujson': ['ujson'],
+    },
     tests_require=TEST_REQUIREMENTS,
 )
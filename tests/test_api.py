@@ -1,6 +1,8 @@
 import sys
+import json
 from nose.tools import *
 from .utils import MailmanAPITestCase
+from mailmanapi import index, utils
 from Mailman import MailList, UserDesc, Defaults
 
 class TestAPI(MailmanAPITestCase):
@@ -68,6 +70,30 @@ class TestAPI(MailmanAPITestCase):
         self.assertEqual(resp.status_code, 405)
         self.assertEqual(resp.json, {'message': 'Already a member: user@email.com'})
 
+    def test_save_only_when_changed(self):
+        path = self.url + self.list_name + '/members'
+        stamp = utils.get_config_stamp(self.list_name)
+        self.client.put(path, {'address': 'user@emailcom'},
+                        expect_errors=True)
+        self.client.delete(path, self.data, expect_errors=True)
+        self.assertEqual(utils.get_config_stamp(self.list_name), stamp)
+
+        self.client.put(path, self.data, expect_errors=False)
+        stamp = utils.get_config_stamp(self.list_name)
+        self.client.put(path, self.data, expect_errors=True)
+        self.assertEqual(utils.get_config_stamp(self.list_name), stamp)
+
+        # Subscriptions held for approval are saved.
+        self.change_list_attribute('subscribe_policy', 2)
+        stamp = utils.get_config_stamp(self.list_name)
+        self.client.put(path, {'address': 'other@email.com'},
+                        expect_errors=True)
+        self.assertNotEqual(utils.get_config_stamp(self.list_name), stamp)
+
+        resp = self.client.get('/_metrics', expect_errors=False)
+        self.assertIn('mailmanapi_commit_duration_seconds_count'
+                      '{saved="false"}', resp.body)
+
     def test_subscribe_bad_email(self):
         path = '/members'
         data = {'address': 'user@emailcom'}
@@ -76,6 +102,26 @@ class TestAPI(MailmanAPITestCase):
         self.assertEqual(resp.status_code, 400)
         self.assertEqual(resp.json, {'message': 'Bad email: user@emailcom'})
 
+    def test_subscribe_lock_timeout(self):
+        path = '/members'
+        lock_timeout = utils.LOCK_TIMEOUT
+        utils.LOCK_TIMEOUT = 0.1
+        mlist = MailList.MailList(self.list_name)
+        try:
+            resp = self.client.put(self.url + self.list_name + path,
+                                   self.data, expect_errors=True)
+        finally:
+            mlist.Unlock()
+            utils.LOCK_TIMEOUT = lock_timeout
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers['Retry-After'], str(utils.RETRY_AFTER))
+        self.assertEqual(resp.json,
+                         {'message': 'Timed out waiting for the list lock: '
+                                     + self.list_name})
+        resp = self.client.get('/_metrics', expect_errors=False)
+        self.assertIn('mailmanapi_lock_timeouts_total{listname="%s"}'
+                      % self.list_name, resp.body)
+
     def test_unsubscribe(self):
         path = '/members'
         user_desc = UserDesc.UserDesc(self.data['address'], 'fullname', 1)
@@ -96,6 +142,81 @@ class TestAPI(MailmanAPITestCase):
         self.assertEqual(resp.status_code, 404)
         self.assertEqual(resp.json, {'message': 'Not a member: user@email.com'})
 
+    def test_subscribe_batch(self):
+        path = '/members/batch'
+        batch = ['batch1@email.com',
+                 {'address': 'batch2@email.com', 'fullname': 'Batch Two',
+                  'digest': True},
+                 {'address': 'batch1@email.com'},
+                 {'address': 'user@emailcom'},
+                 {'fullname': 'No Address'}]
+
+        self.change_list_attribute('subscribe_policy', 0)
+        resp = self.client.put(self.url + self.list_name + path,
+                               json.dumps(batch),
+                               content_type='application/json',
+                               expect_errors=False)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json, [
+            {'address': 'batch1@email.com', 'status': 200,
+             'message': 'Success'},
+            {'address': 'batch2@email.com', 'status': 200,
+             'message': 'Success'},
+            {'address': 'batch1@email.com', 'status': 405,
+             'message': 'Already a member: batch1@email.com'},
+            {'address': 'user@emailcom', 'status': 400,
+             'message': 'Bad email: user@emailcom'},
+            {'address': None, 'status': 400,
+             'message': 'Missing information'}])
+
+        mlist = MailList.MailList(self.list_name, lock=False)
+        self.assertEqual(mlist.getMemberName('batch2@email.com'), 'Batch Two')
+        self.assertIn('batch2@email.com', mlist.getDigestMemberKeys())
+
+    def test_unsubscribe_batch(self):
+        path = '/members/batch'
+        mlist = MailList.MailList(self.list_name)
+        mlist.AddMember(UserDesc.UserDesc('batch1@email.com', 'one', 0))
+        mlist.Save()
+        mlist.Unlock()
+
+        body = '"batch1@email.com"\n"batch2@email.com"\n'
+        resp = self.client.delete(self.url + self.list_name + path, body,
+                                  content_type='application/x-ndjson',
+                                  expect_errors=False)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json, [
+            {'address': 'batch1@email.com', 'status': 200,
+             'message': 'Success'},
+            {'address': 'batch2@email.com', 'status': 404,
+             'message': 'Not a member: batch2@email.com'}])
+
+    def test_subscribe_batch_invalid_body(self):
+        path = '/members/batch'
+        resp = self.client.put(self.url + self.list_name + path,
+                               '{"address": "user@email.com"}',
+                               content_type='application/json',
+                               expect_errors=True)
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json,
+                         {'message': 'Invalid parameters: '
+                                     'expected a JSON array'})
+        for body, message in (('[5]', 'expected an address or an object'),
+                              ('[{"address": 5}]',
+                               'address must be a string'),
+                              ('[{"address": "user@email.com", '
+                               '"fullname": ["A"]}]',
+                               'fullname must be a string'),
+                              ('[{"address": "user@email.com", '
+                               '"digest": {}}]',
+                               'digest must be a boolean')):
+            resp = self.client.put(self.url + self.list_name + path, body,
+                                   content_type='application/json',
+                                   expect_errors=True)
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(resp.json,
+                             {'message': 'Invalid parameters: ' + message})
+
     def test_mailman_site_list_not_listed_among_lists(self):
         mailman_site_list = Defaults.MAILMAN_SITE_LIST
 
@@ -126,6 +247,118 @@ class TestAPI(MailmanAPITestCase):
 
         self.assertTrue(found)
 
+    def test_list_lists_fields(self):
+        resp = self.client.get(self.url, {'fields': 'member_count,owner'},
+                               expect_errors=False)
+        lists = dict((mlist['listname'], mlist) for mlist in resp.json)
+        self.assertEqual(lists[self.list_name],
+                         {'listname': self.list_name, 'member_count': 0,
+                          'owner': ['admin@list.com']})
+
+        resp = self.client.get(self.url, {'fields': 'listname'},
+                               expect_errors=False)
+        self.assertIn({'listname': self.list_name}, resp.json)
+
+        resp = self.client.get(self.url, {'fields': 'password'},
+                               expect_errors=True)
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json, {'message': 'Invalid parameters: '
+                                                'unknown field: password'})
+
+    def test_list_lists_summary(self):
+        resp = self.client.get(self.url, {'summary': 'true'},
+                               expect_errors=False)
+        for mlist in resp.json:
+            self.assertEqual(sorted(mlist),
+                             ['description', 'listname', 'real_name'])
+
+    def test_list_lists_address(self):
+        address = 'indexed@email.com'
+        path = '/members'
+
+        self.change_list_attribute('subscribe_policy', 0)
+        resp = self.client.put(self.url + self.list_name + path,
+                               {'address': address}, expect_errors=False)
+        self.assertEqual(resp.status_code, 200)
+
+        resp = self.client.get(self.url, {'address': address},
+                               expect_errors=False)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([self.list_name],
+                         [mlist['listname'] for mlist in resp.json])
+
+        resp = self.client.delete(self.url + self.list_name + path,
+                                  {'address': address}, expect_errors=False)
+        resp = self.client.get(self.url, {'address': address},
+                               expect_errors=False)
+        self.assertEqual(resp.json, [])
+
+    def test_list_lists_address_mixed_case_listname(self):
+        path = '/members'
+        self.change_list_attribute('subscribe_policy', 0)
+        refresh_interval = index.REFRESH_INTERVAL
+        index.REFRESH_INTERVAL = 3600
+        try:
+            index.refresh(force=True)
+            # The index must follow changes made through any spelling of
+            # the list name without waiting for a refresh.
+            for listname, address in ((self.list_name.upper(),
+                                       'upper@email.com'),
+                                      (self.list_name, 'lower@email.com')):
+                self.client.put(self.url + listname + path,
+                                {'address': address}, expect_errors=False)
+                resp = self.client.get(self.url, {'address': address},
+                                       expect_errors=False)
+                self.assertEqual([self.list_name],
+                                 [item['listname'] for item in resp.json])
+        finally:
+            index.REFRESH_INTERVAL = refresh_interval
+
+    def test_list_lists_address_list_removed_outside_api(self):
+        address = 'removed@email.com'
+        other_list = 'removed_list'
+        self.create_list(other_list)
+        for list_name in (self.list_name, other_list):
+            mlist = MailList.MailList(list_name)
+            mlist.AddMember(UserDesc.UserDesc(address))
+            mlist.Save()
+            mlist.Unlock()
+        refresh_interval = index.REFRESH_INTERVAL
+        index.REFRESH_INTERVAL = 3600
+        try:
+            index.refresh(force=True)
+            self.remove_list(other_list)
+            # The index still has the removed list until the next refresh.
+            resp = self.client.get(self.url, {'address': address},
+                                   expect_errors=False)
+            self.assertEqual([self.list_name],
+                             [item['listname'] for item in resp.json])
+        finally:
+            index.REFRESH_INTERVAL = refresh_interval
+            self.remove_list(other_list)
+
+    def test_list_lists_address_changed_outside_api(self):
+        address = 'outside@email.com'
+        user_desc = UserDesc.UserDesc(address, 'fullname', 1)
+        refresh_interval = index.REFRESH_INTERVAL
+        index.REFRESH_INTERVAL = 0
+        try:
+            resp = self.client.get(self.url, {'address': address},
+                                   expect_errors=False)
+            self.assertEqual(resp.json, [])
+
+            mlist = MailList.MailList(self.list_name)
+            mlist.AddMember(user_desc)
+            mlist.Save()
+            mlist.Unlock()
+
+            resp = self.client.get(self.url, {'address': address},
+                                   expect_errors=False)
+            self.assertEqual([self.list_name],
+                             [item['listname'] for item in resp.json])
+        finally:
+            index.REFRESH_INTERVAL = refresh_interval
+
     def test_create_list(self):
         new_list = 'new_list'
         url = self.url + new_list
@@ -325,6 +558,148 @@ class TestAPI(MailmanAPITestCase):
         self.assertEqual(resp.json,
                          {'message': 'Not a member: unknown@email.address'})
 
+    def test_members_pagination(self):
+        list_name = 'list16'
+        path = '/members'
+        addresses = ['user%d@email.com' % i for i in range(5)]
+        self.create_list(list_name)
+        mlist = MailList.MailList(list_name)
+        for address in reversed(addresses):
+            mlist.AddMember(UserDesc.UserDesc(address, 'fullname', 0))
+        mlist.Save()
+        mlist.Unlock()
+
+        resp = self.client.get(self.url + list_name + path, {'limit': 2},
+                               expect_errors=False)
+        self.assertEqual(resp.json, addresses[:2])
+        cursor = resp.headers['X-Next-Cursor']
+        resp = self.client.get(self.url + list_name + path,
+                               {'limit': 2, 'after': cursor},
+                               expect_errors=False)
+        self.assertEqual(resp.json, addresses[2:4])
+        cursor = resp.headers['X-Next-Cursor']
+        resp = self.client.get(self.url + list_name + path,
+                               {'limit': 2, 'after': cursor},
+                               expect_errors=False)
+        self.assertEqual(resp.json, addresses[4:])
+        self.assertNotIn('X-Next-Cursor', resp.headers)
+
+        resp = self.client.get(self.url + list_name + path, {'limit': 'x'},
+                               expect_errors=True)
+        self.assertEqual(resp.status_code, 400)
+        self.remove_list(list_name)
+
+    def test_members_stream(self):
+        list_name = 'list17'
+        path = '/members'
+        addresses = ['user%d@email.com' % i for i in range(3)]
+        self.create_list(list_name)
+        mlist = MailList.MailList(list_name)
+        for address in addresses:
+            mlist.AddMember(UserDesc.UserDesc(address, 'fullname', 0))
+        mlist.Save()
+        mlist.Unlock()
+
+        resp = self.client.get(self.url + list_name + path,
+                               {'stream': 'true'}, expect_errors=False)
+        self.assertEqual(resp.json, addresses)
+        resp = self.client.get(self.url + list_name + path,
+                               {'format': 'ndjson', 'after': addresses[0]},
+                               expect_errors=False)
+        self.assertEqual(resp.content_type, 'application/x-ndjson')
+        self.assertEqual(resp.body.splitlines(),
+                         ['"%s"' % address for address in addresses[1:]])
+        resp = self.client.get(self.url + list_name + path,
+                               {'format': 'csv'}, expect_errors=True)
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json,
+                         {'message': 'Invalid parameters: unknown format: csv'})
+        self.remove_list(list_name)
+
+    def test_members_detail(self):
+        list_name = 'list19'
+        path = '/members'
+        self.create_list(list_name)
+        mlist = MailList.MailList(list_name)
+        mlist.AddMember(UserDesc.UserDesc('ann@email.com', 'Ann', digest=0))
+        mlist.AddMember(UserDesc.UserDesc('bob@email.com', 'Bob', digest=1))
+        mlist.AddMember(UserDesc.UserDesc('cid@email.com', None, digest=0))
+        mlist.setDeliveryStatus('bob@email.com', 2)
+        mlist.setMemberLanguage('cid@email.com', 'pt_BR')
+        mlist.Save()
+        mlist.Unlock()
+
+        expected = [{'address': 'ann@email.com', 'fullname': 'Ann',
+                     'digest': False, 'delivery_status': 0,
+                     'language': 'en'},
+                    {'address': 'bob@email.com', 'fullname': 'Bob',
+                     'digest': True, 'delivery_status': 2,
+                     'language': 'en'},
+                    {'address': 'cid@email.com', 'fullname': None,
+                     'digest': False, 'delivery_status': 0,
+                     'language': 'pt_BR'}]
+        resp = self.client.get(self.url + list_name + path, {'detail': '1'},
+                               expect_errors=False)
+        self.assertEqual(resp.json, expected)
+        resp = self.client.get(self.url + list_name + path,
+                               {'detail': 'true', 'limit': 1,
+                                'after': 'ann@email.com', 'format': 'ndjson'},
+                               expect_errors=False)
+        self.assertEqual([json.loads(line) for line in resp.body.splitlines()],
+                         expected[1:2])
+        self.assertEqual(resp.headers['X-Next-Cursor'], 'bob@email.com')
+        self.remove_list(list_name)
+
+    def test_members_search(self):
+        list_name = 'list18'
+        path = '/members'
+        self.create_list(list_name)
+        mlist = MailList.MailList(list_name)
+        for address, fullname in [('ann@email.com', 'Ann Smith'),
+                                  ('bob@other.org', 'Bob Smithers'),
+                                  ('carol@email.com', 'Carol Jones')]:
+            mlist.AddMember(UserDesc.UserDesc(address, fullname, 0))
+        mlist.Save()
+        mlist.Unlock()
+
+        resp = self.client.get(self.url + list_name + path, {'q': 'smith'},
+                               expect_errors=False)
+        self.assertEqual(resp.json, [
+            {'address': 'ann@email.com', 'fullname': 'Ann Smith'},
+            {'address': 'bob@other.org', 'fullname': 'Bob Smithers'}])
+        resp = self.client.get(self.url + list_name + path,
+                               {'q': 'car', 'match': 'prefix'},
+                               expect_errors=False)
+        self.assertEqual([m['address'] for m in resp.json],
+                         ['carol@email.com'])
+        resp = self.client.get(self.url + list_name + path,
+                               {'q': '@email.com', 'limit': 1},
+                               expect_errors=False)
+        self.assertEqual([m['address'] for m in resp.json], ['ann@email.com'])
+        resp = self.client.get(self.url + list_name + path,
+                               {'q': '@email.com', 'limit': 1,
+                                'after': resp.headers['X-Next-Cursor']},
+                               expect_errors=False)
+        self.assertEqual([m['address'] for m in resp.json],
+                         ['carol@email.com'])
+        self.assertNotIn('X-Next-Cursor', resp.headers)
+
+        # Changes to the list are searchable straight away.
+        mlist = MailList.MailList(list_name)
+        mlist.AddMember(UserDesc.UserDesc('dan@email.com', 'Dan Smith', 0))
+        mlist.Save()
+        mlist.Unlock()
+        resp = self.client.get(self.url + list_name + path, {'q': 'smith'},
+                               expect_errors=False)
+        self.assertEqual([m['address'] for m in resp.json],
+                         ['ann@email.com', 'bob@other.org', 'dan@email.com'])
+
+        resp = self.client.get(self.url + list_name + path,
+                               {'q': 'smith', 'match': 'regex'},
+                               expect_errors=True)
+        self.assertEqual(resp.status_code, 400)
+        self.remove_list(list_name)
+
     def test_members_unknown_list(self):
         list_name = 'list15'
         path = '/members'
@@ -0,0 +1,71 @@
+from bottle import HTTPResponse
+from .utils import MailmanAPITestCase
+from mailmanapi import cache
+
+
+class TestListCache(MailmanAPITestCase):
+    url = '/'
+    list_name = 'cached_list'
+
+    def setUp(self):
+        super(TestListCache, self).setUp()
+        self.create_list(self.list_name)
+        cache.configure(max_bytes=cache.MAX_BYTES)
+
+    def tearDown(self):
+        super(TestListCache, self).tearDown()
+        self.remove_list(self.list_name)
+
+    def test_unchanged_list_is_not_reloaded(self):
+        self.client.get(self.url + self.list_name, expect_errors=False)
+        hits = cache.stats()['hits']
+        resp = self.client.get(self.url + self.list_name, expect_errors=False)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(cache.stats()['hits'], hits + 1)
+
+    def test_changed_list_is_reloaded(self):
+        self.client.get(self.url + self.list_name, expect_errors=False)
+        self.change_list_attribute('description', 'Changed description')
+        misses = cache.stats()['misses']
+        resp = self.client.get(self.url + self.list_name, expect_errors=False)
+        self.assertEqual(resp.json[0]['description'], 'Changed description')
+        self.assertEqual(cache.stats()['misses'], misses + 1)
+
+    def test_eviction(self):
+        cache.configure(max_bytes=1)
+        resp = self.client.get(self.url + self.list_name, expect_errors=False)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(cache.stats()['lists'], 0)
+
+    def test_search_index_outlives_eviction(self):
+        cache.configure(max_bytes=1)
+        member_index = cache.get_search_index(self.list_name)
+        self.assertEqual(cache.stats()['lists'], 0)
+        self.assertIs(cache.get_search_index(self.list_name), member_index)
+        self.change_list_attribute('description', 'Changed description')
+        self.assertIsNot(cache.get_search_index(self.list_name),
+                         member_index)
+
+    def test_deleted_list(self):
+        self.client.get(self.url + self.list_name, expect_errors=False)
+        self.remove_list(self.list_name)
+        resp = self.client.get(self.url + self.list_name, expect_errors=True)
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(resp.json,
+                         {'message': 'Unknown list: ' + self.list_name})
+
+    def test_list_deleted_while_loading(self):
+        # The list is gone by the time it is unpickled.
+        get_config_stamp = cache.get_config_stamp
+        cache.get_config_stamp = lambda listname: (1, 1.0, 1)
+        try:
+            self.assertRaises(HTTPResponse, cache.get_list, 'missing_list')
+        finally:
+            cache.get_config_stamp = get_config_stamp
+
+    def test_preload(self):
+        cache.preload([self.list_name, 'missing_list'])
+        hits = cache.stats()['hits']
+        resp = self.client.get(self.url + self.list_name, expect_errors=False)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(cache.stats()['hits'], hits + 1)
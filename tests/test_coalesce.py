@@ -0,0 +1,94 @@
+import threading
+from .utils import MailmanAPITestCase
+from mailmanapi import coalesce
+from Mailman import MailList
+
+
+class TestCoalesce(MailmanAPITestCase):
+    url = '/'
+    list_name = 'coalesced_list'
+
+    def setUp(self):
+        super(TestCoalesce, self).setUp()
+        self.create_list(self.list_name)
+        self.window = coalesce.WINDOW
+        coalesce.WINDOW = 0.2
+
+    def tearDown(self):
+        super(TestCoalesce, self).tearDown()
+        coalesce.WINDOW = self.window
+        self.remove_list(self.list_name)
+
+    def test_concurrent_subscribes(self):
+        path = '/members'
+        addresses = ['user%d@email.com' % i for i in range(5)]
+        responses = {}
+
+        def subscribe(address):
+            responses[address] = self.client.put(
+                self.url + self.list_name + path, {'address': address},
+                expect_errors=True)
+
+        threads = [threading.Thread(target=subscribe, args=(address,))
+                   for address in addresses]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for address in addresses:
+            self.assertEqual(responses[address].status_code, 200)
+            self.assertEqual(responses[address].json, {'message': 'Success'})
+        mlist = MailList.MailList(self.list_name, lock=False)
+        self.assertEqual(sorted(mlist.getMembers()), addresses)
+
+    def test_concurrent_subscribes_share_one_save(self):
+        path = '/members'
+        addresses = ['saved%d@email.com' % i for i in range(5)]
+        coalesce.WINDOW = 0.5
+        saves = []
+        save = MailList.MailList.Save
+
+        def counting_save(mlist):
+            saves.append(mlist.internal_name())
+            return save(mlist)
+
+        start = threading.Event()
+
+        def subscribe(address):
+            start.wait()
+            self.client.put(self.url + self.list_name + path,
+                            {'address': address}, expect_errors=False)
+
+        threads = [threading.Thread(target=subscribe, args=(address,))
+                   for address in addresses]
+        MailList.MailList.Save = counting_save
+        try:
+            for thread in threads:
+                thread.start()
+            start.set()
+            for thread in threads:
+                thread.join()
+        finally:
+            MailList.MailList.Save = save
+
+        self.assertEqual(saves, [self.list_name])
+        mlist = MailList.MailList(self.list_name, lock=False)
+        self.assertEqual(sorted(mlist.getMembers()), addresses)
+
+    def test_results_are_per_request(self):
+        path = '/members'
+        resp = self.client.delete(self.url + self.list_name + path,
+                                  {'address': 'user@email.com'},
+                                  expect_errors=True)
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(resp.json,
+                         {'message': 'Not a member: user@email.com'})
+
+    def test_unknown_list(self):
+        path = '/members'
+        resp = self.client.put(self.url + 'unknown_list' + path,
+                               {'address': 'user@email.com'},
+                               expect_errors=True)
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(resp.json, {'message': 'Unknown list: unknown_list'})
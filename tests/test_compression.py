@@ -0,0 +1,110 @@
+import zlib
+import unittest
+from webob import Request
+from .utils import MailmanAPITestCase
+from mailmanapi import compression
+from mailmanapi.routes import get_application
+from Mailman import MailList, UserDesc
+
+
+def application(environ, start_response):
+    size = int(environ['PATH_INFO'].strip('/') or 0)
+    start_response('200 OK', [('Content-Type', 'application/json')])
+    # Streamed in small chunks, without a Content-Length.
+    return ('x' * 10 for i in range(size // 10))
+
+
+def gunzip(body):
+    return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+
+
+def get(app, path, **headers):
+    # Unlike webtest, webob leaves compressed bodies alone.
+    return Request.blank(path, headers=headers).get_response(app)
+
+
+class TestCompressionMiddleware(unittest.TestCase):
+
+    def setUp(self):
+        self.app = compression.CompressionMiddleware(application)
+
+    def test_not_accepted(self):
+        resp = get(self.app, '/5000')
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.body, 'x' * 5000)
+
+    def test_small_response(self):
+        resp = get(self.app, '/100', Accept_Encoding='gzip')
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertNotIn('Vary', resp.headers)
+        self.assertEqual(resp.body, 'x' * 100)
+
+    def test_gzip_stream(self):
+        resp = get(self.app, '/500000', Accept_Encoding='deflate, gzip')
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gunzip(resp.body), 'x' * 500000)
+        self.assertLess(len(resp.body), 5000)
+
+    def test_deflate(self):
+        resp = get(self.app, '/5000', Accept_Encoding='gzip;q=0, deflate')
+        self.assertEqual(resp.headers['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(resp.body), 'x' * 5000)
+
+    def test_choose_encoding(self):
+        self.assertEqual(compression.choose_encoding('*'), 'gzip')
+        self.assertEqual(compression.choose_encoding('identity'), None)
+        self.assertEqual(compression.choose_encoding('br, gzip;q=0.5'),
+                         'gzip')
+        self.assertEqual(compression.choose_encoding(None), None)
+
+
+class TestCompressedAPI(MailmanAPITestCase):
+    url = '/'
+    list_name = 'compressed_list'
+
+    def setUp(self):
+        super(TestCompressedAPI, self).setUp()
+        self.create_list(self.list_name)
+        mlist = MailList.MailList(self.list_name)
+        try:
+            for i in range(200):
+                mlist.ApprovedAddMember(
+                    UserDesc.UserDesc('user%03d@email.com' % i))
+            mlist.Save()
+        finally:
+            mlist.Unlock()
+        self.app = get_application()
+
+    def tearDown(self):
+        super(TestCompressedAPI, self).tearDown()
+        self.remove_list(self.list_name)
+
+    def test_members(self):
+        url = self.url + self.list_name + '/members'
+        plain = get(self.app, url)
+        for query in ('', '?stream=true'):
+            resp = get(self.app, url + query, Accept_Encoding='gzip')
+            self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(gunzip(resp.body), plain.body)
+
+    def test_etag(self):
+        url = self.url + self.list_name + '/members'
+        resp = get(self.app, url, Accept_Encoding='gzip')
+        etag = resp.headers['ETag']
+        self.assertTrue(etag.endswith('-gzip"'))
+
+        resp = get(self.app, url, Accept_Encoding='gzip', If_None_Match=etag)
+        self.assertEqual(resp.status_int, 304)
+        self.assertEqual(resp.headers['ETag'], etag)
+
+    def test_small_response_etag(self):
+        url = self.url + self.list_name
+        plain = get(self.app, url)
+        resp = get(self.app, url, Accept_Encoding='gzip')
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.headers['ETag'], plain.headers['ETag'])
+
+        resp = get(self.app, url, Accept_Encoding='gzip',
+                   If_None_Match=plain.headers['ETag'])
+        self.assertEqual(resp.status_int, 304)
+        self.assertEqual(resp.headers['ETag'], plain.headers['ETag'])
@@ -0,0 +1,59 @@
+from .utils import MailmanAPITestCase
+from mailmanapi import cache
+
+
+class TestConditionalRequests(MailmanAPITestCase):
+    url = '/'
+    list_name = 'conditional_list'
+
+    def setUp(self):
+        super(TestConditionalRequests, self).setUp()
+        self.create_list(self.list_name)
+
+    def tearDown(self):
+        super(TestConditionalRequests, self).tearDown()
+        self.remove_list(self.list_name)
+
+    def assertNotModified(self, url, headers):
+        before = cache.stats()
+        resp = self.client.get(url, headers=headers, status=304)
+        self.assertEqual(resp.body, '')
+        # Answered without looking the list up at all.
+        after = cache.stats()
+        self.assertEqual((after['hits'], after['misses']),
+                         (before['hits'], before['misses']))
+        return resp
+
+    def test_list_attr_etag(self):
+        url = self.url + self.list_name
+        resp = self.client.get(url, expect_errors=False)
+        etag = resp.headers['ETag']
+        self.assertNotModified(url, {'If-None-Match': etag})
+        self.assertNotModified(url, {'If-None-Match': '"other", W/' + etag})
+
+        self.change_list_attribute('description', 'Changed description')
+        resp = self.client.get(url, headers={'If-None-Match': etag},
+                               expect_errors=False)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+    def test_members_last_modified(self):
+        url = self.url + self.list_name + '/members'
+        resp = self.client.get(url, expect_errors=False)
+        last_modified = resp.headers['Last-Modified']
+        self.assertNotModified(url, {'If-Modified-Since': last_modified})
+        epoch = 'Thu, 01 Jan 1970 00:00:00 GMT'
+        resp = self.client.get(url, headers={'If-Modified-Since': epoch},
+                               expect_errors=False)
+        self.assertEqual(resp.status_code, 200)
+
+    def test_list_lists_etag(self):
+        resp = self.client.get(self.url, expect_errors=False)
+        etag = resp.headers['ETag']
+        self.assertNotModified(self.url, {'If-None-Match': etag})
+
+        self.remove_list(self.list_name)
+        resp = self.client.get(self.url, headers={'If-None-Match': etag},
+                               expect_errors=False)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers['ETag'], etag)
@@ -0,0 +1,55 @@
+from .utils import MailmanAPITestCase
+from mailmanapi import utils
+from Mailman import MailList, UserDesc
+
+
+class TestEraseMember(MailmanAPITestCase):
+    url = '/_members'
+    address = 'erase@email.com'
+    list_names = ['erase_list1', 'erase_list2', 'erase_list3']
+
+    def setUp(self):
+        super(TestEraseMember, self).setUp()
+        for list_name in self.list_names:
+            self.create_list(list_name)
+        for list_name in self.list_names[:2]:
+            mlist = MailList.MailList(list_name)
+            mlist.AddMember(UserDesc.UserDesc(self.address, 'Erase'))
+            mlist.Save()
+            mlist.Unlock()
+
+    def tearDown(self):
+        super(TestEraseMember, self).tearDown()
+        for list_name in self.list_names:
+            self.remove_list(list_name)
+
+    def test_erase_member(self):
+        resp = self.client.delete(self.url + '?address=' + self.address,
+                                  expect_errors=False)
+        self.assertEqual(resp.json, [
+            {'listname': 'erase_list1', 'status': 200, 'message': 'Success'},
+            {'listname': 'erase_list2', 'status': 200, 'message': 'Success'}])
+        for list_name in self.list_names:
+            self.assertFalse(MailList.MailList(list_name, lock=False)
+                             .isMember(self.address))
+
+        resp = self.client.delete(self.url + '?address=' + self.address,
+                                  expect_errors=False)
+        self.assertEqual(resp.json, [])
+
+    def test_erase_member_locked_list(self):
+        lock_timeout = utils.LOCK_TIMEOUT
+        utils.LOCK_TIMEOUT = 0.1
+        mlist = MailList.MailList(self.list_names[1])
+        try:
+            resp = self.client.delete(self.url, {'address': self.address},
+                                      expect_errors=False)
+        finally:
+            mlist.Unlock()
+            utils.LOCK_TIMEOUT = lock_timeout
+        self.assertEqual([(r['listname'], r['status']) for r in resp.json],
+                         [('erase_list1', 200), ('erase_list2', 503)])
+
+    def test_erase_member_missing_address(self):
+        resp = self.client.delete(self.url, expect_errors=True)
+        self.assertEqual(resp.status_code, 400)
@@ -0,0 +1,71 @@
+import csv
+import json
+from StringIO import StringIO
+from .utils import MailmanAPITestCase
+from Mailman import MailList, UserDesc
+
+
+class TestExport(MailmanAPITestCase):
+    url = '/_export'
+    list_names = ['export_list1', 'export_list2']
+
+    def setUp(self):
+        super(TestExport, self).setUp()
+        for list_name in self.list_names:
+            self.create_list(list_name)
+        mlist = MailList.MailList(self.list_names[0])
+        mlist.AddMember(UserDesc.UserDesc('b@email.com', 'B'))
+        mlist.AddMember(UserDesc.UserDesc('a@email.com', 'A', digest=True))
+        mlist.Save()
+        mlist.Unlock()
+
+    def tearDown(self):
+        super(TestExport, self).tearDown()
+        for list_name in self.list_names:
+            self.remove_list(list_name)
+
+    def _records(self, resp):
+        return [record for record in
+                (json.loads(line) for line in resp.body.splitlines())
+                if record['listname'] in self.list_names]
+
+    def test_export_ndjson(self):
+        resp = self.client.get(self.url, expect_errors=False)
+        self.assertEqual(resp.content_type, 'application/x-ndjson')
+        records = self._records(resp)
+        self.assertEqual([(r['record'], r['listname'], r.get('address'))
+                          for r in records],
+                         [('list', 'export_list1', None),
+                          ('member', 'export_list1', 'a@email.com'),
+                          ('member', 'export_list1', 'b@email.com'),
+                          ('list', 'export_list2', None)])
+        self.assertEqual(records[0]['member_count'], 2)
+        self.assertEqual(records[1]['fullname'], 'A')
+        self.assertTrue(records[1]['digest'])
+        self.assertFalse(records[2]['digest'])
+
+    def test_export_after(self):
+        resp = self.client.get(self.url, {'after': 'export_list1'},
+                               expect_errors=False)
+        self.assertEqual([(r['record'], r['listname'])
+                          for r in self._records(resp)],
+                         [('list', 'export_list2')])
+
+    def test_export_csv(self):
+        resp = self.client.get(self.url, {'format': 'csv'},
+                               expect_errors=False)
+        self.assertEqual(resp.content_type, 'text/csv')
+        rows = list(csv.DictReader(StringIO(resp.body)))
+        rows = [row for row in rows if row['listname'] in self.list_names]
+        self.assertEqual([(row['record'], row['address'], row['digest'])
+                          for row in rows],
+                         [('list', '', ''),
+                          ('member', 'a@email.com', '1'),
+                          ('member', 'b@email.com', '0'),
+                          ('list', '', '')])
+        self.assertEqual(rows[0]['member_count'], '2')
+
+    def test_export_invalid_format(self):
+        resp = self.client.get(self.url, {'format': 'xml'},
+                               expect_errors=True)
+        self.assertEqual(resp.status_code, 400)
@@ -0,0 +1,102 @@
+import time
+from .utils import MailmanAPITestCase
+from mailmanapi import idempotency, utils
+from Mailman import MailList
+
+
+class TestIdempotency(MailmanAPITestCase):
+    url = '/'
+    list_name = 'idempotent_list'
+
+    def setUp(self):
+        super(TestIdempotency, self).setUp()
+        self.create_list(self.list_name)
+
+    def tearDown(self):
+        super(TestIdempotency, self).tearDown()
+        idempotency._connect().execute('DELETE FROM responses')
+        self.remove_list(self.list_name)
+
+    def test_subscribe_replay(self):
+        path = self.url + self.list_name + '/members'
+        headers = {'Idempotency-Key': 'subscribe-1'}
+        data = {'address': 'user@email.com'}
+        resp = self.client.put(path, data, headers=headers,
+                               expect_errors=False)
+        self.assertEqual(resp.json, {'message': 'Success'})
+        self.assertNotIn('Idempotent-Replayed', resp.headers)
+
+        # Mailman isn't asked again, so the replay isn't "Already a
+        # member" and works even with the list locked.
+        mlist = MailList.MailList(self.list_name)
+        try:
+            resp = self.client.put(path, data, headers=headers,
+                                   expect_errors=False)
+        finally:
+            mlist.Unlock()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json, {'message': 'Success'})
+        self.assertEqual(resp.content_type, 'application/json')
+        self.assertEqual(resp.headers['Idempotent-Replayed'], 'true')
+
+        # Without a key the request runs again.
+        resp = self.client.put(path, data, expect_errors=True)
+        self.assertEqual(resp.status_code, 405)
+
+    def test_errors_are_replayed(self):
+        path = self.url + 'missing_list/members'
+        headers = {'Idempotency-Key': 'unsubscribe-1'}
+        for _ in range(2):
+            resp = self.client.delete(path, {'address': 'user@email.com'},
+                                      headers=headers, expect_errors=True)
+            self.assertEqual(resp.status_code, 404)
+        self.assertEqual(resp.headers['Idempotent-Replayed'], 'true')
+
+    def test_key_reused_for_another_request(self):
+        path = self.url + self.list_name + '/members'
+        headers = {'Idempotency-Key': 'subscribe-2'}
+        self.client.put(path, {'address': 'user@email.com'},
+                        headers=headers, expect_errors=False)
+        resp = self.client.put(path, {'address': 'other@email.com'},
+                               headers=headers, expect_errors=True)
+        self.assertEqual(resp.status_code, 422)
+
+    def test_key_in_progress(self):
+        path = self.url + self.list_name + '/members'
+        headers = {'Idempotency-Key': 'subscribe-3'}
+        data = {'address': 'user@email.com'}
+        self.client.put(path, data, headers=headers, expect_errors=False)
+        # Pretend the first request is still running.
+        conn = idempotency._connect()
+        conn.execute("UPDATE responses SET status = NULL "
+                     "WHERE key = 'subscribe-3'")
+        resp = self.client.put(path, data, headers=headers,
+                               expect_errors=True)
+        self.assertEqual(resp.status_code, 409)
+
+        # Until it's presumed lost.
+        conn.execute("UPDATE responses SET created = ? "
+                     "WHERE key = 'subscribe-3'",
+                     (time.time() - idempotency.PENDING_TIMEOUT - 1,))
+        resp = self.client.put(path, data, headers=headers,
+                               expect_errors=True)
+        self.assertEqual(resp.status_code, 405)
+        self.assertNotIn('Idempotent-Replayed', resp.headers)
+
+    def test_server_errors_are_not_kept(self):
+        path = self.url + self.list_name + '/members'
+        headers = {'Idempotency-Key': 'subscribe-4'}
+        data = {'address': 'user@email.com'}
+        lock_timeout = utils.LOCK_TIMEOUT
+        utils.LOCK_TIMEOUT = 0.1
+        mlist = MailList.MailList(self.list_name)
+        try:
+            resp = self.client.put(path, data, headers=headers,
+                                   expect_errors=True)
+        finally:
+            mlist.Unlock()
+            utils.LOCK_TIMEOUT = lock_timeout
+        self.assertEqual(resp.status_code, 503)
+        resp = self.client.put(path, data, headers=headers,
+                               expect_errors=False)
+        self.assertEqual(resp.json, {'message': 'Success'})
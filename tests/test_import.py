@@ -0,0 +1,96 @@
+import json
+from .utils import MailmanAPITestCase
+from mailmanapi import api, utils
+from Mailman import MailList, UserDesc
+
+
+class TestImportMembers(MailmanAPITestCase):
+    list_name = 'import_list'
+    url = '/import_list/members/import'
+
+    def setUp(self):
+        super(TestImportMembers, self).setUp()
+        self.create_list(self.list_name)
+        mlist = MailList.MailList(self.list_name)
+        mlist.AddMember(UserDesc.UserDesc('existing@email.com'))
+        mlist.Save()
+        mlist.Unlock()
+        self.chunk_size = api.IMPORT_CHUNK_SIZE
+        api.IMPORT_CHUNK_SIZE = 2
+
+    def tearDown(self):
+        super(TestImportMembers, self).tearDown()
+        api.IMPORT_CHUNK_SIZE = self.chunk_size
+        self.remove_list(self.list_name)
+
+    def _import(self, body, content_type, expect_errors=False):
+        return self.client.post(self.url, body,
+                                content_type=content_type,
+                                expect_errors=expect_errors)
+
+    def test_import_csv(self):
+        body = ('Address,FullName,digest\n'
+                'user1@email.com,"Doe, John",true\n'
+                'existing@email.com,,\n'
+                'not an address,,\n'
+                'user2@email.com,,\n')
+        resp = self._import(body, 'text/csv')
+        self.assertEqual(resp.json['rows'], 4)
+        self.assertEqual(resp.json['added'], 2)
+        self.assertEqual(resp.json['skipped'], 1)
+        self.assertEqual(resp.json['failed'], 1)
+        self.assertEqual([(e['row'], e['address'], e['status'])
+                          for e in resp.json['errors']],
+                         [(3, 'not an address', 400)])
+        mlist = MailList.MailList(self.list_name, lock=False)
+        self.assertEqual(mlist.getMemberName('user1@email.com'), 'Doe, John')
+        self.assertIn('user1@email.com', mlist.getDigestMemberKeys())
+        self.assertTrue(mlist.isMember('user2@email.com'))
+
+    def test_import_ndjson(self):
+        body = '\n'.join(['"user1@email.com"',
+                          json.dumps({'address': 'user2@email.com',
+                                      'fullname': 'User Two'}),
+                          '{not json',
+                          '{"address": 5}',
+                          ''])
+        resp = self._import(body, 'application/x-ndjson')
+        self.assertEqual((resp.json['rows'], resp.json['added'],
+                          resp.json['failed']), (4, 2, 2))
+        self.assertEqual([(e['row'], e['status'])
+                          for e in resp.json['errors']],
+                         [(3, 400), (4, 400)])
+        self.assertEqual(resp.json['errors'][1]['message'],
+                         'Invalid parameters: address must be a string')
+        mlist = MailList.MailList(self.list_name, lock=False)
+        self.assertEqual(mlist.getMemberName('user2@email.com'), 'User Two')
+
+    def test_import_invalid_body(self):
+        resp = self._import('[]', 'application/json', expect_errors=True)
+        self.assertEqual(resp.status_code, 400)
+        resp = self._import('name\nfoo\n', 'text/csv', expect_errors=True)
+        self.assertEqual(resp.status_code, 400)
+
+    def test_import_unknown_list(self):
+        resp = self.client.post('/no_such_list/members/import',
+                                'user1@email.com\n', content_type='text/csv',
+                                expect_errors=True)
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.post('/no_such_list/members/import',
+                                'address\nuser1@email.com\n',
+                                content_type='text/csv', expect_errors=True)
+        self.assertEqual(resp.status_code, 404)
+
+    def test_import_lock_timeout(self):
+        lock_timeout = utils.LOCK_TIMEOUT
+        utils.LOCK_TIMEOUT = 0.1
+        body = ''.join('address\n' if i == 0 else 'user%d@email.com\n' % i
+                       for i in range(5))
+        mlist = MailList.MailList(self.list_name)
+        try:
+            resp = self._import(body, 'text/csv', expect_errors=True)
+        finally:
+            mlist.Unlock()
+            utils.LOCK_TIMEOUT = lock_timeout
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers['Retry-After'], str(utils.RETRY_AFTER))
@@ -0,0 +1,128 @@
+from .utils import MailmanAPITestCase
+from mailmanapi import index
+from Mailman import MailList, UserDesc
+
+
+class TestReadModel(MailmanAPITestCase):
+    url = '/'
+    list_name = 'indexed_list'
+
+    def setUp(self):
+        super(TestReadModel, self).setUp()
+        self.create_list(self.list_name)
+        self.read_model = index.READ_MODEL
+        index.READ_MODEL = 'consistent'
+
+    def tearDown(self):
+        super(TestReadModel, self).tearDown()
+        index.READ_MODEL = self.read_model
+        self.remove_list(self.list_name)
+
+    def subscribe_outside_api(self, address, fullname=None):
+        mlist = MailList.MailList(self.list_name)
+        try:
+            mlist.ApprovedAddMember(UserDesc.UserDesc(address, fullname))
+            mlist.Save()
+        finally:
+            mlist.Unlock()
+
+    def test_list_attr(self):
+        index.READ_MODEL = None
+        expected = self.client.get(self.url + self.list_name).json
+        index.READ_MODEL = 'consistent'
+        resp = self.client.get(self.url + self.list_name,
+                               expect_errors=False)
+        self.assertEqual(resp.json, expected)
+
+    def test_list_lists(self):
+        resp = self.client.get(self.url, expect_errors=False)
+        self.assertIn(self.list_name,
+                      [item['listname'] for item in resp.json])
+
+    def test_list_lists_fields(self):
+        resp = self.client.get(self.url, {'fields': 'member_count'},
+                               expect_errors=False)
+        self.assertIn({'listname': self.list_name, 'member_count': 0},
+                      resp.json)
+
+    def test_unknown_list(self):
+        resp = self.client.get(self.url + 'missing_list/members',
+                               expect_errors=True)
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(resp.json, {'message': 'Unknown list: missing_list'})
+
+    def test_subscribe_write_through(self):
+        path = '/members'
+        self.change_list_attribute('subscribe_policy', 0)
+        self.client.put(self.url + self.list_name + path,
+                        {'address': 'user@email.com', 'fullname': 'User'},
+                        expect_errors=False)
+        resp = self.client.get(self.url + self.list_name + path,
+                               {'address': 'user@email.com'},
+                               expect_errors=False)
+        self.assertEqual(resp.json, [{'address': 'user@email.com',
+                                      'fullname': 'User'}])
+        resp = self.client.get(self.url + self.list_name,
+                               expect_errors=False)
+        self.assertEqual(resp.json[0]['member_count'], 1)
+
+        self.client.delete(self.url + self.list_name + path,
+                           {'address': 'user@email.com'},
+                           expect_errors=False)
+        resp = self.client.get(self.url + self.list_name + path,
+                               {'address': 'user@email.com'},
+                               expect_errors=True)
+        self.assertEqual(resp.status_code, 404)
+
+    def test_members_pagination(self):
+        path = '/members'
+        addresses = ['user%d@email.com' % i for i in range(5)]
+        for address in addresses:
+            self.subscribe_outside_api(address)
+        resp = self.client.get(self.url + self.list_name + path,
+                               {'limit': 3}, expect_errors=False)
+        self.assertEqual(resp.json, addresses[:3])
+        cursor = resp.headers['X-Next-Cursor']
+        resp = self.client.get(self.url + self.list_name + path,
+                               {'limit': 3, 'after': cursor},
+                               expect_errors=False)
+        self.assertEqual(resp.json, addresses[3:])
+        self.assertNotIn('X-Next-Cursor', resp.headers)
+
+    def test_members_search(self):
+        path = '/members'
+        self.subscribe_outside_api('user@email.com', 'Some User')
+        resp = self.client.get(self.url + self.list_name + path,
+                               {'q': 'some'}, expect_errors=False)
+        self.assertEqual(resp.json, [{'address': 'user@email.com',
+                                      'fullname': 'Some User'}])
+
+    def test_members_detail(self):
+        path = '/members'
+        self.subscribe_outside_api('user@email.com', 'Some User')
+        resp = self.client.get(self.url + self.list_name + path,
+                               {'detail': '1'}, expect_errors=False)
+        self.assertEqual(resp.json, [{'address': 'user@email.com',
+                                      'fullname': 'Some User',
+                                      'digest': False,
+                                      'delivery_status': 0,
+                                      'language': 'en'}])
+
+    def test_stale_reads(self):
+        path = '/members'
+        refresh_interval = index.REFRESH_INTERVAL
+        index.READ_MODEL = 'stale'
+        try:
+            index.refresh(force=True)
+            index.REFRESH_INTERVAL = 3600
+            self.subscribe_outside_api('outside@email.com')
+            resp = self.client.get(self.url + self.list_name + path,
+                                   expect_errors=False)
+            self.assertEqual(resp.json, [])
+
+            index.READ_MODEL = 'consistent'
+            resp = self.client.get(self.url + self.list_name + path,
+                                   expect_errors=False)
+            self.assertEqual(resp.json, ['outside@email.com'])
+        finally:
+            index.REFRESH_INTERVAL = refresh_interval
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+from .utils import MailmanAPITestCase
+from mailmanapi import jobs
+from Mailman import Utils, mm_cfg
+
+
+@jobs.handler('test_echo')
+def echo(listname, params, progress):
+    progress(1, 1)
+    return params['status'], params['message']
+
+
+class TestJobs(MailmanAPITestCase):
+    url = '/'
+
+    def wait(self, job_id, timeout=10):
+        deadline = time.time() + timeout
+        while True:
+            job = self.client.get(self.url + '_jobs/' + job_id,
+                                  expect_errors=False).json
+            if job['state'] in ('done', 'failed') or time.time() > deadline:
+                return job
+            time.sleep(0.05)
+
+    def test_create_list_async(self):
+        list_name = 'async_list'
+        resp = self.client.post(self.url + list_name + '?async=true',
+                                {'admin': 'admin@list.com',
+                                 'password': '123456'},
+                                expect_errors=False)
+        self.assertEqual(resp.status_code, 202)
+        job_id = resp.json['id']
+        self.assertTrue(resp.headers['Location'].endswith('/_jobs/' + job_id))
+        self.assertEqual(resp.json['kind'], 'create_list')
+
+        job = self.wait(job_id)
+        self.assertEqual(job['state'], 'done')
+        self.assertEqual(job['result'], {'status': 200,
+                                         'message': 'Success'})
+        self.assertEqual(job['progress'], {'done': 3, 'total': 3})
+        self.assertIn(list_name, Utils.list_names())
+        # The password isn't kept once the job is done.
+        params = jobs._connect().execute('SELECT params FROM jobs '
+                                         'WHERE id = ?', (job_id,))
+        self.assertEqual(params.fetchone(), ('{}',))
+
+        # Failures are reported as the job's result.
+        resp = self.client.post(self.url + list_name,
+                                {'admin': 'admin@list.com',
+                                 'password': '123456', 'async': 'true'},
+                                expect_errors=False)
+        job = self.wait(resp.json['id'])
+        self.assertEqual(job['state'], 'failed')
+        self.assertEqual(job['result'],
+                         {'status': 400,
+                          'message': 'List already exists: ' + list_name})
+        self.remove_list(list_name)
+
+    def test_delete_list_async(self):
+        list_name = 'async_delete_list'
+        self.create_list(list_name)
+        archive = os.path.join(mm_cfg.VAR_PREFIX, 'archives', 'private',
+                               list_name, '2016-May')
+        os.makedirs(archive)
+        for number in range(5):
+            open(os.path.join(archive, '%06d.html' % number), 'w').close()
+
+        resp = self.client.delete(self.url + list_name + '?async=true',
+                                  {'delete_archives': 'true'},
+                                  expect_errors=False)
+        self.assertEqual(resp.status_code, 202)
+        job = self.wait(resp.json['id'])
+        self.assertEqual(job['state'], 'done')
+        self.assertEqual(job['result']['status'], 200)
+        self.assertTrue(job['progress']['done'] >= 7)
+        self.assertNotIn(list_name, Utils.list_names())
+        self.assertFalse(os.path.exists(os.path.dirname(archive)))
+
+    def test_async_one(self):
+        list_name = 'async_one_list'
+        resp = self.client.post(self.url + list_name + '?async=1',
+                                {'admin': 'admin@list.com',
+                                 'password': '123456'},
+                                expect_errors=False)
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(self.wait(resp.json['id'])['state'], 'done')
+        self.assertIn(list_name, Utils.list_names())
+
+        resp = self.client.delete(self.url + list_name + '?async=1',
+                                  expect_errors=False)
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(self.wait(resp.json['id'])['state'], 'done')
+        self.assertNotIn(list_name, Utils.list_names())
+
+    def test_delete_unknown_list_async(self):
+        resp = self.client.delete(self.url + 'missing_list?async=true',
+                                  expect_errors=True)
+        self.assertEqual(resp.status_code, 404)
+
+    def test_unknown_job(self):
+        resp = self.client.get(self.url + '_jobs/missing', expect_errors=True)
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(resp.json, {'message': 'Unknown job: missing'})
+
+    def test_lost_job_is_run_again(self):
+        job_id = jobs.submit('test_echo', None,
+                             {'status': 200, 'message': 'Echo'})
+        self.wait(job_id)
+        # Pretend a worker died while running it.
+        params = json.dumps({'status': 200, 'message': 'Echo'})
+        conn = jobs._connect()
+        conn.execute("UPDATE jobs SET state = 'running', status = NULL, "
+                     "params = ?, lease_until = ? WHERE id = ?",
+                     (params, time.time() - 1, job_id))
+        jobs.start()
+        job = self.wait(job_id)
+        self.assertEqual(job['state'], 'done')
+        self.assertEqual(job['attempts'], 2)
+
+        conn.execute("UPDATE jobs SET state = 'running', status = NULL, "
+                     "params = ?, attempts = ?, lease_until = ? "
+                     "WHERE id = ?",
+                     (params, jobs.MAX_ATTEMPTS, time.time() - 1, job_id))
+        job = self.wait(job_id)
+        self.assertEqual(job['state'], 'failed')
+        self.assertEqual(job['result']['message'], 'Job lost too many times')
@@ -0,0 +1,45 @@
+from .utils import MailmanAPITestCase
+from mailmanapi import metrics
+
+
+class TestMetrics(MailmanAPITestCase):
+    url = '/'
+    list_name = 'metrics_list'
+
+    def setUp(self):
+        super(TestMetrics, self).setUp()
+        self.create_list(self.list_name)
+
+    def tearDown(self):
+        super(TestMetrics, self).tearDown()
+        self.remove_list(self.list_name)
+
+    def test_request_and_phase_metrics(self):
+        self.client.get(self.url + self.list_name, expect_errors=False)
+        self.client.put(self.url + self.list_name + '/members',
+                        {'address': 'metrics@email.com'},
+                        expect_errors=False)
+        resp = self.client.get('/_metrics', expect_errors=False)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith('text/plain'))
+        body = resp.body
+        self.assertIn('# TYPE mailmanapi_requests_total counter', body)
+        self.assertIn('mailmanapi_requests_total{method="GET",'
+                      'route="/<listname>",status="200"}', body)
+        self.assertIn('mailmanapi_request_duration_seconds_bucket{'
+                      'method="PUT",route="/<listname>/members",'
+                      'status="200",le="+Inf"}', body)
+        for phase in ('lock', 'unpickle', 'mutation', 'save', 'serialize'):
+            self.assertIn('phase="%s"' % phase, body)
+        self.assertIn('mailmanapi_lock_wait_seconds_count{listname="%s"}'
+                      % self.list_name, body)
+
+    def test_render(self):
+        snapshot = {'counters': {('a_total', (('x', 'y"z'),)): 2},
+                    'histograms': {('b_seconds', ()): [1] + [0] * (
+                        len(metrics.BUCKETS) - 1) + [0.0005, 1]}}
+        lines = metrics.render(snapshot).splitlines()
+        self.assertIn('a_total{x="y\\"z"} 2', lines)
+        self.assertIn('b_seconds_bucket{le="0.001"} 1', lines)
+        self.assertIn('b_seconds_bucket{le="+Inf"} 1', lines)
+        self.assertIn('b_seconds_count 1', lines)
@@ -0,0 +1,98 @@
+import os
+import time
+from .utils import MailmanAPITestCase
+from mailmanapi import outbox
+from Mailman import mm_cfg
+
+
+@outbox.renderer('test_fail')
+def fail(mlist, params):
+    raise IOError('queue unavailable')
+
+
+class TestOutbox(MailmanAPITestCase):
+    url = '/'
+    list_name = 'outbox_list'
+
+    def setUp(self):
+        super(TestOutbox, self).setUp()
+        self.create_list(self.list_name)
+        self.settings = (outbox.MAX_ATTEMPTS, outbox.RETRY_DELAY,
+                         outbox.POLL_INTERVAL)
+
+    def tearDown(self):
+        super(TestOutbox, self).tearDown()
+        (outbox.MAX_ATTEMPTS, outbox.RETRY_DELAY,
+         outbox.POLL_INTERVAL) = self.settings
+        outbox._connect().execute("DELETE FROM outbox WHERE kind = "
+                                  "'test_fail'")
+        self.remove_list(self.list_name)
+
+    def wait(self, condition, timeout=10):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.05)
+        return condition()
+
+    def sent(self, subject):
+        queue = os.path.join(mm_cfg.QUEUE_DIR, 'virgin')
+        if not os.path.isdir(queue):
+            return False
+        for name in os.listdir(queue):
+            with open(os.path.join(queue, name)) as fp:
+                if 'Subject: %s\n' % subject in fp.read():
+                    return True
+        return False
+
+    def test_create_list_notification(self):
+        new_list = 'outbox_new_list'
+        resp = self.client.post(self.url + new_list,
+                                {'admin': 'admin@list.com',
+                                 'password': '123456'},
+                                expect_errors=False)
+        self.assertEqual(resp.json, {'message': 'Success'})
+        self.assertTrue(self.wait(lambda: self.sent(
+            'Your new mailing list: %(listname)s')))
+        self.assertTrue(self.wait(
+            lambda: outbox.depth() == {'pending': 0, 'given_up': 0}))
+        self.remove_list(new_list)
+
+    def test_password_not_queued(self):
+        new_list = 'outbox_password_list'
+        queued = []
+        queue = outbox.queue
+        outbox.queue = lambda *args: queued.append(args)
+        try:
+            self.client.post(self.url + new_list,
+                             {'admin': 'admin@list.com',
+                              'password': '123456'},
+                             expect_errors=False)
+        finally:
+            outbox.queue = queue
+        self.assertEqual(queued, [(new_list, 'newlist',
+                                   {'admin': 'admin@list.com',
+                                    'siteowner': 'admin@list.com'})])
+        self.remove_list(new_list)
+
+    def test_retry_and_give_up(self):
+        outbox.RETRY_DELAY = 0
+        outbox.POLL_INTERVAL = 0.1
+        outbox.MAX_ATTEMPTS = 2
+        outbox.queue(self.list_name, 'test_fail', {})
+        self.assertTrue(self.wait(
+            lambda: outbox.depth()['given_up'] == 1))
+        row = outbox._connect().execute(
+            "SELECT attempts, last_error FROM outbox "
+            "WHERE kind = 'test_fail'").fetchone()
+        self.assertEqual(row, (2, 'IOError: queue unavailable'))
+
+        resp = self.client.get('/_metrics', expect_errors=False)
+        self.assertIn('mailmanapi_outbox_depth{state="given_up"} 1',
+                      resp.body)
+        self.assertIn('mailmanapi_outbox_depth{state="pending"} 0',
+                      resp.body)
+
+    def test_unknown_list(self):
+        outbox.queue('missing_list', 'test_fail', {})
+        self.assertTrue(self.wait(
+            lambda: outbox.depth() == {'pending': 0, 'given_up': 0}))
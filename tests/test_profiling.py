@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import unittest
+from webtest import TestApp
+from mailmanapi import profiling
+
+
+def application(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return iter(['streamed ', 'body'])
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = (profiling.DIRECTORY, profiling.SAMPLE_RATE,
+                         profiling.TOKEN, profiling.MAX_FILES)
+        profiling.DIRECTORY = tempfile.mkdtemp()
+        profiling.SAMPLE_RATE = 0
+        profiling.TOKEN = 'secret'
+        self.client = TestApp(profiling.ProfilerMiddleware(application))
+
+    def tearDown(self):
+        shutil.rmtree(profiling.DIRECTORY)
+        (profiling.DIRECTORY, profiling.SAMPLE_RATE,
+         profiling.TOKEN, profiling.MAX_FILES) = self.settings
+
+    def profiles(self):
+        return sorted(name for name in os.listdir(profiling.DIRECTORY)
+                      if name.endswith('.prof'))
+
+    def test_not_sampled(self):
+        resp = self.client.get('/list/members')
+        self.assertEqual(resp.body, 'streamed body')
+        self.assertEqual(self.profiles(), [])
+
+    def test_token(self):
+        resp = self.client.get('/list/members',
+                               headers={'X-Profile': 'secret'})
+        self.assertEqual(resp.body, 'streamed body')
+        self.assertEqual(len(self.profiles()), 1)
+        self.assertIn('GET-list_members', self.profiles()[0])
+        summary = os.path.join(profiling.DIRECTORY, 'summary.txt')
+        self.assertTrue(os.path.exists(summary))
+
+    def test_wrong_token(self):
+        self.client.get('/', headers={'X-Profile': 'guess'})
+        self.assertEqual(self.profiles(), [])
+
+    def test_sampled_and_rotated(self):
+        profiling.SAMPLE_RATE = 1
+        profiling.MAX_FILES = 2
+        for path in ('/a', '/b', '/c'):
+            self.client.get(path)
+        self.assertEqual(len(self.profiles()), 2)
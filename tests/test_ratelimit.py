@@ -0,0 +1,67 @@
+import unittest
+from .utils import MailmanAPITestCase
+from mailmanapi import ratelimit
+
+
+class TestRateLimit(MailmanAPITestCase):
+    url = '/'
+    list_name = 'limited_list'
+
+    def setUp(self):
+        super(TestRateLimit, self).setUp()
+        self.create_list(self.list_name)
+        ratelimit._connect().execute('DELETE FROM buckets')
+
+    def tearDown(self):
+        super(TestRateLimit, self).tearDown()
+        ratelimit.CLIENT_LIMITS = {}
+        ratelimit.LIST_LIMITS = {}
+        ratelimit.API_KEYS = set()
+        self.remove_list(self.list_name)
+
+    def test_client_limit(self):
+        ratelimit.CLIENT_LIMITS = {'read': (0.5, 2)}
+        for _ in range(2):
+            self.client.get(self.url + self.list_name, expect_errors=False)
+        resp = self.client.get(self.url + self.list_name, expect_errors=True)
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp.json, {'message': 'Too many requests'})
+        self.assertEqual(resp.headers['Retry-After'], '2')
+
+        # Unknown API keys don't make for another client.
+        resp = self.client.get(self.url + self.list_name,
+                               headers={'X-API-Key': 'unknown'},
+                               expect_errors=True)
+        self.assertEqual(resp.status_code, 429)
+
+        # Other clients and route classes have their own allowance.
+        ratelimit.API_KEYS = set(['other'])
+        self.client.get(self.url + self.list_name,
+                        headers={'X-API-Key': 'other'}, expect_errors=False)
+        self.client.get(self.url + self.list_name,
+                        extra_environ={'REMOTE_ADDR': '10.0.0.1'},
+                        expect_errors=False)
+        self.client.get(self.url, expect_errors=False)
+        self.client.get('/_metrics', expect_errors=False)
+
+    def test_list_limit(self):
+        ratelimit.LIST_LIMITS = {'write': (0.1, 1)}
+        path = self.url + self.list_name + '/members'
+        self.client.put(path, {'address': 'user@email.com'},
+                        expect_errors=False)
+        resp = self.client.put(path, {'address': 'other@email.com'},
+                               headers={'X-API-Key': 'other'},
+                               expect_errors=True)
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp.headers['Retry-After'], '10')
+        # Reads aren't limited.
+        self.client.get(path, expect_errors=False)
+
+
+class TestParseLimit(unittest.TestCase):
+
+    def test_parse_limit(self):
+        self.assertEqual(ratelimit.parse_limit('scan:0.5:3'),
+                         ('scan', (0.5, 3.0)))
+        for value in ('scan:1', 'bulk:1:1', 'read:0:1', 'read:1:0.5'):
+            self.assertRaises(ValueError, ratelimit.parse_limit, value)
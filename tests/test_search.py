@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import unittest
+from mailmanapi.search import MemberIndex
+
+
+class FakeList(object):
+
+    def __init__(self, members):
+        self.members = members
+
+    def getMembers(self):
+        return list(self.members)
+
+    def getMemberName(self, address):
+        return self.members[address]
+
+
+class TestMemberIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = MemberIndex(FakeList({
+            'alice@example.com': 'Alice Smith',
+            'bob@example.org': 'Bob Jones',
+            'carol@example.com': None,
+            'smithers@example.net': u'Wayland Sm\xeftherson',
+            'zed@sub.example.com': 'Zed',
+        }))
+
+    def addresses(self, *args, **kwargs):
+        results, more = self.index.search(*args, **kwargs)
+        return [address for address, fullname in results], more
+
+    def test_substring(self):
+        self.assertEqual(self.addresses('SMITH'),
+                         (['alice@example.com', 'smithers@example.net'],
+                          False))
+        self.assertEqual(self.addresses('example.com'),
+                         (['alice@example.com', 'carol@example.com',
+                           'zed@sub.example.com'], False))
+        self.assertEqual(self.addresses('sm\xc3\xaf'),
+                         (['smithers@example.net'], False))
+        self.assertEqual(self.addresses('nobody'), ([], False))
+
+    def test_prefix(self):
+        self.assertEqual(self.addresses('sm', prefix=True),
+                         (['smithers@example.net'], False))
+        self.assertEqual(self.addresses('bob j', prefix=True),
+                         (['bob@example.org'], False))
+        self.assertEqual(self.addresses('w', prefix=True),
+                         (['smithers@example.net'], False))
+
+    def test_domain(self):
+        self.assertEqual(self.addresses('@EXAMPLE.com'),
+                         (['alice@example.com', 'carol@example.com'], False))
+        self.assertEqual(self.addresses('@example.invalid'), ([], False))
+
+    def test_limit_and_after(self):
+        self.assertEqual(self.addresses('example', limit=2),
+                         (['alice@example.com', 'bob@example.org'], True))
+        self.assertEqual(self.addresses('example', limit=2,
+                                        after='bob@example.org'),
+                         (['carol@example.com', 'smithers@example.net'],
+                          True))
+        self.assertEqual(self.addresses('example', limit=2,
+                                        after='smithers@example.net'),
+                         (['zed@sub.example.com'], False))
+        self.assertEqual(self.addresses('@example.com',
+                                        after='alice@example.com'),
+                         (['carol@example.com'], False))
+
+    def test_results_keep_full_names(self):
+        results, more = self.index.search('bob')
+        self.assertEqual(results, [('bob@example.org', 'Bob Jones')])
@@ -0,0 +1,71 @@
+import json
+from StringIO import StringIO
+import unittest
+from mailmanapi import utils
+
+
+class TestJSONEncoding(unittest.TestCase):
+
+    def setUp(self):
+        self.encoder = utils.json_encoder
+
+    def tearDown(self):
+        utils.use_json_encoder(self.encoder)
+
+    def test_iter_json_array(self):
+        items = [{'address': 'user%d@email.com' % i} for i in range(5)]
+        chunks = list(utils.iter_json_array(iter(items), chunk_size=2))
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(json.loads(''.join(chunks)), items)
+        self.assertEqual(''.join(utils.iter_json_array([])), '[]')
+
+    def test_iter_ndjson(self):
+        items = ['user%d@email.com' % i for i in range(5)]
+        body = ''.join(utils.iter_ndjson(items, chunk_size=2))
+        self.assertEqual([json.loads(line) for line in body.splitlines()],
+                         items)
+        self.assertEqual(''.join(utils.iter_ndjson([])), '')
+
+    def test_use_json_encoder(self):
+        self.assertEqual(utils.use_json_encoder('json'), 'json')
+        self.assertEqual(utils.dumps, json.dumps)
+        self.assertIn(utils.use_json_encoder(), utils.JSON_ENCODERS)
+        self.assertRaises(ImportError, utils.use_json_encoder,
+                          'no_such_encoder')
+
+
+class TestParseBoolean(unittest.TestCase):
+
+    def test_parse_boolean(self):
+        for value in ('true', 'True'):
+            self.assertTrue(utils.parse_boolean(value))
+        for value in (None, '', 'false', '0', '1', 'yes'):
+            self.assertFalse(utils.parse_boolean(value))
+
+
+class TestIterCSV(unittest.TestCase):
+
+    def test_iter_csv(self):
+        rows = [{'address': u'\xe9@email.com', 'digest': True,
+                 'created': 1462200000.123456, 'owner': ['a', 'b']},
+                {'address': 'b@email.com'}]
+        columns = ('address', 'digest', 'created', 'owner')
+        self.assertEqual(''.join(utils.iter_csv(rows, columns, 1)),
+                         'address,digest,created,owner\r\n'
+                         '\xc3\xa9@email.com,1,1462200000.123456,a b\r\n'
+                         'b@email.com,,,\r\n')
+        self.assertEqual(''.join(utils.iter_csv([], columns)),
+                         'address,digest,created,owner\r\n')
+
+
+class TestIterBodyLines(unittest.TestCase):
+
+    def test_iter_body_lines(self):
+        body = 'a@email.com\nb@email.com\nc@email.com'
+        environ = {'wsgi.input': StringIO(body + '\nignored'),
+                   'CONTENT_LENGTH': str(len(body))}
+        self.assertEqual(list(utils.iter_body_lines(environ, block_size=4)),
+                         ['a@email.com\n', 'b@email.com\n', 'c@email.com'])
+        environ = {'wsgi.input': StringIO(body + '\n')}
+        self.assertEqual(list(utils.iter_body_lines(environ)),
+                         ['a@email.com\n', 'b@email.com\n', 'c@email.com\n'])